@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import threading
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from .cache import LRUCache, SingleFlight
+from .invalidation import bus
+from .config import get_settings
+
+settings = get_settings()
+
+# Serialized dashboard responses keyed by the normalized filters. Each entry is
+# tagged with the generation it was computed at; written scan batches and QR code
+# changes bump the generation, so an entry is only served until the next write.
+
+
+def analytics_key(qr_id: Optional[int], location: Optional[str], location_id: Optional[int],
+                  start_date: Optional[datetime], end_date: Optional[datetime]) -> tuple:
+    # Location matches case-insensitively, so "Venue " and "venue" share an entry
+    location = location.strip().lower() if location and location.strip() else None
+    return (
+        qr_id or None,
+        location,
+        location_id,
+        start_date.isoformat() if start_date else None,
+        end_date.isoformat() if end_date else None,
+    )
+
+
+class AnalyticsCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.generation = 0
+        self.flights = SingleFlight()
+        self._async_flights: Dict[tuple, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        bus.publish("analytics")
+
+    def bump_generation(self):
+        with self._lock:
+            self.generation += 1
+
+    def on_scans_written(self, rows):
+        if rows:
+            self.invalidate()
+
+    def _lookup(self, key: tuple, generation: int) -> Optional[Tuple[str, str]]:
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == generation:
+            return entry[1], entry[2]
+        return None
+
+    def _store(self, key: tuple, generation: int, body: str) -> Tuple[str, str]:
+        etag = '"' + hashlib.blake2b(body.encode(), digest_size=16).hexdigest() + '"'
+        self.cache.set(key, (generation, body, etag))
+        return body, etag
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], str]) -> Tuple[str, str]:
+        # Returns (json body, etag). The generation is read before computing, so a
+        # write that lands mid-computation leaves the new entry already stale.
+        generation = self.generation
+        hit = self._lookup(key, generation)
+        if hit is not None:
+            return hit
+        return self.flights.do((generation, key), lambda: self._store(key, generation, compute()))
+
+    async def get_or_compute_async(self, key: tuple, compute: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+        generation = self.generation
+        hit = self._lookup(key, generation)
+        if hit is not None:
+            return hit
+        flight = (generation, key)
+        future = self._async_flights.get(flight)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._async_flights[flight] = asyncio.get_running_loop().create_future()
+        try:
+            result = self._store(key, generation, await compute())
+            future.set_result(result)
+            return result
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._async_flights.pop(flight, None)
+
+
+analytics_cache = AnalyticsCache(maxsize=settings.analytics_cache_size, ttl=settings.analytics_cache_ttl)
+bus.subscribe("analytics", lambda key: analytics_cache.bump_generation())
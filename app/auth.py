@@ -1,37 +1,99 @@
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from .database import get_db
 from .models import User
 from .config import get_settings
+from .cache import LRUCache
+from .invalidation import bus
+from .passwords import crypt_context, hasher
 
 settings = get_settings()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# In-process hashing, for the CLI and startup seeding; requests use the hasher pool
+pwd_context = crypt_context(settings.bcrypt_rounds)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
+# The fields request handlers need from the authenticated user
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    full_name: Optional[str]
+    is_admin: bool
+    is_active: bool
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user.id, user.email, user.full_name, bool(user.is_admin), bool(user.is_active), user.created_at)
+
+# Decoded principals keyed by token. Each entry records the user's version at
+# caching time; changing or deleting a user bumps the version in every worker,
+# which turns every cached token for that user into a miss.
+principal_cache = LRUCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl)
+_user_versions: Dict[int, int] = {}
+
+def invalidate_user(user_id: int):
+    bus.publish("user", str(user_id))
+
+def _bump_user_version(key: str):
+    user_id = int(key)
+    _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
+
+bus.subscribe("user", _bump_user_version)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def create_user_token(user: User) -> str:
+    # uid and adm let the auth path skip the email lookup
+    return create_access_token(data={"sub": user.email, "uid": user.id, "adm": bool(user.is_admin)})
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.access_token_expire_minutes))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+def _save_hash(db: Session, user: User, hashed_password: str):
+    user.hashed_password = hashed_password
+    db.commit()
+    db.refresh(user)
+
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
+    # Raises PasswordHasherBusy when the hash pool is saturated
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.email == email).first())
+    if not user:
+        return None
+    valid, new_hash = await hasher.verify(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        await run_in_threadpool(_save_hash, db, user, new_hash)
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    cached = principal_cache.get(token)
+    if cached is not None:
+        principal, version = cached
+        if version == _user_versions.get(principal.id, 0):
+            return principal
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -45,12 +107,22 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
+    # Tokens issued before the uid claim existed fall back to the email lookup
+    user_id = payload.get("uid")
+    if user_id:
+        user = db.get(User, user_id)
+    else:
+        user = db.query(User).filter(User.email == email).first()
+    if user is None or user.email != email or not user.is_active:
         raise credentials_exception
-    return user
+    
+    principal = Principal.from_user(user)
+    ttl = min(settings.auth_cache_ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        principal_cache.set(token, (principal, _user_versions.get(user.id, 0)), ttl=ttl)
+    return principal
 
-async def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_admin(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+# Thread-safe LRU bounded by entry count and, optionally, by total size and age
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: Optional[float] = None, max_bytes: Optional[int] = None,
+                 sizeof: Callable[[object], int] = len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires, _ = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._evict(key)
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+            expires = time.monotonic() + ttl if ttl else None
+            self._data[key] = (value, expires, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes):
+                self._evict(next(iter(self._data)))
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _evict(self, key: Hashable):
+        _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+# Coalesces concurrent calls: while one caller computes a key, others asking for the
+# same key block and share its result (or exception) instead of repeating the work
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+# Pluggable key/value backends for caches that may need to be shared between
+# worker processes. Values must be JSON-serializable so any shared store
+# (Redis, memcached, ...) can implement the same three methods.
+
+class CacheBackend:
+    # Whether calls do blocking I/O, so async callers run them in the threadpool
+    blocking = False
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        self.cache.set(key, value, ttl=ttl)
+
+    def delete(self, key: str):
+        self.cache.delete(key)
+
+
+# Local stand-in for a shared cache: a SQLite file in WAL mode that every worker
+# on the host opens, so invalidations are seen by all of them. Every
+# purge_every writes, expired rows are deleted and the namespace is cut back to
+# its newest maxsize rows (INSERT OR REPLACE gives a rewritten key a new rowid).
+class SqliteBackend(CacheBackend):
+    blocking = True
+
+    def __init__(self, path: str, namespace: str, maxsize: int, ttl: Optional[float] = None,
+                 purge_every: int = 1000):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._ops = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # A connection opened before a fork (gunicorn preload) stays with the
+        # parent; the child opens its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str):
+        row = self._conn().execute("SELECT value, expires FROM cache WHERE key = ?", (self._key(key),)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (self._key(key), json.dumps(value), expires),
+        )
+        self._ops += 1
+        if self._ops % self.purge_every == 0:
+            self.purge()
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (self._key(key),))
+
+    def purge(self):
+        # Keys in the namespace sort between "<namespace>:" and "<namespace>;"
+        bounds = (f"{self.namespace}:", f"{self.namespace};")
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE key >= ? AND key < ? AND expires <= ?", (*bounds, time.time()))
+        conn.execute(
+            "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE key >= ? AND key < ? "
+            "ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+            (*bounds, self.maxsize),
+        )
+
+
+def create_backend(namespace: str, maxsize: int, ttl: Optional[float] = None) -> CacheBackend:
+    from .config import get_settings
+    settings = get_settings()
+    if settings.cache_backend == "sqlite":
+        return SqliteBackend(settings.shared_cache_path, namespace, maxsize=maxsize, ttl=ttl)
+    return MemoryBackend(maxsize=maxsize, ttl=ttl)
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List
 import os
 
 class Settings(BaseSettings):
@@ -7,7 +8,146 @@ class Settings(BaseSettings):
     secret_key: str = os.getenv("SECRET_KEY", "your-super-secret-key-change-in-production")
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 1440
+    auth_cache_size: int = 10000
+    auth_cache_ttl: float = 300.0
     frontend_url: str = os.getenv("FRONTEND_URL", "http://localhost:5173")
+
+    # Connection pool. Keep db_pool_size + db_max_overflow at or above
+    # threadpool_size so sync routes don't queue on connections.
+    db_pool_size: int = 10
+    db_max_overflow: int = 30
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: int = 0
+    threadpool_size: int = 40
+    async_database: bool = False
+
+    # Schema setup and admin seed at startup. Workers serialize on a lock (a file
+    # lock, or an advisory lock on PostgreSQL) and skip work that's already done.
+    # Turn off when `python -m app.init_db migrate` runs as a release step.
+    init_db_on_startup: bool = True
+    init_db_lock_path: str = "cache/init_db.lock"
+
+    # Instrumentation: statements slower than slow_query_ms are logged (0 turns
+    # the log off); metrics_token, if set, is required as a bearer token on /metrics
+    slow_query_ms: float = 500.0
+    server_timing: bool = True
+    metrics_token: str = ""
+    # Multi-worker servers: each worker writes a snapshot of its metrics into
+    # metrics_dir and /metrics merges them. Empty reports this process only.
+    metrics_dir: str = ""
+    metrics_snapshot_interval: float = 5.0
+
+    # Scan ingestion pipeline
+    scan_queue_size: int = 10000
+    scan_batch_size: int = 500
+    scan_flush_interval: float = 1.0
+    scan_queue_put_timeout: float = 0.05
+
+    # Scan sketches: every scan (repeats included) is counted, and visitors per QR
+    # code and day go into a HyperLogLog of 2**sketch_precision registers
+    # (standard error about 1.04 / sqrt(2**precision), 1.6% at 12). Changing the
+    # precision needs `python -m app.sketches rebuild`.
+    sketch_precision: int = 12
+    sketch_flush_interval: float = 5.0
+
+    # scan_logs storage: monthly partitions (PostgreSQL) and how many months of raw
+    # scans to keep; 0 keeps everything. Rollups are never expired.
+    scan_log_partitioning: bool = False
+    scan_partition_months_ahead: int = 3
+    scan_retention_months: int = 0
+
+    # Token-bucket limits for the public endpoints, as "<n>/<second|minute|hour>"
+    # (bursts of n, refilled over the period). Route limits apply per client IP
+    # and QR code; "public" applies per IP across all of them. rate_limit_backend
+    # is "memory" (per process), "sqlite" (every check is a transaction on the
+    # shared file) or "synced" (per-process buckets reconciled with the shared
+    # file every rate_limit_sync_interval seconds).
+    rate_limit_enabled: bool = True
+    rate_limits: Dict[str, str] = {
+        "public": "600/minute",
+        "scan": "30/minute",
+        "contact": "5/minute",
+        "logo": "120/minute",
+        "vcard": "20/minute",
+    }
+    rate_limit_backend: str = "memory"
+    rate_limit_max_keys: int = 100000
+    rate_limit_sync_interval: float = 0.5
+    # Proxies (IPs or CIDRs) whose X-Forwarded-For is believed, e.g.
+    # '["10.0.0.0/8"]'. With none, the client is the connecting address.
+    trusted_proxies: List[str] = []
+
+    # Seen-IP dedup index
+    dedup_recent_size: int = 100000
+    dedup_bloom_capacity: int = 100000
+    dedup_bloom_error_rate: float = 0.01
+
+    # Shared caches: "memory" (per process) or "sqlite" (one file shared by
+    # every worker on the host)
+    cache_backend: str = "memory"
+    shared_cache_path: str = "cache/shared.db"
+
+    # Cross-worker invalidation of the in-memory caches: "memory" (this process
+    # only) or "sqlite" (an event log in shared_cache_path that every worker
+    # polls every invalidation_poll_interval seconds)
+    invalidation_backend: str = "memory"
+    invalidation_poll_interval: float = 0.25
+
+    # Dashboard analytics responses. Scan writes and QR code changes invalidate
+    # every worker's entries; the TTL is a backstop.
+    analytics_cache_size: int = 1000
+    analytics_cache_ttl: float = 5.0
+
+    # Time-series analytics: limits on one request's chart size
+    timeseries_max_buckets: int = 10000
+    timeseries_max_series: int = 100
+
+    # In-memory location catalog used by location search and filters
+    location_catalog_ttl: float = 60.0
+
+    # Landing-page cache
+    landing_cache_size: int = 50000
+    landing_cache_ttl: float = 300.0
+    landing_negative_ttl: float = 60.0
+
+    # Offline GeoIP: path to a .mmdb file or a range file built with
+    # `python -m app.geoip build`. Empty disables enrichment.
+    geoip_database: str = ""
+    geoip_cache_size: int = 100000
+
+    # User-agent classification cache
+    ua_cache_size: int = 20000
+
+    # Rendered QR image cache
+    qr_cache_dir: str = "cache/qr"
+    qr_cache_memory_bytes: int = 64 * 1024 * 1024
+    qr_cache_memory_items: int = 10000
+    qr_image_max_age: int = 30 * 24 * 3600
+    # Encoded QR matrices, shared by every style and size of the same content
+    qr_matrix_cache_size: int = 4096
+    # Share of the code's width covered by an embedded logo (at most ~0.3 with
+    # error correction H)
+    qr_logo_ratio: float = 0.22
+
+    # Uploaded logos: size limit, derivative widths, and the width served to
+    # landing pages that don't ask for one
+    logo_dir: str = "uploads/logos"
+    logo_max_bytes: int = 5 * 1024 * 1024
+    logo_widths: List[int] = [64, 256, 512]
+    logo_default_width: int = 512
+
+    # Bulk operations
+    bulk_max_rows: int = 10000
+    render_workers: int = 2
+
+    # Password hashing runs in its own process pool; hashes beyond
+    # password_max_pending (queued or running) are refused with a 503.
+    # Changing bcrypt_rounds rehashes each password at its next login.
+    bcrypt_rounds: int = 12
+    password_workers: int = 2
+    password_max_pending: int = 16
     
     class Config:
         env_file = ".env"
@@ -5,8 +5,29 @@ from .config import get_settings
 
 settings = get_settings()
 
-connect_args = {"check_same_thread": False} if settings.database_url.startswith("sqlite") else {}
-engine = create_engine(settings.database_url, connect_args=connect_args)
+def _is_memory_sqlite(url: str) -> bool:
+    return url.startswith("sqlite") and (url in ("sqlite://", "sqlite:///") or ":memory:" in url)
+
+def _pool_args(url: str) -> dict:
+    # In-memory SQLite uses a single-connection pool that takes no sizing options
+    if _is_memory_sqlite(url):
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+def _connect_args(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {"check_same_thread": False}
+    if url.startswith("postgresql") and settings.db_statement_timeout_ms:
+        return {"options": f"-c statement_timeout={settings.db_statement_timeout_ms}"}
+    return {}
+
+engine = create_engine(settings.database_url, connect_args=_connect_args(settings.database_url), **_pool_args(settings.database_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -16,3 +37,30 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Optional async engine (asyncpg / aiosqlite) used by the async scan and
+# analytics routes when ASYNC_DATABASE is enabled.
+async_engine = None
+AsyncSessionLocal = None
+
+def async_database_url(url: str) -> str:
+    for prefix, driver in (("postgresql://", "postgresql+asyncpg://"), ("postgres://", "postgresql+asyncpg://"),
+                           ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(prefix):
+            return driver + url[len(prefix):]
+    return url
+
+if settings.async_database:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    _async_url = async_database_url(settings.database_url)
+    _async_connect_args = {}
+    if _async_url.startswith("postgresql+asyncpg") and settings.db_statement_timeout_ms:
+        _async_connect_args = {"server_settings": {"statement_timeout": str(settings.db_statement_timeout_ms)}}
+    async_engine = create_async_engine(_async_url, connect_args=_async_connect_args, **_pool_args(_async_url))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, List, Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from .database import engine
+from .models import ScanLog
+from .config import get_settings
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def _key(qr_id: int, ip: str) -> bytes:
+    return f"{qr_id}|{ip}".encode()
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: bytes):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class ScalableBloomFilter:
+    # Adds a larger, tighter filter whenever the newest one fills up, so the
+    # overall false-positive rate stays bounded as the table grows.
+    def __init__(self, capacity: int, error_rate: float):
+        self.error_rate = error_rate
+        self.filters: List[BloomFilter] = [BloomFilter(capacity, error_rate / 2)]
+
+    def add(self, key: bytes):
+        current = self.filters[-1]
+        if current.count >= current.capacity:
+            current = BloomFilter(current.capacity * 2, self.error_rate / 2 ** (len(self.filters) + 1))
+            self.filters.append(current)
+        current.add(key)
+
+    def __contains__(self, key: bytes) -> bool:
+        return any(key in f for f in reversed(self.filters))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(f.bits) for f in self.filters)
+
+
+def scan_exists_statement(qr_id: int, ip: str):
+    return select(ScanLog.id).where(ScanLog.qr_code_id == qr_id, ScanLog.ip_address == ip).limit(1)
+
+
+def scan_exists(db: Session, qr_id: int, ip: str) -> bool:
+    return db.execute(scan_exists_statement(qr_id, ip)).first() is not None
+
+
+# Answers "has this IP scanned this QR code before" without a DB round trip.
+# Recently seen pairs are kept exactly in a bounded LRU. Everything ever written
+# is in a Bloom filter, so a negative answer is definitive once the filter has been
+# warmed; a positive answer that isn't in the LRU is confirmed against the
+# (qr_code_id, ip_address) unique index.
+class SeenIndex:
+    def __init__(self, recent_size: int, capacity: int, error_rate: float,
+                 lookup: Callable[[Session, int, str], bool] = scan_exists):
+        self.recent_size = recent_size
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = ScalableBloomFilter(capacity, error_rate)
+        self.lookup = lookup
+        self.ready = False
+        self.warmed_id = 0
+        self.stats = {"recent_hits": 0, "bloom_negatives": 0, "fallbacks": 0}
+        self._recent: "OrderedDict[bytes, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: bytes):
+        self._recent[key] = None
+        self._recent.move_to_end(key)
+        if len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    def _check(self, qr_id: int, ip: str) -> Optional[bool]:
+        # None means the in-memory structures can't decide and the DB must
+        key = _key(qr_id, ip)
+        with self._lock:
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                self.stats["recent_hits"] += 1
+                return True
+            if self.ready and key not in self.bloom:
+                self.stats["bloom_negatives"] += 1
+                return False
+            self.stats["fallbacks"] += 1
+        return None
+
+    def seen(self, qr_id: int, ip: str, db: Optional[Session]) -> bool:
+        found = self._check(qr_id, ip)
+        if found is None:
+            found = self.lookup(db, qr_id, ip)
+            if found:
+                self.mark(qr_id, ip)
+        return found
+
+    async def seen_async(self, qr_id: int, ip: str, db: "AsyncSession") -> bool:
+        found = self._check(qr_id, ip)
+        if found is None:
+            found = (await db.execute(scan_exists_statement(qr_id, ip))).first() is not None
+            if found:
+                self.mark(qr_id, ip)
+        return found
+
+    def mark(self, qr_id: int, ip: str):
+        key = _key(qr_id, ip)
+        with self._lock:
+            self.bloom.add(key)
+            self._remember(key)
+
+    def forget(self, qr_id: int, ip: str):
+        # Bloom bits can't be cleared; the pair just falls through to the exact check
+        with self._lock:
+            self._recent.pop(_key(qr_id, ip), None)
+
+    def forget_scans(self, rows: List[dict]):
+        # Scans that were marked but never written must be counted when they recur
+        for row in rows:
+            self.forget(row["qr_code_id"], row["ip_address"])
+
+    def warm(self, batch_size: int = 10000):
+        # Loads scans written since the last warm. Workers forked from a master
+        # that already warmed (gunicorn preload) only read what is newer, and
+        # answer from the database until they have.
+        after = self.warmed_id
+        self.ready = False
+        stmt = (select(ScanLog.id, ScanLog.qr_code_id, ScanLog.ip_address).where(ScanLog.id > after)
+                .execution_options(yield_per=batch_size))
+        loaded = 0
+        with engine.connect() as conn:
+            # Size the first filter for the existing table plus headroom so lookups
+            # don't have to probe a long chain of grown filters
+            existing = 0 if after else conn.execute(select(func.count(ScanLog.id))).scalar() or 0
+            if existing * 2 > self.capacity:
+                with self._lock:
+                    self.bloom.filters.append(BloomFilter(existing * 2, self.error_rate / 4))
+            for partition in conn.execute(stmt).partitions():
+                keys = [_key(qr_id, ip) for _, qr_id, ip in partition]
+                with self._lock:
+                    for key in keys:
+                        self.bloom.add(key)
+                after = max(after, max(row[0] for row in partition))
+                loaded += len(keys)
+        self.warmed_id = after
+        self.ready = True
+        logger.info("Seen-IP index warmed with %d scans (%d bytes)", loaded, self.bloom.nbytes)
+
+    def warm_in_background(self):
+        def run():
+            try:
+                self.warm()
+            except Exception:
+                logger.exception("Failed to warm seen-IP index; using exact lookups")
+        threading.Thread(target=run, name="seen-index-warm", daemon=True).start()
+
+
+seen_index = SeenIndex(
+    recent_size=settings.dedup_recent_size,
+    capacity=settings.dedup_bloom_capacity,
+    error_rate=settings.dedup_bloom_error_rate,
+)
@@ -0,0 +1,221 @@
+import argparse
+import os
+import re
+import zlib
+import zipfile
+from typing import Iterable, Iterator, List, Optional, Tuple
+from .qr_images import (
+    MIN_CONTRAST, PLAIN, SVG_MODULES, Style, contrast, image_cache, make_style, render, render_image, scan_url,
+)
+from .workers import imap_bounded
+
+# Batch artwork export. Images are rendered across the worker pool and written
+# out as they arrive, so only a bounded window of images is in memory at a time.
+# Each code carries its own style, since branded codes embed their own logo.
+
+Job = Tuple[str, str, int, int, str, Style]
+
+
+class _StreamBuffer:
+    # Write-only file object for zipfile; chunks are drained after each entry
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _slug(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "-", value or "").strip("-")[:60] or "qr"
+
+
+def _render_job(args: Job) -> bytes:
+    return render(*args)
+
+
+def _cached_or_render(jobs: List[Job]) -> Iterator[bytes]:
+    # Only the positions of misses are kept up front; hits are read one at a
+    # time as they are written, and misses come back from the pool in order
+    misses = [i for i, job in enumerate(jobs) if not image_cache.contains(*job)]
+    rendered = imap_bounded(_render_job, (jobs[i] for i in misses))
+    pending = iter(misses)
+    next_miss = next(pending, None)
+    for i, job in enumerate(jobs):
+        if i == next_miss:
+            content = next(rendered)
+            image_cache.store(content, *job)
+            next_miss = next(pending, None)
+        else:
+            # Evicted since the first pass
+            content = image_cache.peek(*job)
+            if content is None:
+                content = render(*job)
+                image_cache.store(content, *job)
+        yield content
+
+
+def _jobs(qrs: List[Tuple[int, str, str, Style]], fmt: str, box_size: int, border: int, ec: str) -> List[Job]:
+    return [(scan_url(qr_id), fmt, box_size, border, ec, style) for qr_id, _, _, style in qrs]
+
+
+def stream_zip(qrs: Iterable[Tuple[int, str, str, Style]], fmt: str = "png", box_size: int = 10,
+               border: int = 4, ec: str = "M") -> Iterator[bytes]:
+    qrs = list(qrs)
+    jobs = _jobs(qrs, fmt, box_size, border, ec)
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        for (qr_id, name, location, _), content in zip(qrs, _cached_or_render(jobs)):
+            zf.writestr(f"{qr_id}-{_slug(name)}-{_slug(location)}.{fmt}", content)
+            yield buf.drain()
+    yield buf.drain()
+
+
+# Multi-page print sheet: one code per A4 page with its name and location.
+# Pages are emitted as they are rendered; only object offsets are kept for the
+# cross-reference table at the end.
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+IMAGE_SIZE = 420
+
+
+def _page_job(args: Tuple[str, int, int, str, Style]) -> Tuple[int, int, bytes, bytes]:
+    # Plain codes are embedded as 1-bit images; branded ones need full colour
+    img = render_image(*args)
+    if args[-1] == PLAIN:
+        img = img.convert("1")
+        return img.width, img.height, b"/ColorSpace /DeviceGray /BitsPerComponent 1", zlib.compress(img.tobytes())
+    img = img.convert("RGB")
+    return img.width, img.height, b"/ColorSpace /DeviceRGB /BitsPerComponent 8", zlib.compress(img.tobytes())
+
+
+def _pdf_text(value: str) -> bytes:
+    value = (value or "").replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return value.encode("latin-1", "replace")
+
+
+class _PdfWriter:
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+
+    def emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+    def obj(self, number: int, body: bytes, stream: bytes = None) -> bytes:
+        self.offsets[number] = self.offset
+        data = b"%d 0 obj\n" % number + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return self.emit(data + b"\nendobj\n")
+
+
+def stream_pdf(qrs: Iterable[Tuple[int, str, str, Style]], box_size: int = 10, border: int = 4,
+               ec: str = "M") -> Iterator[bytes]:
+    qrs = list(qrs)
+    pdf = _PdfWriter()
+    yield pdf.emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    # 1 = catalog, 2 = pages, 3 = font; each page uses three objects from 4 on
+    yield pdf.obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_refs = []
+    jobs = ((scan_url(qr_id), box_size, border, ec, style) for qr_id, _, _, style in qrs)
+    for i, ((qr_id, name, location, _), (width, height, color, pixels)) in enumerate(zip(qrs, imap_bounded(_page_job, jobs))):
+        page, image, content = 4 + i * 3, 5 + i * 3, 6 + i * 3
+        page_refs.append(page)
+        yield pdf.obj(image, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d %s "
+                             b"/Filter /FlateDecode /Length %d >>" % (width, height, color, len(pixels)), pixels)
+        x = (PAGE_WIDTH - IMAGE_SIZE) // 2
+        y = (PAGE_HEIGHT - IMAGE_SIZE) // 2
+        ops = (
+            b"q %d 0 0 %d %d %d cm /Im0 Do Q\n" % (IMAGE_SIZE, IMAGE_SIZE, x, y)
+            + b"BT /F1 20 Tf %d %d Td (" % (x, y + IMAGE_SIZE + 50) + _pdf_text(name) + b") Tj ET\n"
+            + b"BT /F1 14 Tf %d %d Td (" % (x, y + IMAGE_SIZE + 25) + _pdf_text(location) + b") Tj ET\n"
+            + b"BT /F1 10 Tf %d %d Td (" % (x, y - 20) + _pdf_text(f"#{qr_id}  {scan_url(qr_id)}") + b") Tj ET\n"
+        )
+        yield pdf.obj(content, b"<< /Length %d >>" % len(ops), ops)
+        yield pdf.obj(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R "
+                            b"/Resources << /Font << /F1 3 0 R >> /XObject << /Im0 %d 0 R >> >> >>"
+                            % (PAGE_WIDTH, PAGE_HEIGHT, content, image))
+    kids = b" ".join(b"%d 0 R" % ref for ref in page_refs)
+    yield pdf.obj(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_refs))
+    yield pdf.obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    size = max(pdf.offsets) + 1
+    xref = pdf.offset
+    table = b"xref\n0 %d\n0000000000 65535 f \n" % size
+    table += b"".join(b"%010d 00000 n \n" % pdf.offsets[n] for n in range(1, size))
+    yield pdf.emit(table + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref))
+
+
+EXPORT_MEDIA_TYPES = {"zip": "application/zip", "pdf": "application/pdf"}
+
+
+def render_files(out: str, qrs: Iterable[Tuple[int, str, str, Style]], fmt: str = "png", box_size: int = 10,
+                 border: int = 4, ec: str = "M") -> int:
+    # Writes each code's artwork into a directory, warming the image cache on the way
+    qrs = list(qrs)
+    os.makedirs(out, exist_ok=True)
+    for (qr_id, name, location, _), content in zip(qrs, _cached_or_render(_jobs(qrs, fmt, box_size, border, ec))):
+        with open(os.path.join(out, f"{qr_id}-{_slug(name)}-{_slug(location)}.{fmt}"), "wb") as f:
+            f.write(content)
+    return len(qrs)
+
+
+def _select(ids: Optional[List[int]], location: Optional[str], style: Style, with_logo: bool):
+    from sqlalchemy import select
+    from .database import engine
+    from .locations import location_catalog
+    from .models import QRCode
+
+    stmt = select(QRCode.id, QRCode.name, QRCode.location, QRCode.logo_path).order_by(QRCode.id)
+    if ids:
+        stmt = stmt.where(QRCode.id.in_(ids))
+    if location:
+        stmt = stmt.where(QRCode.location_id.in_(location_catalog.match_ids(location)))
+    with engine.connect() as conn:
+        return [(qr_id, name, loc, style._replace(logo=make_style(logo_path=logo_path).logo if with_logo else None))
+                for qr_id, name, loc, logo_path in conn.execute(stmt)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render QR artwork in bulk")
+    sub = parser.add_subparsers(dest="command", required=True)
+    render_cmd = sub.add_parser("render", help="Render codes into a directory across the worker pool")
+    render_cmd.add_argument("--out", required=True)
+    render_cmd.add_argument("--ids", type=int, nargs="*", help="Only these QR codes")
+    render_cmd.add_argument("--location", help="Only codes whose location contains this text")
+    render_cmd.add_argument("--format", choices=["png", "svg"], default="png")
+    render_cmd.add_argument("--box-size", type=int, default=10)
+    render_cmd.add_argument("--border", type=int, default=4)
+    render_cmd.add_argument("--ec", choices=["L", "M", "Q", "H"], default="M")
+    render_cmd.add_argument("--fill", default="#000000")
+    render_cmd.add_argument("--back", default="#ffffff")
+    render_cmd.add_argument("--module", choices=["square", "rounded", "circle", "gapped"], default="square")
+    render_cmd.add_argument("--no-logo", action="store_true", help="Leave uploaded logos out")
+    args = parser.parse_args()
+
+    if args.command == "render":
+        from . import workers
+        if args.format == "svg" and args.module not in SVG_MODULES:
+            parser.error(f"--module {args.module} is only available for PNG")
+        if contrast(args.fill, args.back) < MIN_CONTRAST:
+            parser.error("--fill and --back don't have enough contrast to scan")
+        style = make_style(args.fill, args.back, args.module)
+        qrs = _select(args.ids, args.location, style, not args.no_logo)
+        try:
+            count = render_files(args.out, qrs, args.format, args.box_size, args.border, args.ec)
+        finally:
+            workers.shutdown()
+        print(f"Rendered {count} codes into {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import csv
+import ipaddress
+import logging
+import mmap
+import struct
+import sys
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+from sqlalchemy import bindparam, select, update
+from .cache import LRUCache
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Offline IP -> (country, city) lookups from a local file, never the network.
+#
+# The native format is a compact sorted-range file, memory-mapped read-only:
+#
+#   header   magic "QRGEO\x01\x00\x00", u32 record count
+#   starts   u32[n]  first IPv4 address of each range, ascending
+#   ends     u32[n]  last IPv4 address of each range
+#   country  u32[n]  offset of the country string in the string table
+#   city     u32[n]  offset of the city string in the string table
+#   strings  u8 length + UTF-8 bytes, each distinct value stored once
+#
+# All integers are little-endian. The arrays are viewed in place through
+# memoryview casts, so a lookup is a C-level bisect with no parsing or copying.
+# MaxMind .mmdb files are used instead when the optional maxminddb package is
+# installed.
+
+MAGIC = b"QRGEO\x01\x00\x00"
+HEADER = struct.Struct("<8sI")
+
+GeoResult = Tuple[Optional[str], Optional[str]]
+
+
+class RangeDatabase:
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("Range GeoIP files require a little-endian host")
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a GeoIP range file")
+        view = memoryview(self.mm)
+        size = 4 * count
+        base = HEADER.size
+        self.starts = view[base:base + size].cast("I")
+        self.ends = view[base + size:base + 2 * size].cast("I")
+        self.countries = view[base + 2 * size:base + 3 * size].cast("I")
+        self.cities = view[base + 3 * size:base + 4 * size].cast("I")
+        self.strings_offset = base + 4 * size
+        self._strings = {}
+
+    def _string(self, offset: int) -> Optional[str]:
+        # Distinct strings are few (countries, cities), so decode each once
+        value = self._strings.get(offset)
+        if value is None:
+            start = self.strings_offset + offset
+            length = self.mm[start]
+            value = self.mm[start + 1:start + 1 + length].decode()
+            self._strings[offset] = value
+        return value or None
+
+    def lookup(self, ip: str) -> GeoResult:
+        try:
+            address = ipaddress.IPv4Address(ip)
+        except ValueError:
+            return None, None
+        n = int(address)
+        i = bisect_right(self.starts, n) - 1
+        if i < 0 or n > self.ends[i]:
+            return None, None
+        return self._string(self.countries[i]), self._string(self.cities[i])
+
+
+class MaxMindDatabase:
+    def __init__(self, path: str):
+        import maxminddb
+        self.reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+    def lookup(self, ip: str) -> GeoResult:
+        try:
+            record = self.reader.get(ip)
+        except ValueError:
+            return None, None
+        if not record:
+            return None, None
+        country = (record.get("country") or {}).get("iso_code")
+        city = ((record.get("city") or {}).get("names") or {}).get("en")
+        return country, city
+
+
+class GeoIP:
+    def __init__(self, path: str, cache_size: int):
+        self.path = path
+        self.cache = LRUCache(maxsize=cache_size)
+        self._db = None
+        self._failed = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and not self._failed
+
+    def _database(self):
+        if self._db is None and self.enabled:
+            try:
+                self._db = MaxMindDatabase(self.path) if self.path.endswith(".mmdb") else RangeDatabase(self.path)
+            except Exception:
+                self._failed = True
+                logger.exception("GeoIP database %s could not be opened; enrichment disabled", self.path)
+        return self._db
+
+    def lookup(self, ip: Optional[str]) -> GeoResult:
+        if not ip:
+            return None, None
+        cached = self.cache.get(ip)
+        if cached is not None:
+            return cached
+        db = self._database()
+        result = db.lookup(ip.strip()) if db else (None, None)
+        self.cache.set(ip, result)
+        return result
+
+    def enrich(self, rows: List[dict]) -> List[dict]:
+        # Scan pipeline stage: runs on the writer thread, off the request path
+        if not self.enabled:
+            return rows
+        for row in rows:
+            if not row.get("country"):
+                row["country"], row["city"] = self.lookup(row.get("ip_address"))
+        return rows
+
+
+geoip = GeoIP(settings.geoip_database, settings.geoip_cache_size)
+
+
+def build(source: str, target: str, columns: Tuple[int, int, int, int] = (0, 1, 2, 3), skip_header: bool = False) -> int:
+    # Builds a range file from a CSV of IPv4 ranges (e.g. DB-IP or IP2Location
+    # lite exports). Ranges must not overlap; IPv6 rows are skipped.
+    start_col, end_col, country_col, city_col = columns
+    ranges = []
+    with open(source, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        if skip_header:
+            next(reader, None)
+        for row in reader:
+            try:
+                start, end = (_ipv4_int(row[start_col]), _ipv4_int(row[end_col]))
+            except ValueError:
+                continue
+            ranges.append((start, end, row[country_col].strip(), row[city_col].strip()))
+    ranges.sort()
+
+    strings, table = {}, bytearray()
+    def offset(value: str) -> int:
+        if value not in strings:
+            encoded = value.encode()[:255]
+            strings[value] = len(table)
+            table.append(len(encoded))
+            table.extend(encoded)
+        return strings[value]
+
+    countries = [offset(country) for _, _, country, _ in ranges]
+    cities = [offset(city) for _, _, _, city in ranges]
+    pack = lambda values: struct.pack(f"<{len(values)}I", *values)
+    with open(target, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(ranges)))
+        f.write(pack([r[0] for r in ranges]))
+        f.write(pack([r[1] for r in ranges]))
+        f.write(pack(countries))
+        f.write(pack(cities))
+        f.write(table)
+    return len(ranges)
+
+
+def _ipv4_int(value: str) -> int:
+    value = value.strip()
+    return int(value) if value.isdigit() else int(ipaddress.IPv4Address(value))
+
+
+def backfill(batch_size: int = 5000) -> int:
+    from .database import engine
+    from .models import ScanLog
+
+    if not geoip.enabled:
+        raise SystemExit("Set GEOIP_DATABASE to a .mmdb or range file first")
+    stmt = update(ScanLog).where(ScanLog.id == bindparam("scan_id")).values(
+        country=bindparam("geo_country"), city=bindparam("geo_city")
+    )
+    updated, last_id = 0, 0
+    while True:
+        query = select(ScanLog.id, ScanLog.ip_address).where(
+            ScanLog.id > last_id, ScanLog.country.is_(None), ScanLog.ip_address.isnot(None)
+        ).order_by(ScanLog.id).limit(batch_size)
+        with engine.begin() as conn:
+            rows = conn.execute(query).all()
+            if not rows:
+                return updated
+            values = []
+            for scan_id, ip in rows:
+                country, city = geoip.lookup(ip)
+                if country:
+                    values.append({"scan_id": scan_id, "geo_country": country, "geo_city": city})
+            if values:
+                conn.execute(stmt, values)
+        updated += len(values)
+        last_id = rows[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline GeoIP enrichment")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Build a range file from a CSV of IPv4 ranges")
+    build_cmd.add_argument("source")
+    build_cmd.add_argument("target")
+    build_cmd.add_argument("--columns", default="0,1,2,3",
+                           help="Column indexes of start,end,country,city (DB-IP city lite: 0,1,3,5)")
+    build_cmd.add_argument("--skip-header", action="store_true")
+    sub.add_parser("backfill", help="Fill country/city on scan_logs rows that have none")
+    lookup_cmd = sub.add_parser("lookup", help="Resolve one address")
+    lookup_cmd.add_argument("ip")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        columns = tuple(int(c) for c in args.columns.split(","))
+        print(f"Wrote {build(args.source, args.target, columns, args.skip_header)} ranges to {args.target}")
+    elif args.command == "backfill":
+        print(f"Enriched {backfill()} scans")
+    elif args.command == "lookup":
+        print(geoip.lookup(args.ip))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,125 @@
+import argparse
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+from sqlalchemy import delete, func, inspect, select, text, update
 from .database import engine, Base, SessionLocal
-from .models import User
+from .models import ContactSubmission, ScanLog, User
 from .auth import get_password_hash
+from .config import get_settings
+from . import locations, partitions, rollups, sketches
 
-def init_database():
-    Base.metadata.create_all(bind=engine)
-    
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_lock, shared by every process running init
+ADVISORY_LOCK_KEY = 0x5152_494E
+
+def ensure_columns():
+    # create_all doesn't add new columns to tables that already exist. Columns are
+    # added as plain nullable columns; their indexes come from ensure_indexes.
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+            logger.info("Added column %s.%s", table.name, column.name)
+
+def remove_duplicate_scans() -> int:
+    # Databases from before ux_scan_logs_qr_ip can hold several scans per
+    # (QR code, IP). Keeps the first one and points contacts at it.
+    keep = (
+        select(ScanLog.qr_code_id, ScanLog.ip_address, func.min(ScanLog.id).label("keep_id"))
+        .group_by(ScanLog.qr_code_id, ScanLog.ip_address).having(func.count(ScanLog.id) > 1).subquery()
+    )
+    duplicate = ScanLog.__table__.alias("duplicate")
+    pairs = (
+        select(duplicate.c.id, keep.c.keep_id)
+        .join(keep, (duplicate.c.qr_code_id == keep.c.qr_code_id) & (duplicate.c.ip_address == keep.c.ip_address))
+        .where(duplicate.c.id != keep.c.keep_id)
+    )
+    with engine.begin() as conn:
+        mapping = dict(conn.execute(pairs).all())
+        if not mapping:
+            return 0
+        ids = list(mapping)
+        for start in range(0, len(ids), 1000):
+            chunk = ids[start:start + 1000]
+            for contact_id, scan_id in conn.execute(
+                select(ContactSubmission.id, ContactSubmission.scan_id).where(ContactSubmission.scan_id.in_(chunk))
+            ).all():
+                conn.execute(update(ContactSubmission).where(ContactSubmission.id == contact_id)
+                             .values(scan_id=mapping[scan_id]))
+            conn.execute(delete(ScanLog).where(ScanLog.id.in_(chunk)))
+    logger.warning("Removed %d duplicate scans before creating ux_scan_logs_qr_ip", len(ids))
+    # Rollups counted the duplicates
+    rollups.rebuild()
+    return len(ids)
+
+def ensure_indexes():
+    # create_all doesn't add new indexes to tables that already exist. Unique
+    # indexes back ON CONFLICT writes, so failing to create one stops startup.
+    skipped = partitions.skipped_indexes()
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in skipped or index.name in existing:
+                continue
+            if index.name == "ux_scan_logs_qr_ip":
+                remove_duplicate_scans()
+            try:
+                index.create(bind=engine)
+            except Exception:
+                if index.unique:
+                    raise
+                logger.exception("Could not create index %s", index.name)
+
+def schema_is_current() -> bool:
+    # One inspector pass: every model table, column and index already exists
+    inspector = inspect(engine)
+    skipped = partitions.skipped_indexes()
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            return False
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        if any(column.name not in columns for column in table.columns):
+            return False
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        if any(index.name not in indexes and index.name not in skipped for index in table.indexes):
+            return False
+    return True
+
+def migrate():
+    # Repeat boots find everything in place and only pay for the inspection
+    current = schema_is_current()
+    if not current:
+        Base.metadata.create_all(bind=engine)
+    if settings.scan_log_partitioning:
+        partitions.init_partitioning()
+    if not current:
+        ensure_columns()
+        ensure_indexes()
+    if rollups.needs_backfill():
+        print(f"Backfilled scan rollups: {rollups.rebuild()} rows")
+    if sketches.needs_backfill():
+        print(f"Backfilled scan sketches: {sketches.rebuild()} rows")
+    if locations.needs_backfill():
+        print(f"Linked QR codes to locations: {locations.backfill()}")
+
+def seed_admin():
     db = SessionLocal()
     try:
         # Check if admin exists
-        admin = db.query(User).filter(User.email == "admin@gmail.com").first()
+        admin = db.query(User.id).filter(User.email == "admin@gmail.com").first()
         if not admin:
             admin = User(
                 email="admin@gmail.com",
@@ -23,5 +134,49 @@ def init_database():
     finally:
         db.close()
 
+def init_database():
+    migrate()
+    seed_admin()
+
+@contextmanager
+def init_lock():
+    # Keeps workers that boot together from running DDL concurrently
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        return
+    os.makedirs(os.path.dirname(settings.init_db_lock_path) or ".", exist_ok=True)
+    with open(settings.init_db_lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def init_on_startup():
+    start = time.perf_counter()
+    with init_lock():
+        init_database()
+    logger.info("Database init finished in %.0f ms", (time.perf_counter() - start) * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or update the schema and seed data")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("migrate", help="Create missing tables, columns and indexes and run backfills")
+    sub.add_parser("seed", help="Create the admin user if it doesn't exist")
+    args = parser.parse_args()
+
+    with init_lock():
+        if args.command == "migrate":
+            migrate()
+        elif args.command == "seed":
+            seed_admin()
+        else:
+            init_database()
+
 if __name__ == "__main__":
-    init_database()
+    main()
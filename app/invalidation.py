@@ -0,0 +1,117 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Cross-worker cache invalidation. Caches stay in each worker's memory, so a
+# request never leaves the process to read one; what has to reach every worker
+# is the news that an entry changed. publish() runs this process's handlers
+# straight away and, with INVALIDATION_BACKEND=sqlite, appends the event to a
+# log in the shared cache file. Every worker polls the log and runs its handlers
+# for the other workers' events, so a change is seen everywhere within one poll
+# interval. Only writes (QR code edits, scan batches, user changes) touch the
+# file, and polling is a read that takes no lock.
+
+
+class InvalidationBus:
+    def __init__(self, path: Optional[str], poll_interval: float, retention: float = 300.0,
+                 purge_every: int = 1000):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.purge_every = purge_every
+        self.handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self.stats = {"published": 0, "received": 0}
+        self._last_seq = 0
+        self._polls = 0
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn().execute(
+                "CREATE TABLE IF NOT EXISTS invalidations "
+                "(seq INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER, channel TEXT, key TEXT, at REAL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        # A connection opened before a fork (gunicorn preload) stays with the
+        # parent; the child opens its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def subscribe(self, channel: str, fn: Callable[[str], None]):
+        self.handlers.setdefault(channel, []).append(fn)
+
+    def _dispatch(self, channel: str, key: str):
+        for fn in self.handlers.get(channel, ()):
+            try:
+                fn(key)
+            except Exception:
+                logger.exception("Invalidation handler %r failed", fn)
+
+    def publish(self, channel: str, key: str = ""):
+        self._dispatch(channel, key)
+        if not self.path:
+            return
+        try:
+            self._conn().execute("INSERT INTO invalidations (pid, channel, key, at) VALUES (?, ?, ?, ?)",
+                                 (os.getpid(), channel, key, time.time()))
+            self.stats["published"] += 1
+        except sqlite3.Error:
+            # Other workers fall back on their cache TTLs
+            logger.exception("Failed to publish %s invalidation", channel)
+
+    def poll(self):
+        rows = self._conn().execute(
+            "SELECT seq, pid, channel, key FROM invalidations WHERE seq > ? ORDER BY seq", (self._last_seq,)
+        ).fetchall()
+        pid = os.getpid()
+        for seq, source, channel, key in rows:
+            if source != pid:
+                self._dispatch(channel, key)
+                self.stats["received"] += 1
+            self._last_seq = seq
+        self._polls += 1
+        if self._polls % self.purge_every == 0:
+            self._conn().execute("DELETE FROM invalidations WHERE at < ?", (time.time() - self.retention,))
+
+    def start(self):
+        if not self.path:
+            return
+        # Earlier events are about entries this worker hasn't cached yet
+        self._last_seq = self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM invalidations").fetchone()[0]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="invalidation-poll", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except sqlite3.Error:
+                logger.exception("Failed to poll invalidations")
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(5)
+        self._thread = None
+
+
+bus = InvalidationBus(
+    settings.shared_cache_path if settings.invalidation_backend == "sqlite" else None,
+    poll_interval=settings.invalidation_poll_interval,
+)
@@ -0,0 +1,82 @@
+from typing import TYPE_CHECKING, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .cache import create_backend
+from .invalidation import bus
+from .models import QRCode
+from .config import get_settings
+from .logos import digest_from_path
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+settings = get_settings()
+
+# Read-through cache of what the public scan endpoints need from a QR code.
+# Unknown ids are cached too (briefly) so scrapers probing random ids don't
+# reach the database. Entries are dropped whenever a code is created, edited,
+# gets a new logo or is deleted.
+landing_cache = create_backend("landing", maxsize=settings.landing_cache_size, ttl=settings.landing_cache_ttl)
+
+_MISSING = {"missing": True}
+
+
+def _logo_url(logo_path: Optional[str]) -> Optional[str]:
+    # Content-addressed URL that can be cached forever; legacy logos go through
+    # the per-QR route
+    digest = digest_from_path(logo_path)
+    return f"/api/scan/logos/{digest}" if digest else None
+
+
+def _entry(qr: Optional[QRCode]) -> dict:
+    if qr is None:
+        return _MISSING
+    return {
+        "payload": {
+            "id": qr.id,
+            "name": qr.name,
+            "location": qr.location,
+            "company_name": qr.company_name,
+            "phone_number": qr.phone_number,
+            "description": qr.description,
+            "logo_path": qr.logo_path,
+            "logo_url": _logo_url(qr.logo_path),
+        },
+        "is_active": bool(qr.is_active),
+        "logo_path": qr.logo_path,
+    }
+
+
+def _store(qr_id: int, entry: dict) -> Optional[dict]:
+    ttl = settings.landing_negative_ttl if entry is _MISSING else None
+    landing_cache.set(str(qr_id), entry, ttl=ttl)
+    return None if entry is _MISSING else entry
+
+
+def get_landing(db: Session, qr_id: int) -> Optional[dict]:
+    entry = landing_cache.get(str(qr_id))
+    if entry is not None:
+        return None if entry.get("missing") else entry
+    return _store(qr_id, _entry(db.get(QRCode, qr_id)))
+
+
+async def get_landing_async(db: "AsyncSession", qr_id: int) -> Optional[dict]:
+    if landing_cache.blocking:
+        entry = await run_in_threadpool(landing_cache.get, str(qr_id))
+    else:
+        entry = landing_cache.get(str(qr_id))
+    if entry is not None:
+        return None if entry.get("missing") else entry
+    result = await db.execute(select(QRCode).where(QRCode.id == qr_id))
+    entry = _entry(result.scalars().first())
+    if landing_cache.blocking:
+        return await run_in_threadpool(_store, qr_id, entry)
+    return _store(qr_id, entry)
+
+
+def invalidate_landing(qr_id: int):
+    bus.publish("landing", str(qr_id))
+
+
+bus.subscribe("landing", landing_cache.delete)
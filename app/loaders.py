@@ -0,0 +1,50 @@
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+from fastapi import Depends
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import get_db
+from .models import QRCode, ScanRollup
+
+# Request-scoped batch loaders: callers hand over every id they need and each
+# loader resolves all uncached ids with a single IN (...) query.
+
+class Loader:
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Dict[Hashable, object]], default=None):
+        self.batch_fn = batch_fn
+        self.default = default
+        self.cache: Dict[Hashable, object] = {}
+
+    def load_many(self, keys: Iterable[Hashable]) -> List[object]:
+        keys = list(keys)
+        missing = list({k for k in keys if k not in self.cache})
+        if missing:
+            found = self.batch_fn(missing)
+            for k in missing:
+                self.cache[k] = found.get(k, self.default)
+        return [self.cache[k] for k in keys]
+
+    def load(self, key: Hashable) -> Optional[object]:
+        return self.load_many([key])[0]
+
+    def prime(self, key: Hashable, value: object):
+        self.cache[key] = value
+
+
+class Loaders:
+    def __init__(self, db: Session):
+        self.db = db
+        self.qr_codes = Loader(self._qr_codes)
+        self.scan_counts = Loader(self._scan_counts, default=0)
+
+    def _qr_codes(self, ids):
+        return {qr.id: qr for qr in self.db.query(QRCode).filter(QRCode.id.in_(ids))}
+
+    def _scan_counts(self, ids):
+        rows = self.db.query(ScanRollup.qr_code_id, func.sum(ScanRollup.count)).filter(
+            ScanRollup.qr_code_id.in_(ids)
+        ).group_by(ScanRollup.qr_code_id)
+        return {qr_id: int(count) for qr_id, count in rows}
+
+
+def get_loaders(db: Session = Depends(get_db)) -> Loaders:
+    return Loaders(db)
@@ -0,0 +1,217 @@
+import argparse
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .database import engine
+from .models import Location, QRCode
+from .config import get_settings
+from .invalidation import bus
+
+settings = get_settings()
+
+# Normalized locations referenced by QRCode.location_id, plus an in-memory
+# catalog of the locations in use. The catalog answers prefix searches with a
+# bisect over the sorted keys and substring searches through a trigram index,
+# so neither the dashboard filter nor the location picker scans qr_codes.
+
+
+def normalize(name: Optional[str]) -> str:
+    return " ".join((name or "").split()).casefold()
+
+
+def _trigrams(key: str) -> set:
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+def ensure_locations(conn, names: Iterable[str]) -> Dict[str, int]:
+    # Maps each name's key to a location id, inserting any that don't exist yet.
+    # Safe against concurrent inserts of the same key.
+    wanted = {}
+    for name in names:
+        key = normalize(name)
+        if key:
+            wanted.setdefault(key, " ".join(name.split()))
+    if not wanted:
+        return {}
+    stmt = select(Location.key, Location.id).where(Location.key.in_(wanted))
+    found = dict(conn.execute(stmt).all())
+    missing = [{"key": key, "name": name} for key, name in wanted.items() if key not in found]
+    if missing:
+        # Works with a Connection or a Session
+        dialect = (getattr(conn, "dialect", None) or conn.get_bind().dialect).name
+        if dialect == "postgresql":
+            conn.execute(pg_insert(Location).on_conflict_do_nothing(index_elements=["key"]), missing)
+        elif dialect == "sqlite":
+            conn.execute(sqlite_insert(Location).on_conflict_do_nothing(index_elements=["key"]), missing)
+        else:
+            conn.execute(insert(Location), missing)
+        found = dict(conn.execute(stmt).all())
+    return found
+
+
+def location_id_for(conn, name: Optional[str]) -> Optional[int]:
+    return ensure_locations(conn, [name] if name else []).get(normalize(name))
+
+
+class LocationEntry(NamedTuple):
+    id: int
+    name: str
+    key: str
+
+
+class _Snapshot:
+    def __init__(self, entries: List[LocationEntry], version: int):
+        self.entries = sorted(entries, key=lambda e: e.key)
+        self.keys = [e.key for e in self.entries]
+        self.by_name = sorted(self.entries, key=lambda e: e.name.casefold())
+        self.trigrams: Dict[str, List[int]] = {}
+        for pos, entry in enumerate(self.entries):
+            for gram in _trigrams(entry.key):
+                self.trigrams.setdefault(gram, []).append(pos)
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+
+class LocationCatalog:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._snapshot: Optional[_Snapshot] = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        bus.publish("locations")
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+
+    def _load(self, version: int) -> _Snapshot:
+        in_use = select(QRCode.location_id).where(QRCode.location_id.is_not(None))
+        stmt = select(Location.id, Location.name, Location.key).where(Location.id.in_(in_use))
+        with engine.connect() as conn:
+            return _Snapshot([LocationEntry(*row) for row in conn.execute(stmt)], version)
+
+    def snapshot(self) -> _Snapshot:
+        snap = self._snapshot
+        if snap is not None and snap.version == self._version and time.monotonic() - snap.loaded_at < self.ttl:
+            return snap
+        with self._lock:
+            version = self._version
+            snap = self._snapshot
+            if snap is None or snap.version != version or time.monotonic() - snap.loaded_at >= self.ttl:
+                snap = self._load(version)
+                # An invalidation during the load leaves this snapshot already stale
+                self._snapshot = snap
+        return snap
+
+    def names(self) -> List[str]:
+        return [e.name for e in self.snapshot().by_name]
+
+    def _matches(self, snap: _Snapshot, key: str) -> List[int]:
+        if len(key) < 3:
+            return [pos for pos, k in enumerate(snap.keys) if key in k]
+        # Candidates share every trigram of the query; confirm the substring
+        candidates = None
+        for gram in sorted(_trigrams(key), key=lambda g: len(snap.trigrams.get(g, ()))):
+            positions = snap.trigrams.get(gram)
+            if not positions:
+                return []
+            candidates = set(positions) if candidates is None else candidates.intersection(positions)
+            if not candidates:
+                return []
+        return sorted(pos for pos in candidates if key in snap.keys[pos])
+
+    def search(self, query: str, limit: int = 20) -> List[LocationEntry]:
+        # Prefix matches first (alphabetical), then other substring matches
+        snap = self.snapshot()
+        key = normalize(query)
+        if not key:
+            return snap.by_name[:limit]
+        start = bisect_left(snap.keys, key)
+        results = []
+        pos = start
+        while pos < len(snap.keys) and snap.keys[pos].startswith(key) and len(results) < limit:
+            results.append(snap.entries[pos])
+            pos += 1
+        if len(results) < limit:
+            for pos in self._matches(snap, key):
+                if not snap.keys[pos].startswith(key):
+                    results.append(snap.entries[pos])
+                    if len(results) == limit:
+                        break
+        return results
+
+    def get(self, name: str) -> Optional[LocationEntry]:
+        snap = self.snapshot()
+        key = normalize(name)
+        pos = bisect_left(snap.keys, key)
+        return snap.entries[pos] if pos < len(snap.keys) and snap.keys[pos] == key else None
+
+    def match_ids(self, query: str) -> List[int]:
+        # Every location whose name contains the query, case-insensitively
+        snap = self.snapshot()
+        key = normalize(query)
+        if not key:
+            return [e.id for e in snap.entries]
+        return [snap.entries[pos].id for pos in self._matches(snap, key)]
+
+
+location_catalog = LocationCatalog(ttl=settings.location_catalog_ttl)
+bus.subscribe("locations", lambda key: location_catalog.bump_version())
+
+
+def backfill(batch_size: int = 1000) -> int:
+    # Links QR codes created before the locations table existed
+    updated = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(QRCode.id, QRCode.location)
+                .where(QRCode.location_id.is_(None), QRCode.location.is_not(None), QRCode.id > last_id)
+                .order_by(QRCode.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            ids = ensure_locations(conn, [location for _, location in rows])
+            by_location: Dict[int, List[int]] = {}
+            for qr_id, location in rows:
+                location_id = ids.get(normalize(location))
+                if location_id:
+                    by_location.setdefault(location_id, []).append(qr_id)
+            for location_id, qr_ids in by_location.items():
+                conn.execute(update(QRCode).where(QRCode.id.in_(qr_ids)).values(location_id=location_id))
+        updated += sum(len(qr_ids) for qr_ids in by_location.values())
+        last_id = rows[-1][0]
+    location_catalog.invalidate()
+    return updated
+
+
+def needs_backfill() -> bool:
+    with engine.connect() as conn:
+        stmt = select(QRCode.id).where(QRCode.location_id.is_(None), QRCode.location.is_not(None), QRCode.location != "")
+        return conn.execute(stmt.limit(1)).first() is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the locations catalog")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="Link QR codes without a location_id to a location")
+    search_cmd = sub.add_parser("search", help="Search locations by prefix or substring")
+    search_cmd.add_argument("query")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        print(f"Linked {backfill()} QR codes to locations")
+    elif args.command == "search":
+        for entry in location_catalog.search(args.query):
+            print(f"{entry.id}\t{entry.name}")
+
+
+if __name__ == "__main__":
+    main()
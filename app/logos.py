@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import List, NamedTuple, Optional, Tuple
+import anyio.to_thread
+from .config import get_settings
+
+settings = get_settings()
+
+# Uploaded logos are stored once per content hash:
+#
+#     uploads/logos/<hh>/<sha256>/original.<ext>
+#     uploads/logos/<hh>/<sha256>/<width>.<png|webp|avif>
+#     uploads/logos/<hh>/<sha256>/manifest.json
+#
+# Derivatives are resized in the render process pool. This module is imported by
+# those workers, so it must not pull in the database or the routers at import
+# time; PIL is only loaded where images are actually decoded.
+
+CHUNK_SIZE = 1024 * 1024
+MEDIA_TYPES = {"png": "image/png", "webp": "image/webp", "avif": "image/avif"}
+ORIGINAL_FORMATS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "GIF": "gif", "BMP": "bmp", "TIFF": "tiff", "AVIF": "avif"}
+
+
+class LogoError(Exception):
+    pass
+
+
+class LogoTooLarge(LogoError):
+    pass
+
+
+class InvalidLogo(LogoError):
+    pass
+
+
+class StoredLogo(NamedTuple):
+    digest: str
+    path: str
+    manifest: dict
+
+
+def logo_dir(digest: str) -> str:
+    return os.path.join(settings.logo_dir, digest[:2], digest)
+
+
+def digest_from_path(path: Optional[str]) -> Optional[str]:
+    # Content-addressed logos live in a directory named after their hash;
+    # anything else is a legacy upload served as-is
+    if not path:
+        return None
+    digest = os.path.basename(os.path.dirname(path))
+    return digest if len(digest) == 64 and os.path.basename(path).startswith("original.") else None
+
+
+def load_manifest(digest: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(logo_dir(digest), "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _encode(image, path: str, fmt: str):
+    if fmt == "png":
+        image.save(path, format="PNG", optimize=True)
+    elif fmt == "webp":
+        image.save(path, format="WEBP", quality=85, method=4)
+    elif fmt == "avif":
+        image.save(path, format="AVIF", quality=60)
+
+
+def process_logo(src: str, directory: str, widths: Tuple[int, ...]) -> dict:
+    # Runs in a worker process: validates the upload, writes every derivative into
+    # a scratch directory and renames it into place, so readers never see a
+    # half-written set. Returns the manifest.
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+    try:
+        with Image.open(src) as probe:
+            probe.verify()
+        with Image.open(src) as opened:
+            fmt = ORIGINAL_FORMATS.get(opened.format or "")
+            if fmt is None:
+                raise InvalidLogo(f"Unsupported image format: {opened.format}")
+            image = ImageOps.exif_transpose(opened)
+            image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as exc:
+        raise InvalidLogo(str(exc) or "Not an image") from exc
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    sizes = sorted({min(w, image.width) for w in widths})
+    formats = ["png", "webp"] + (["avif"] if features.check("avif") else [])
+
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=parent, prefix=".logo-")
+    try:
+        shutil.copyfile(src, os.path.join(scratch, f"original.{fmt}"))
+        for width in sizes:
+            resized = image if width == image.width else image.resize(
+                (width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            for out in formats:
+                _encode(resized, os.path.join(scratch, f"{width}.{out}"), out)
+        manifest = {"original": f"original.{fmt}", "width": image.width, "height": image.height,
+                    "widths": sizes, "formats": formats}
+        with open(os.path.join(scratch, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        try:
+            os.rename(scratch, directory)
+        except OSError:
+            # The same image was stored concurrently; keep that copy
+            if load_manifest(os.path.basename(directory)) is None:
+                raise
+            shutil.rmtree(scratch, ignore_errors=True)
+        return manifest
+    except BaseException:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+
+
+async def _process(src: str, digest: str) -> dict:
+    from . import workers
+    future = workers.get_pool().submit(process_logo, src, logo_dir(digest), tuple(settings.logo_widths))
+    return await asyncio.wrap_future(future)
+
+
+async def save_upload(upload) -> StoredLogo:
+    # Copies the upload to disk in chunks, hashing as it goes; file I/O happens on
+    # worker threads so the event loop never blocks on disk
+    os.makedirs(settings.logo_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=settings.logo_dir, suffix=".upload")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.logo_max_bytes:
+                    raise LogoTooLarge(f"Logo exceeds {settings.logo_max_bytes} bytes")
+                digest.update(chunk)
+                await anyio.to_thread.run_sync(out.write, chunk)
+        if size == 0:
+            raise InvalidLogo("Empty file")
+        key = digest.hexdigest()
+        manifest = await anyio.to_thread.run_sync(load_manifest, key)
+        if manifest is None:
+            manifest = await _process(tmp, key)
+        return StoredLogo(key, os.path.join(logo_dir(key), manifest["original"]), manifest)
+    finally:
+        await anyio.to_thread.run_sync(_remove, tmp)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def choose_variant(manifest: dict, accept: Optional[str], width: Optional[int]) -> Tuple[str, str]:
+    # Best format the client accepts, then the smallest stored width that still
+    # covers the requested one (or the landing size when none is given)
+    accept = accept or ""
+    fmt = next((f for f in ("avif", "webp") if f in manifest["formats"] and MEDIA_TYPES[f] in accept), "png")
+    target = width or settings.logo_default_width
+    widths: List[int] = manifest["widths"]
+    chosen = next((w for w in widths if w >= target), widths[-1])
+    return f"{chosen}.{fmt}", MEDIA_TYPES[fmt]
+
+
+def variant_path(digest: str, name: str) -> str:
+    return os.path.join(logo_dir(digest), name)
+
+
+def migrate() -> int:
+    # Moves logos uploaded before content addressing into the hashed layout
+    from sqlalchemy import select, update
+    from .database import engine
+    from .models import QRCode
+
+    with engine.connect() as conn:
+        rows = conn.execute(select(QRCode.id, QRCode.logo_path).where(QRCode.logo_path.is_not(None))).all()
+    migrated = 0
+    for qr_id, path in rows:
+        if digest_from_path(path) or not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            key = hashlib.file_digest(f, "sha256").hexdigest()
+        manifest = load_manifest(key)
+        if manifest is None:
+            try:
+                manifest = process_logo(path, logo_dir(key), tuple(settings.logo_widths))
+            except InvalidLogo as exc:
+                print(f"Skipping QR {qr_id}: {exc}")
+                continue
+        with engine.begin() as conn:
+            conn.execute(update(QRCode).where(QRCode.id == qr_id)
+                         .values(logo_path=os.path.join(logo_dir(key), manifest["original"])))
+        migrated += 1
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain uploaded logos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("migrate", help="Convert legacy logo uploads to content-addressed variants")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(f"Migrated {migrate()} logos (restart the app or wait out LANDING_CACHE_TTL)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,65 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import anyio.to_thread
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import os
-from .database import engine, Base
+from typing import Optional
+from .database import engine, Base, async_engine
 from .routers import auth, qrcodes, scan, analytics
 from .config import get_settings
-from .init_db import init_database
+from .scan_pipeline import pipeline
+from .dedup import seen_index
+from . import init_db, metrics, passwords, rollups, sketches, ua, workers
+from .geoip import geoip
+from .analytics_cache import analytics_cache
+from .invalidation import bus
+from .ratelimit import limiter
 
 settings = get_settings()
 
-# Create tables and seed admin
-init_database()
+metrics.instrument_engine(engine)
+if async_engine is not None:
+    metrics.instrument_engine(async_engine.sync_engine)
 
-app = FastAPI(title="QR Code Analytics API", version="1.0.0")
+# Enrichment before each batch is written, then work done in the same
+# transaction as the writes
+pipeline.add_stage(geoip.enrich)
+pipeline.add_flush_hook(rollups.apply_scans)
+pipeline.add_listener(analytics_cache.on_scans_written)
+pipeline.add_failure_listener(seen_index.forget_scans)
+sketches.recorder.add_listener(analytics_cache.on_scans_written)
+metrics_snapshots = metrics.SnapshotWriter(engine, pipeline)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync routes run in this threadpool; size it against the DB pool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.threadpool_size
+    # Create tables and seed admin, once per boot rather than on import
+    if settings.init_db_on_startup:
+        await anyio.to_thread.run_sync(init_db.init_on_startup)
+    pipeline.start()
+    sketches.recorder.start()
+    seen_index.warm_in_background()
+    ua.warm_in_background()
+    bus.start()
+    if limiter.enabled:
+        limiter.backend.start()
+    metrics_snapshots.start()
+    yield
+    # Drain buffered scans before the worker exits
+    pipeline.stop()
+    sketches.recorder.stop()
+    limiter.backend.stop()
+    bus.stop()
+    metrics_snapshots.stop()
+    workers.shutdown()
+    passwords.hasher.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+app = FastAPI(title="QR Code Analytics API", version="1.0.0", lifespan=lifespan)
 
 # CORS - allow frontend URLs
 allowed_origins = [
@@ -32,13 +79,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Static files for uploads
 os.makedirs("uploads/logos", exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 # Routers
+if settings.async_database:
+    from .routers import async_routes
+    app.include_router(async_routes.router)
 app.include_router(auth.router)
 app.include_router(qrcodes.router)
 app.include_router(scan.router)
@@ -50,4 +102,13 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"status": "healthy"}
+    pool = metrics.pool_status(engine)
+    queue = {"depth": pipeline.depth, "capacity": pipeline.queue.maxsize}
+    degraded = pool.get("saturation", 0) >= 1 or queue["depth"] >= queue["capacity"] * 0.9
+    return {"status": "degraded" if degraded else "healthy", "db_pool": pool, "scan_queue": queue}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(authorization: Optional[str] = Header(None)):
+    if settings.metrics_token and authorization != f"Bearer {settings.metrics_token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(engine, pipeline), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,413 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("app.slow_queries")
+
+# Request instrumentation: an ASGI middleware times every request into per-route
+# histograms, SQLAlchemy cursor events add each statement's count and duration
+# to the current request (via a context variable, which the threadpool copies
+# into sync routes), and everything is rendered in the Prometheus text format.
+#
+# Under gunicorn every worker has its own counters. With METRICS_DIR set, each
+# worker writes a snapshot file there periodically and on exit, and /metrics
+# merges the files, so any worker can answer for the whole server. The master
+# folds exited workers' files into one, which keeps counters monotonic across
+# worker recycling.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self._series: Dict[tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def dump(self) -> list:
+        with self._lock:
+            return [[list(labels), list(counts), total, n] for labels, (counts, total, n) in self._series.items()]
+
+    def load(self, series: list):
+        with self._lock:
+            for labels, counts, total, n in series:
+                current = self._series.get(tuple(labels))
+                if current is None:
+                    self._series[tuple(labels)] = [list(counts), total, n]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], counts)]
+                    current[1] += total
+                    current[2] += n
+
+    def collect(self) -> List[Tuple[tuple, List[int], float, int]]:
+        # Cumulative bucket counts, as Prometheus expects
+        with self._lock:
+            out = []
+            for labels, (counts, total, n) in self._series.items():
+                running, cumulative = 0, []
+                for c in counts:
+                    running += c
+                    cumulative.append(running)
+                out.append((labels, cumulative, total, n))
+            return out
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+request_latency = Histogram(LATENCY_BUCKETS)
+query_latency = Histogram(QUERY_BUCKETS)
+request_queries = Histogram((0, 1, 2, 3, 5, 10, 20, 50, 100))
+# Queue wait plus bcrypt time for the password pool (app.passwords)
+password_latency = Histogram((0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0, 10.0))
+_counters: Dict[str, float] = {"slow_queries": 0}
+_counter_lock = threading.Lock()
+
+
+def _bump(name: str, n: float = 1):
+    with _counter_lock:
+        _counters[name] += n
+
+
+# SQLAlchemy hooks
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    query_latency.observe(("request" if stats is not None else "background",), elapsed)
+    threshold = settings.slow_query_ms
+    if threshold and elapsed * 1000 >= threshold:
+        _bump("slow_queries")
+        slow_query_logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split())[:2000])
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ASGI middleware
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    # Unmatched paths share one label so probes for random URLs can't blow up
+    # the number of series
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.server_timing:
+                    total = (time.perf_counter() - start) * 1000
+                    timing = (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+                              f"app;dur={total:.1f}")
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            labels = (scope["method"], _route_label(scope), str(status))
+            request_latency.observe(labels, elapsed)
+            request_queries.observe(labels[:2], stats.queries)
+
+
+# Gauges read at scrape time
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"class": type(pool).__name__}
+    size = pool.size()
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    checked_out = pool.checkedout()
+    capacity = size + max(max_overflow, 0)
+    return {
+        "class": type(pool).__name__,
+        "size": size,
+        "max_overflow": max_overflow,
+        "checked_out": checked_out,
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(checked_out / capacity, 3) if capacity else 0.0,
+    }
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+INF = 'le="+Inf"'
+
+
+def _histogram_lines(name: str, help_text: str, hist: Histogram, label_names: Tuple[str, ...]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, cumulative, total, count in hist.collect():
+        for bound, n in zip(hist.buckets, cumulative):
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {n}")
+        lines.append(f"{name}_bucket{_labels(label_names, labels, INF)} {count}")
+        lines.append(f"{name}_sum{_labels(label_names, labels)} {total}")
+        lines.append(f"{name}_count{_labels(label_names, labels)} {count}")
+    return lines
+
+
+def _metric(lines: List[str], name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{labels} {value}")
+
+
+# Cross-worker snapshots
+
+HISTOGRAMS = {"request_latency": request_latency, "request_queries": request_queries, "query_latency": query_latency,
+              "password_latency": password_latency}
+RETIRED = "retired.json"
+
+
+def snapshot(engine, pipeline) -> dict:
+    from .passwords import hasher
+    from . import ua
+    with _counter_lock:
+        counters = dict(_counters)
+    passwords = hasher.status()
+    ua_cache = ua.stats()
+    return {
+        "pid": os.getpid(),
+        "histograms": {name: hist.dump() for name, hist in HISTOGRAMS.items()},
+        "counters": counters,
+        "pipeline": dict(pipeline.stats),
+        "pool": pool_status(engine),
+        "queue": {"depth": pipeline.depth, "capacity": pipeline.queue.maxsize},
+        "password_events": passwords["stats"],
+        "password_pool": {"pending": passwords["pending"], "capacity": passwords["capacity"]},
+        "ua_cache_events": {"hit": ua_cache["hits"], "miss": ua_cache["misses"]},
+        "ua_cache_size": ua_cache["size"],
+    }
+
+
+def _write_json(path: str, data: dict):
+    # Written to a temporary file and renamed, so readers never see half a file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(engine, pipeline):
+    os.makedirs(settings.metrics_dir, exist_ok=True)
+    _write_json(os.path.join(settings.metrics_dir, f"{os.getpid()}.json"), snapshot(engine, pipeline))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(into: dict, snap: dict):
+    for name, series in snap.get("histograms", {}).items():
+        target = into["histograms"].setdefault(name, Histogram(HISTOGRAMS[name].buckets))
+        target.load(series)
+    for field in ("counters", "pipeline", "password_events", "ua_cache_events"):
+        for key, value in snap.get(field, {}).items():
+            into[field][key] = into[field].get(key, 0) + value
+
+
+def _empty() -> dict:
+    return {"histograms": {}, "counters": {}, "pipeline": {}, "password_events": {}, "ua_cache_events": {}}
+
+
+def retire_snapshot(pid: int):
+    # Called by the gunicorn master when a worker exits: its final totals are
+    # folded into one file so recycled workers don't pile up snapshots
+    if not settings.metrics_dir:
+        return
+    path = os.path.join(settings.metrics_dir, f"{pid}.json")
+    snap = _read_json(path)
+    if snap is None:
+        return
+    retired_path = os.path.join(settings.metrics_dir, RETIRED)
+    merged = _empty()
+    _merge(merged, _read_json(retired_path) or {})
+    _merge(merged, snap)
+    merged["histograms"] = {name: hist.dump() for name, hist in merged["histograms"].items()}
+    _write_json(retired_path, merged)
+    os.remove(path)
+
+
+def reset_snapshots():
+    if not settings.metrics_dir:
+        return
+    os.makedirs(settings.metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(settings.metrics_dir, "*.json")):
+        os.remove(path)
+
+
+def collect(engine, pipeline) -> Tuple[dict, List[dict]]:
+    # Totals over every worker that ever ran, plus the gauges of the live ones
+    own = snapshot(engine, pipeline)
+    snaps = [own]
+    if settings.metrics_dir:
+        for path in glob.glob(os.path.join(settings.metrics_dir, "*.json")):
+            snap = _read_json(path)
+            if snap is not None and snap.get("pid") != own["pid"]:
+                snaps.append(snap)
+    merged = _empty()
+    for snap in snaps:
+        _merge(merged, snap)
+    live = [snap for snap in snaps if snap.get("pid") and _alive(snap["pid"])]
+    return merged, live
+
+
+class SnapshotWriter:
+    def __init__(self, engine, pipeline):
+        self.engine = engine
+        self.pipeline = pipeline
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not settings.metrics_dir:
+            return
+        write_snapshot(self.engine, self.pipeline)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshots", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(settings.metrics_snapshot_interval):
+            try:
+                write_snapshot(self.engine, self.pipeline)
+            except OSError:
+                logger.exception("Failed to write metrics snapshot")
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(5)
+        self._thread = None
+        write_snapshot(self.engine, self.pipeline)
+
+
+def render(engine, pipeline) -> str:
+    merged, live = collect(engine, pipeline)
+    hists = merged["histograms"]
+    lines: List[str] = []
+    lines += _histogram_lines("http_request_duration_seconds", "HTTP request latency by route",
+                              hists["request_latency"], ("method", "route", "status"))
+    lines += _histogram_lines("http_request_db_queries", "SQL statements per HTTP request",
+                              hists["request_queries"], ("method", "route"))
+    lines += _histogram_lines("db_query_duration_seconds", "SQL statement latency",
+                              hists["query_latency"], ("source",))
+    _metric(lines, "db_slow_queries_total", "counter", "Statements slower than SLOW_QUERY_MS",
+            [("", merged["counters"].get("slow_queries", 0))])
+
+    # Pool and queue gauges add up over the live workers; saturation is the worst one
+    pools = [snap["pool"] for snap in live if "size" in snap.get("pool", {})]
+    if pools:
+        _metric(lines, "db_pool_size", "gauge", "Configured pool size", [("", sum(p["size"] for p in pools))])
+        _metric(lines, "db_pool_checked_out", "gauge", "Connections in use",
+                [("", sum(p["checked_out"] for p in pools))])
+        _metric(lines, "db_pool_overflow", "gauge", "Connections opened beyond pool size",
+                [("", sum(p["overflow"] for p in pools))])
+        _metric(lines, "db_pool_saturation", "gauge", "Checked-out share of pool size plus overflow",
+                [("", max(p["saturation"] for p in pools))])
+
+    _metric(lines, "scan_queue_depth", "gauge", "Scans waiting to be written",
+            [("", sum(snap["queue"]["depth"] for snap in live))])
+    _metric(lines, "scan_queue_capacity", "gauge", "Scan queue size limit",
+            [("", sum(snap["queue"]["capacity"] for snap in live))])
+    _metric(lines, "scan_pipeline_events_total", "counter", "Scan pipeline events by outcome",
+            [(_labels(("outcome",), (key,)), value) for key, value in merged["pipeline"].items()])
+    lines += _histogram_lines("password_hash_duration_seconds", "Password hash and verify latency, queueing included",
+                              hists["password_latency"], ("operation", "outcome"))
+    _metric(lines, "password_pool_pending", "gauge", "Password hashes queued or running",
+            [("", sum(snap.get("password_pool", {}).get("pending", 0) for snap in live))])
+    _metric(lines, "password_pool_capacity", "gauge", "Password hashes allowed in flight before rejecting",
+            [("", sum(snap.get("password_pool", {}).get("capacity", 0) for snap in live))])
+    _metric(lines, "password_events_total", "counter", "Password pool events by outcome",
+            [(_labels(("outcome",), (key,)), value) for key, value in merged["password_events"].items()])
+    _metric(lines, "ua_cache_lookups_total", "counter", "User-agent classification cache lookups by result",
+            [(_labels(("result",), (key,)), value) for key, value in merged["ua_cache_events"].items()])
+    _metric(lines, "ua_cache_size", "gauge", "User agents held in the classification cache",
+            [("", sum(snap.get("ua_cache_size", 0) for snap in live))])
+    _metric(lines, "server_workers", "gauge", "Worker processes reporting metrics", [("", len(live))])
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, ForeignKey, Boolean, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -16,6 +16,15 @@ class User(Base):
     
     qr_codes = relationship("QRCode", back_populates="owner")
 
+class Location(Base):
+    __tablename__ = "locations"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), nullable=False)
+    # Case- and whitespace-folded name; one row per distinct location
+    key = Column(String(255), nullable=False, unique=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class QRCode(Base):
     __tablename__ = "qr_codes"
     
@@ -30,9 +39,10 @@ class QRCode(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    location_id = Column(Integer, ForeignKey("locations.id"), index=True)
     
     owner = relationship("User", back_populates="qr_codes")
-    scans = relationship("ScanLog", back_populates="qr_code")
+    scans = relationship("ScanLog", back_populates="qr_code", passive_deletes=True)
 
 class ScanLog(Base):
     __tablename__ = "scan_logs"
@@ -50,6 +60,43 @@ class ScanLog(Base):
     
     qr_code = relationship("QRCode", back_populates="scans")
 
+    # One row per (QR code, IP): backs the dedup check and insert-if-absent writes.
+    # (qr_code_id, timestamp, id) serves per-QR keyset pages.
+    __table_args__ = (
+        Index("ux_scan_logs_qr_ip", "qr_code_id", "ip_address", unique=True),
+        Index("ix_scan_logs_qr_timestamp_id", "qr_code_id", "timestamp", "id"),
+    )
+
+
+class ScanRollup(Base):
+    __tablename__ = "scan_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    qr_code_id = Column(Integer, ForeignKey("qr_codes.id"), nullable=False)
+    day = Column(Date, nullable=False, index=True)
+    device_type = Column(String(50), nullable=False, default="")
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint("qr_code_id", "day", "device_type", name="ux_scan_rollups_key"),
+    )
+
+
+class ScanSketch(Base):
+    __tablename__ = "scan_sketches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    qr_code_id = Column(Integer, ForeignKey("qr_codes.id"), nullable=False)
+    day = Column(Date, nullable=False, index=True)
+    # Every scan, repeats included
+    total = Column(Integer, nullable=False, default=0)
+    # Serialized HyperLogLog of visitor IPs (see app.sketches)
+    visitors = Column(LargeBinary, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("qr_code_id", "day", name="ux_scan_sketches_key"),
+    )
+
 
 class ContactSubmission(Base):
     __tablename__ = "contact_submissions"
@@ -64,3 +111,7 @@ class ContactSubmission(Base):
     
     qr_code = relationship("QRCode")
     scan = relationship("ScanLog")
+    
+    __table_args__ = (
+        Index("ix_contact_submissions_created_id", "created_at", "id"),
+    )
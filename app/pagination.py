@@ -0,0 +1,88 @@
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from sqlalchemy import Select, tuple_
+from .database import engine
+
+# Keyset pagination over (timestamp, id). Cursors are opaque to clients: a
+# base64url-encoded JSON pair of the last row's sort key.
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def after_cursor(stmt, ts_col, id_col, cursor: Optional[Tuple[datetime, int]], descending: bool = True):
+    if cursor is None:
+        return stmt
+    key, bound = tuple_(ts_col, id_col), tuple_(*cursor)
+    return stmt.filter(key < bound if descending else key > bound)
+
+
+def next_cursor(rows: Sequence, limit: int, ts_attr: str, id_attr: str = "id") -> Optional[str]:
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, ts_attr), getattr(last, id_attr))
+
+
+def iter_keyset(stmt: Select, ts_col, id_col, page_size: int = 5000, yield_per: int = 1000) -> Iterator:
+    # Walks the whole result in ascending (timestamp, id) pages. Each page is its
+    # own short query streamed with a server-side cursor, so memory stays flat and
+    # no transaction is held open for the length of the export.
+    cursor = None
+    while True:
+        page = after_cursor(stmt, ts_col, id_col, cursor, descending=False).order_by(ts_col, id_col).limit(page_size)
+        count, last = 0, None
+        with engine.connect() as conn:
+            for row in conn.execution_options(yield_per=yield_per).execute(page):
+                count += 1
+                last = row
+                yield row
+        if count < page_size:
+            return
+        cursor = (last._mapping[ts_col.key], last._mapping[id_col.key])
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def to_ndjson(rows: Iterable, columns: List[str], chunk_rows: int = 500) -> Iterator[str]:
+    buf = []
+    for row in rows:
+        buf.append(json.dumps({c: _jsonable(v) for c, v in zip(columns, row)}))
+        if len(buf) >= chunk_rows:
+            yield "\n".join(buf) + "\n"
+            buf = []
+    if buf:
+        yield "\n".join(buf) + "\n"
+
+
+def to_csv(rows: Iterable, columns: List[str], chunk_rows: int = 500) -> Iterator[str]:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow([_jsonable(v) for v in row])
+        if i % chunk_rows == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
@@ -0,0 +1,240 @@
+import argparse
+import logging
+from datetime import date, datetime
+from typing import List, Optional, Set, Tuple
+from sqlalchemy import delete, select, text, update
+from .database import engine
+from .models import ContactSubmission, ScanLog
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Time-range storage for scan_logs. On Postgres the table can be converted to
+# monthly RANGE partitions on "timestamp": date-bounded queries only touch the
+# matching months, and retention drops whole partitions instead of deleting rows.
+# Daily counts live on in scan_rollups, so dropping raw scans loses no analytics
+# totals. Other databases keep a single table and fall back to range deletes.
+
+TABLE = "scan_logs"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+# Postgres can't enforce a unique index on a partitioned table unless it includes the
+# partition key, so (qr_code_id, ip_address) uniqueness is created per partition.
+PER_PARTITION_INDEXES = {"ux_scan_logs_qr_ip"}
+
+
+def month_start(d) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def retention_cutoff(months: Optional[int] = None, today: Optional[date] = None) -> Optional[date]:
+    months = settings.scan_retention_months if months is None else months
+    if not months:
+        return None
+    return add_months(month_start(today or datetime.utcnow().date()), -months)
+
+
+def is_partitioned(conn=None) -> bool:
+    if engine.dialect.name != "postgresql":
+        return False
+    stmt = text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))")
+    if conn is not None:
+        return conn.execute(stmt, {"name": TABLE}).scalar()
+    with engine.connect() as conn:
+        return conn.execute(stmt, {"name": TABLE}).scalar()
+
+
+def skipped_indexes() -> Set[str]:
+    # Indexes from the model that ensure_indexes must not create on the parent table
+    return PER_PARTITION_INDEXES if is_partitioned() else set()
+
+
+def list_partitions(conn) -> List[Tuple[str, date]]:
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:name) ORDER BY c.relname"
+    ), {"name": TABLE}).scalars()
+    prefix = f"{TABLE}_p"
+    return [
+        (name, datetime.strptime(name[len(prefix):], "%Y%m").date())
+        for name in rows if name.startswith(prefix)
+    ]
+
+
+def _create_partition(conn, month: date):
+    name = partition_name(month)
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    # Rows for a month without a partition land in the default partition; move them
+    # into a standalone table and attach it, since Postgres refuses to create a
+    # partition whose range overlaps rows already in the default.
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} (LIKE {TABLE} INCLUDING DEFAULTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= '{lower}' AND timestamp < '{upper}' "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+    ))
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_qr_ip ON {name} (qr_code_id, ip_address)"))
+    conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+
+
+def ensure_partitions(months_ahead: Optional[int] = None, start: Optional[date] = None) -> int:
+    months_ahead = settings.scan_partition_months_ahead if months_ahead is None else months_ahead
+    current = month_start(datetime.utcnow().date())
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return 0
+        existing = {month for _, month in list_partitions(conn)}
+        month = month_start(start) if start else current
+        created = 0
+        while month <= add_months(current, months_ahead):
+            if month not in existing:
+                _create_partition(conn, month)
+                created += 1
+            month = add_months(month, 1)
+    return created
+
+
+def migrate() -> int:
+    # Converts an existing scan_logs table into a partitioned one in a single
+    # transaction. The table is locked while rows are copied.
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("scan_logs partitioning requires PostgreSQL")
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return 0
+        old = f"{TABLE}_unpartitioned"
+        conn.execute(text(f"UPDATE {TABLE} SET timestamp = now() AT TIME ZONE 'utc' WHERE timestamp IS NULL"))
+        first = conn.execute(text(f"SELECT min(timestamp) FROM {TABLE}")).scalar()
+
+        # The id sequence and index names outlive the old table
+        conn.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE"))
+        conn.execute(text("ALTER TABLE contact_submissions DROP CONSTRAINT IF EXISTS contact_submissions_scan_id_fkey"))
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {old}"))
+        conn.execute(text(f"ALTER TABLE {old} RENAME CONSTRAINT {TABLE}_pkey TO {old}_pkey"))
+        for index in ScanLog.__table__.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+        conn.execute(text(
+            f'CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")'
+        ))
+        conn.execute(text(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, "timestamp")'))
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_qr_code_id_fkey "
+            "FOREIGN KEY (qr_code_id) REFERENCES qr_codes (id) ON DELETE CASCADE"
+        ))
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+        conn.execute(text(f"CREATE UNIQUE INDEX {DEFAULT_PARTITION}_qr_ip ON {DEFAULT_PARTITION} (qr_code_id, ip_address)"))
+
+        current = month_start(datetime.utcnow().date())
+        month = month_start(first) if first else current
+        while month <= add_months(current, settings.scan_partition_months_ahead):
+            _create_partition(conn, month)
+            month = add_months(month, 1)
+        for index in ScanLog.__table__.indexes:
+            if index.name not in PER_PARTITION_INDEXES:
+                columns = ", ".join(f'"{c.name}"' for c in index.columns)
+                conn.execute(text(f"CREATE INDEX {index.name} ON {TABLE} ({columns})"))
+
+        copied = conn.execute(text(f"INSERT INTO {TABLE} SELECT * FROM {old}")).rowcount
+        conn.execute(text(f"DROP TABLE {old}"))
+        conn.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id"))
+    logger.info("Partitioned %s: %d rows copied", TABLE, copied)
+    return copied
+
+
+def apply_retention(months: Optional[int] = None, batch_size: int = 10000) -> int:
+    cutoff = retention_cutoff(months)
+    if cutoff is None:
+        return 0
+    if is_partitioned():
+        return _drop_partitions(cutoff)
+    return _delete_before(datetime.combine(cutoff, datetime.min.time()), batch_size)
+
+
+def _drop_partitions(cutoff: date) -> int:
+    dropped = 0
+    with engine.connect() as conn:
+        expired = [name for name, month in list_partitions(conn) if add_months(month, 1) <= cutoff]
+    for name in expired:
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"UPDATE contact_submissions SET scan_id = NULL WHERE scan_id IN (SELECT id FROM {name})"
+            ))
+            conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        logger.info("Dropped scan partition %s", name)
+        dropped += 1
+    return dropped
+
+
+def _delete_before(cutoff: datetime, batch_size: int) -> int:
+    expired = select(ScanLog.id).where(ScanLog.timestamp < cutoff)
+    with engine.begin() as conn:
+        conn.execute(
+            update(ContactSubmission).where(ContactSubmission.scan_id.in_(expired)).values(scan_id=None)
+        )
+    deleted = 0
+    while True:
+        # Short transactions so scan writes aren't blocked for the whole purge
+        with engine.begin() as conn:
+            count = conn.execute(
+                delete(ScanLog).where(ScanLog.id.in_(expired.order_by(ScanLog.id).limit(batch_size)))
+            ).rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+def maintain() -> Tuple[int, int]:
+    return ensure_partitions(), apply_retention()
+
+
+def init_partitioning():
+    # Called at startup when SCAN_LOG_PARTITIONING is on: an empty table is converted
+    # immediately, a populated one has to be migrated explicitly.
+    if engine.dialect.name != "postgresql":
+        logger.warning("scan_log_partitioning is only supported on PostgreSQL")
+        return
+    if not is_partitioned():
+        with engine.connect() as conn:
+            empty = conn.execute(select(ScanLog.id).limit(1)).first() is None
+        if not empty:
+            logger.warning("scan_logs is not partitioned; run `python -m app.partitions migrate`")
+            return
+        migrate()
+    ensure_partitions()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage scan_logs partitions and retention")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("migrate", help="Convert scan_logs to monthly partitions (PostgreSQL)")
+    sub.add_parser("maintain", help="Create upcoming partitions and apply retention")
+    retention_cmd = sub.add_parser("retention", help="Drop raw scans older than the retention window")
+    retention_cmd.add_argument("--months", type=int, default=None, help="Override SCAN_RETENTION_MONTHS")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(f"Copied {migrate()} scans into partitioned {TABLE}")
+    elif args.command == "maintain":
+        created, removed = maintain()
+        print(f"Created {created} partitions, removed {removed} expired")
+    elif args.command == "retention":
+        cutoff = retention_cutoff(args.months)
+        if cutoff is None:
+            print("No retention window configured")
+            return
+        print(f"Removed {apply_retention(args.months)} expired (before {cutoff})")
+
+
+if __name__ == "__main__":
+    main()
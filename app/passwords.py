@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+from . import metrics
+from .config import get_settings
+
+settings = get_settings()
+
+# bcrypt runs in a dedicated process pool, so a burst of logins neither holds
+# the request threads nor the GIL while scans are being served. The number of
+# hashes queued or running is capped; past the cap callers get
+# PasswordHasherBusy straight away instead of waiting behind the backlog.
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+@lru_cache(maxsize=4)
+def crypt_context(rounds: int) -> CryptContext:
+    # Hashes at any other cost count as outdated, so raising or lowering
+    # BCRYPT_ROUNDS rehashes each password at its next login
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=rounds,
+                        bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds)
+
+
+# Run in the pool processes
+
+def _hash(password: str, rounds: int) -> str:
+    return crypt_context(rounds).hash(password)
+
+
+def _verify(password: str, hashed: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return crypt_context(rounds).verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int, workers: int, max_pending: int):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise PasswordHasherBusy()
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            self.pending += 1
+            pool = self._pool
+        try:
+            future = pool.submit(fn, *args)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    async def _run(self, op: str, fn, *args):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await asyncio.wrap_future(self._submit(fn, *args))
+            outcome = "ok"
+            return result
+        except PasswordHasherBusy:
+            outcome = "rejected"
+            raise
+        finally:
+            metrics.password_latency.observe((op, outcome), time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run("hash", _hash, password, self.rounds)
+        with self._lock:
+            self.stats["hashed"] += 1
+        return hashed
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        # (valid, new hash); the new hash is set when the stored one used another cost
+        valid, new_hash = await self._run("verify", _verify, password, hashed, self.rounds)
+        with self._lock:
+            self.stats["verified"] += 1
+            if new_hash:
+                self.stats["rehashed"] += 1
+        return valid, new_hash
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"pending": self.pending, "capacity": self.max_pending, "stats": dict(self.stats)}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+hasher = PasswordHasher(rounds=settings.bcrypt_rounds, workers=settings.password_workers,
+                        max_pending=settings.password_max_pending)
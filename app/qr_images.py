@@ -0,0 +1,235 @@
+import base64
+import copy
+import hashlib
+import io
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import TYPE_CHECKING, NamedTuple, Optional, Tuple
+from . import logos
+from .cache import LRUCache
+from .config import get_settings
+
+if TYPE_CHECKING:
+    import qrcode
+    from PIL import Image
+
+settings = get_settings()
+
+# qrcode and PIL are imported on first render (or in the render workers), not
+# when the app starts.
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+# Module shapes. Finder patterns always stay square so styled codes still scan.
+PNG_MODULES = {
+    "square": "SquareModuleDrawer",
+    "rounded": "RoundedModuleDrawer",
+    "circle": "CircleModuleDrawer",
+    "gapped": "GappedSquareModuleDrawer",
+}
+SVG_MODULES = {"square": None, "circle": "circle", "gapped": "gapped-square"}
+MIN_CONTRAST = 3.0
+
+
+class Style(NamedTuple):
+    fill: str = "#000000"
+    back: str = "#ffffff"
+    module: str = "square"
+    # Digest of a content-addressed logo (see app.logos)
+    logo: Optional[str] = None
+
+
+PLAIN = Style()
+
+
+def make_style(fill: str = "#000000", back: str = "#ffffff", module: str = "square",
+               logo_path: Optional[str] = None) -> Style:
+    return Style(fill.lower(), back.lower(), module, logos.digest_from_path(logo_path))
+
+
+def _luminance(color: str) -> float:
+    channels = [int(color[i:i + 2], 16) / 255 for i in (1, 3, 5)]
+    r, g, b = [c / 12.92 if c <= 0.03928 else ((c + 0.055) / 1.055) ** 2.4 for c in channels]
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def contrast(fill: str, back: str) -> float:
+    # WCAG contrast ratio; scanners struggle well before colours look similar
+    light, dark = sorted((_luminance(fill), _luminance(back)), reverse=True)
+    return (light + 0.05) / (dark + 0.05)
+
+
+def effective_ec(ec: str, style: Style) -> str:
+    # A logo hides part of the code, so it always gets the highest recovery level
+    return "H" if style.logo else ec
+
+
+def scan_url(qr_id: int) -> str:
+    return f"{settings.frontend_url}/scan/{qr_id}"
+
+
+@lru_cache(maxsize=settings.qr_matrix_cache_size)
+def _matrix(data: str, ec: str) -> "qrcode.QRCode":
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{ec}"))
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def _sized(data: str, box_size: int, border: int, ec: str) -> "qrcode.QRCode":
+    # Shallow copy: the encoded modules are shared, only the geometry differs
+    qr = copy.copy(_matrix(data, ec))
+    qr.box_size = box_size
+    qr.border = border
+    return qr
+
+
+def _logo(digest: str, size: int) -> Optional["Image.Image"]:
+    from PIL import Image
+
+    manifest = logos.load_manifest(digest)
+    if manifest is None:
+        return None
+    name, _ = logos.choose_variant(manifest, "", size)
+    with Image.open(logos.variant_path(digest, name)) as opened:
+        logo = opened.convert("RGBA")
+    logo.thumbnail((size, size), Image.LANCZOS)
+    return logo
+
+
+def _logo_box(width: int, box_size: int, border: int) -> Tuple[int, int]:
+    # Side of the backing square in the centre of the code, and its padding
+    side = int((width - 2 * border * box_size) * settings.qr_logo_ratio)
+    return side, max(2, box_size // 2)
+
+
+def render_image(data: str, box_size: int = 10, border: int = 4, ec: str = "M", style: Style = PLAIN) -> "Image.Image":
+    from PIL import Image, ImageDraw, ImageOps
+    from qrcode.image.styledpil import StyledPilImage
+    from qrcode.image.styles.moduledrawers import pil as drawers
+
+    qr = _sized(data, box_size, border, effective_ec(ec, style))
+    if style == PLAIN:
+        return qr.make_image(fill_color="black", back_color="white").get_image()
+    # Modules are drawn black on white (qrcode's fast path) and recoloured in one pass
+    drawn = qr.make_image(image_factory=StyledPilImage, module_drawer=getattr(drawers, PNG_MODULES[style.module])()).get_image()
+    img = ImageOps.colorize(drawn.convert("L"), black=style.fill, white=style.back)
+    logo = _logo(style.logo, _logo_box(img.width, box_size, border)[0]) if style.logo else None
+    if logo is not None:
+        side, pad = _logo_box(img.width, box_size, border)
+        x0 = (img.width - side) // 2
+        ImageDraw.Draw(img).rounded_rectangle((x0, x0, x0 + side, x0 + side), radius=pad * 2, fill=style.back)
+        logo.thumbnail((side - 2 * pad, side - 2 * pad), Image.LANCZOS)
+        img.paste(logo, ((img.width - logo.width) // 2, (img.height - logo.height) // 2), logo)
+    return img
+
+
+def _render_svg(data: str, box_size: int, border: int, ec: str, style: Style) -> bytes:
+    import qrcode.image.svg
+
+    qr = _sized(data, box_size, border, effective_ec(ec, style))
+    img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage, module_drawer=SVG_MODULES[style.module])
+    if style != PLAIN:
+        root = img.get_image()
+        img.path.set("fill", style.fill)
+        root.insert(0, ET.Element("rect", fill=style.back, x="0", y="0", width="100%", height="100%"))
+        side, pad = _logo_box(img.pixel_size, box_size, border)
+        logo = _logo(style.logo, side * 2) if style.logo else None
+        if logo is not None:
+            # Pixel geometry is converted to the document's units; the logo is
+            # inlined so the file stays self-contained
+            def units(px: int) -> str:
+                return str(img.units(px, text=False))
+            x0 = (img.pixel_size - side) // 2
+            inner = side - 2 * pad
+            buf = io.BytesIO()
+            logo.save(buf, format="PNG", optimize=True)
+            root.append(ET.Element("rect", fill=style.back, x=units(x0), y=units(x0), width=units(side),
+                                   height=units(side), rx=units(pad * 2)))
+            root.append(ET.Element("image", x=units(x0 + pad), y=units(x0 + pad), width=units(inner),
+                                   height=units(inner), preserveAspectRatio="xMidYMid meet",
+                                   href="data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()))
+    buf = io.BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+def render(data: str, fmt: str = "png", box_size: int = 10, border: int = 4, ec: str = "M",
+           style: Style = PLAIN) -> bytes:
+    if fmt == "svg":
+        return _render_svg(data, box_size, border, ec, style)
+    buf = io.BytesIO()
+    render_image(data, box_size, border, ec, style).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# Rendered images are content-addressed by everything that affects the output,
+# so the key doubles as a strong ETag. Logos are identified by their content
+# hash, so replacing a logo changes the key.
+def image_key(data: str, fmt: str, box_size: int, border: int, ec: str, style: Style = PLAIN) -> str:
+    params = [data, fmt, box_size, border, effective_ec(ec, style)]
+    if style != PLAIN:
+        params.append(list(style))
+    return hashlib.sha256(json.dumps(params, separators=(",", ":")).encode()).hexdigest()
+
+
+class ImageCache:
+    def __init__(self, directory: str, max_bytes: int, max_items: int):
+        self.directory = directory
+        self.memory = LRUCache(maxsize=max_items, max_bytes=max_bytes)
+
+    def _path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{fmt}")
+
+    def contains(self, data: str, fmt: str = "png", box_size: int = 10, border: int = 4, ec: str = "M",
+                 style: Style = PLAIN) -> bool:
+        key = image_key(data, fmt, box_size, border, ec, style)
+        return self.memory.get(key) is not None or os.path.exists(self._path(key, fmt))
+
+    def peek(self, data: str, fmt: str = "png", box_size: int = 10, border: int = 4, ec: str = "M",
+             style: Style = PLAIN) -> Optional[bytes]:
+        key = image_key(data, fmt, box_size, border, ec, style)
+        content = self.memory.get(key)
+        if content is not None:
+            return content
+        try:
+            with open(self._path(key, fmt), "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        self.memory.set(key, content)
+        return content
+
+    def store(self, content: bytes, data: str, fmt: str = "png", box_size: int = 10, border: int = 4, ec: str = "M",
+              style: Style = PLAIN) -> str:
+        key = image_key(data, fmt, box_size, border, ec, style)
+        self._write(self._path(key, fmt), content)
+        self.memory.set(key, content)
+        return key
+
+    def get_or_render(self, data: str, fmt: str = "png", box_size: int = 10, border: int = 4, ec: str = "M",
+                      style: Style = PLAIN) -> Tuple[str, bytes]:
+        content = self.peek(data, fmt, box_size, border, ec, style)
+        if content is not None:
+            return image_key(data, fmt, box_size, border, ec, style), content
+        content = render(data, fmt, box_size, border, ec, style)
+        return self.store(content, data, fmt, box_size, border, ec, style), content
+
+    def _write(self, path: str, content: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+image_cache = ImageCache(
+    directory=settings.qr_cache_dir,
+    max_bytes=settings.qr_cache_memory_bytes,
+    max_items=settings.qr_cache_memory_items,
+)
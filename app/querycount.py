@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+from typing import List
+from sqlalchemy import event
+from .database import engine
+
+# Counts statements sent to the database. Meant for tests and benchmarks:
+#
+#     with assert_max_queries(3):
+#         client.get("/api/qrcodes/", headers=auth)
+#
+# The listener is engine-wide, so keep background writers (the scan pipeline)
+# idle while measuring.
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(bind=engine):
+    counter = QueryCounter()
+    event.listen(bind, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", counter)
+
+
+@contextmanager
+def assert_max_queries(limit: int, bind=engine):
+    with count_queries(bind) as counter:
+        yield counter
+    if counter.count > limit:
+        listing = "\n".join(f"  {i + 1}. {s}" for i, s in enumerate(counter.statements))
+        raise AssertionError(f"Expected at most {limit} queries, got {counter.count}:\n{listing}")
@@ -0,0 +1,321 @@
+import ipaddress
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Token-bucket rate limiting for the unauthenticated endpoints. Each route has
+# a bucket per client IP and QR code, and every public route also draws from
+# one bucket per IP, so a bot can't spread its load over many codes. A bucket
+# that has been idle long enough to refill completely is the same as a new one,
+# so idle buckets are dropped without changing any decision. Memory therefore
+# tracks active clients only.
+
+PERIODS = {"second": 1.0, "minute": 60.0, "hour": 3600.0}
+
+
+class Limit(NamedTuple):
+    capacity: float
+    rate: float  # tokens per second
+
+    @property
+    def refill_time(self) -> float:
+        return self.capacity / self.rate
+
+
+def parse_limit(value: str) -> Limit:
+    # "30/minute": bursts of 30, refilled evenly over a minute
+    count, _, period = value.partition("/")
+    if period not in PERIODS or not count.strip().isdigit() or int(count) < 1:
+        raise ValueError(f"Invalid rate limit {value!r}; expected e.g. '30/minute'")
+    return Limit(float(count), int(count) / PERIODS[period])
+
+
+def _refill(tokens: float, updated: float, limit: Limit, now: float) -> float:
+    return min(limit.capacity, tokens + (now - updated) * limit.rate)
+
+
+class RateLimitBackend:
+    # Takes one token from the bucket at `key`; returns 0 when allowed, otherwise
+    # the seconds until a token is available
+    blocking = False
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> [tokens, updated, refill_time], least recently used first
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            tokens = limit.capacity if bucket is None else _refill(bucket[0], bucket[1], limit, now)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = [tokens, now, limit.refill_time]
+            self._evict(now)
+            return wait
+
+    def adopt(self, key: str, tokens: float, limit: Limit, now: float):
+        # Replaces a bucket's balance with one worked out elsewhere
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._buckets[key] = [tokens, now, limit.refill_time]
+            else:
+                bucket[0], bucket[1] = tokens, now
+            self._evict(now)
+
+    def _evict(self, now: float):
+        # The oldest entries come first; stop at the first one still refilling.
+        # Past max_keys the least recently used bucket goes regardless.
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated, refill_time) = next(iter(buckets.items()))
+            if now - updated < refill_time and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+
+class SqliteRateLimitBackend(RateLimitBackend):
+    # Buckets shared by every worker on the host, in the shared cache file
+    blocking = True
+
+    def __init__(self, path: str, purge_every: int = 1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._ops = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tokens REAL, updated REAL, expires REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # A connection opened before a fork (gunicorn preload) stays with the
+        # parent; the child opens its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tokens = limit.capacity if row is None else _refill(row[0], row[1], limit, now)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+            if not wait:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, tokens, updated, expires) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, now + limit.refill_time),
+            )
+            self._ops += 1
+            if self._ops % self.purge_every == 0:
+                conn.execute("DELETE FROM rate_limits WHERE expires <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def charge(self, taken: Dict[str, Tuple[Limit, int]], now: float) -> Dict[str, float]:
+        # Takes `n` tokens from each bucket in one transaction, going into debt
+        # if need be, and returns the balances
+        conn = self._conn()
+        balances = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, (limit, n) in taken.items():
+                row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                tokens = limit.capacity if row is None else _refill(row[0], row[1], limit, now)
+                balances[key] = tokens - n
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, tokens, updated, expires) VALUES (?, ?, ?, ?)",
+                    (key, tokens - n, now, now + (limit.capacity - tokens + n) / limit.rate),
+                )
+            self._ops += 1
+            if self._ops % self.purge_every == 0:
+                conn.execute("DELETE FROM rate_limits WHERE expires <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return balances
+
+
+class SyncedRateLimitBackend(RateLimitBackend):
+    # Buckets live in each worker's memory, so a request never waits on another
+    # process. Every sync_interval the worker charges the tokens it handed out
+    # to the shared buckets in one transaction and adopts the shared balances,
+    # debt included. Between syncs a worker spends from the balance it last saw,
+    # so a client spread over several workers can briefly exceed its burst; over
+    # longer spans the debt holds it to the configured rate.
+    def __init__(self, path: str, max_keys: int, sync_interval: float):
+        self.local = MemoryRateLimitBackend(max_keys)
+        self.shared = SqliteRateLimitBackend(path)
+        self.sync_interval = sync_interval
+        self.stats = {"syncs": 0, "failed": 0}
+        # key -> [limit, tokens taken since the last sync]
+        self._taken: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        with self._lock:
+            wait = self.local.take(key, limit, now)
+            if not wait:
+                entry = self._taken.setdefault(key, [limit, 0])
+                entry[1] += 1
+        return wait
+
+    def sync(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            taken, self._taken = self._taken, {}
+        if not taken:
+            return
+        try:
+            balances = self.shared.charge({key: (limit, n) for key, (limit, n) in taken.items()}, now)
+        except sqlite3.Error:
+            # Charged again at the next sync
+            logger.exception("Failed to sync rate limit buckets")
+            self.stats["failed"] += 1
+            with self._lock:
+                for key, (limit, n) in taken.items():
+                    self._taken.setdefault(key, [limit, 0])[1] += n
+            return
+        self.stats["syncs"] += 1
+        with self._lock:
+            for key, balance in balances.items():
+                limit = taken[key][0]
+                # Tokens handed out since the snapshot are charged at the next sync
+                pending = self._taken.get(key, (limit, 0))[1]
+                self.local.adopt(key, balance - pending, limit, now)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rate-limit-sync", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(5)
+        self._thread = None
+        self.sync()
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    if settings.rate_limit_backend == "sqlite":
+        return SqliteRateLimitBackend(settings.shared_cache_path)
+    if settings.rate_limit_backend == "synced":
+        return SyncedRateLimitBackend(settings.shared_cache_path, max_keys=settings.rate_limit_max_keys,
+                                      sync_interval=settings.rate_limit_sync_interval)
+    return MemoryRateLimitBackend(max_keys=settings.rate_limit_max_keys)
+
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend, limits: Dict[str, str], enabled: bool = True):
+        self.backend = backend
+        self.limits = {route: parse_limit(value) for route, value in limits.items()}
+        self.enabled = enabled
+        self.stats = {"allowed": 0, "limited": 0}
+
+    def check(self, route: str, ip: str, qr_id: Optional[str] = None, now: Optional[float] = None) -> float:
+        # Seconds to wait, or 0. The per-IP bucket is only charged when the
+        # route's own bucket had a token.
+        now = time.time() if now is None else now
+        wait = 0.0
+        limit = self.limits.get(route)
+        if limit is not None:
+            wait = self.backend.take(f"{route}:{ip}:{qr_id or ''}", limit, now)
+        shared = self.limits.get("public")
+        if not wait and shared is not None:
+            wait = self.backend.take(f"public:{ip}", shared, now)
+        self.stats["limited" if wait else "allowed"] += 1
+        return wait
+
+
+limiter = RateLimiter(create_rate_limit_backend(), settings.rate_limits, enabled=settings.rate_limit_enabled)
+
+
+_trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in settings.trusted_proxies]
+
+
+def _is_trusted(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _trusted_proxies)
+
+
+def client_ip(request: Request) -> str:
+    # Each proxy appends the address it received from, so the client is the
+    # right-most hop that isn't one of ours; anything left of it is whatever
+    # the client chose to send
+    host = request.client.host if request.client else ""
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or not _is_trusted(host):
+        return host
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop):
+            return hop
+    # Only our own proxies: the first of them is as close to the client as we get
+    return hops[0] if hops else host
+
+
+def rate_limit(route: str):
+    async def dependency(request: Request):
+        if not limiter.enabled:
+            return
+        args = (route, client_ip(request), request.path_params.get("qr_id"))
+        if limiter.backend.blocking:
+            wait = await run_in_threadpool(limiter.check, *args)
+        else:
+            wait = limiter.check(*args)
+        if wait:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+    return dependency
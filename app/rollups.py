@@ -0,0 +1,83 @@
+import argparse
+from collections import Counter
+from typing import List
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .database import engine
+from .models import ScanLog, ScanRollup
+from .partitions import retention_cutoff
+
+# Daily per-device scan counts per QR code. Maintained incrementally by the scan
+# pipeline so dashboards aggregate over (QR codes x days) rather than raw scans.
+
+def apply_scans(conn, rows: List[dict]):
+    counts = Counter(
+        (row["qr_code_id"], row["timestamp"].date(), row.get("device_type") or "")
+        for row in rows
+    )
+    if not counts:
+        return
+    values = [
+        {"qr_code_id": qr_id, "day": day, "device_type": device, "count": n}
+        for (qr_id, day, device), n in counts.items()
+    ]
+    dialect = conn.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(ScanRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["qr_code_id", "day", "device_type"],
+            set_={"count": ScanRollup.count + stmt.excluded["count"]},
+        )
+        conn.execute(stmt, values)
+        return
+    for v in values:
+        updated = conn.execute(
+            update(ScanRollup)
+            .where(ScanRollup.qr_code_id == v["qr_code_id"], ScanRollup.day == v["day"], ScanRollup.device_type == v["device_type"])
+            .values(count=ScanRollup.count + v["count"])
+        )
+        if updated.rowcount == 0:
+            conn.execute(insert(ScanRollup), v)
+
+
+def rebuild(qr_id: int = None) -> int:
+    day = func.date(ScanLog.timestamp)
+    device = func.coalesce(ScanLog.device_type, "")
+    source = select(ScanLog.qr_code_id, day, device, func.count(ScanLog.id)).group_by(ScanLog.qr_code_id, day, device)
+    clear = delete(ScanRollup)
+    # Raw scans past the retention window are gone; their rollups are the only record
+    cutoff = retention_cutoff()
+    if cutoff is not None:
+        source = source.where(ScanLog.timestamp >= cutoff)
+        clear = clear.where(ScanRollup.day >= cutoff)
+    if qr_id is not None:
+        source = source.where(ScanLog.qr_code_id == qr_id)
+        clear = clear.where(ScanRollup.qr_code_id == qr_id)
+    with engine.begin() as conn:
+        conn.execute(clear)
+        conn.execute(insert(ScanRollup).from_select(["qr_code_id", "day", "device_type", "count"], source))
+        return conn.execute(select(func.count(ScanRollup.id))).scalar()
+
+
+def needs_backfill() -> bool:
+    with engine.connect() as conn:
+        has_rollups = conn.execute(select(ScanRollup.id).limit(1)).first() is not None
+        has_scans = conn.execute(select(ScanLog.id).limit(1)).first() is not None
+    return has_scans and not has_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the scan_rollups table")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_cmd = sub.add_parser("rebuild", help="Recompute rollups from scan_logs")
+    rebuild_cmd.add_argument("--qr-id", type=int, default=None, help="Only rebuild one QR code")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        rows = rebuild(args.qr_id)
+        print(f"Rebuilt scan rollups: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
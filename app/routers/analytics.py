@@ -1,70 +1,100 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, select, Select
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Dict, Literal, Optional, List
 from ..database import get_db
-from ..models import User, QRCode, ScanLog, ContactSubmission
-from ..schemas import AnalyticsResponse, ScansByDate, ScansByLocation, ScansByDevice, ScanLogResponse, ContactSubmissionResponse
-from ..auth import get_current_admin
+from ..models import Location, QRCode, ScanLog, ScanRollup, ScanSketch, ContactSubmission
+from ..schemas import LocationResponse, AnalyticsResponse, ScansByDate, ScansByLocation, ScansByDevice, ScanLogResponse, ContactSubmissionResponse, TimeSeries, TimeSeriesResponse
+from ..auth import get_current_admin, Principal
+from ..loaders import Loaders, get_loaders
+from ..cache import etag_matches
+from ..analytics_cache import analytics_cache, analytics_key
+from ..locations import location_catalog
+from ..sketches import merge_all
+from ..config import get_settings
+from .. import timeseries
+from ..pagination import after_cursor, decode_cursor, next_cursor, iter_keyset, to_csv, to_ndjson
 
+settings = get_settings()
 router = APIRouter(prefix="/api/analytics", tags=["analytics"])
 
-@router.get("/", response_model=AnalyticsResponse)
-def get_analytics(
-    qr_id: Optional[int] = Query(None),
-    location: Optional[str] = Query(None),
-    start_date: Optional[datetime] = Query(None),
-    end_date: Optional[datetime] = Query(None),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin)
-):
-    # Base query
-    scan_query = db.query(ScanLog)
+def location_filter(location: Optional[str], location_id: Optional[int]) -> Optional[List[int]]:
+    # Resolves the dashboard's location filters to location ids: an exact id,
+    # and/or a case-insensitive substring matched against the location catalog
+    if location_id is None and not location:
+        return None
+    ids = location_catalog.match_ids(location) if location else [location_id]
+    if location_id is not None:
+        ids = [i for i in ids if i == location_id]
+    return ids
+
+def analytics_statements(
+    qr_id: Optional[int],
+    location_ids: Optional[List[int]],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime]
+) -> Dict[str, Select]:
+    # Shared by the sync and async dashboards. Totals and charts come from the
+    # daily rollups; date filters apply per day.
+    scan_filters = []
+    rollup_filters = []
+    sketch_filters = []
     
     # Apply filters
     if qr_id:
-        scan_query = scan_query.filter(ScanLog.qr_code_id == qr_id)
+        scan_filters.append(ScanLog.qr_code_id == qr_id)
+        rollup_filters.append(ScanRollup.qr_code_id == qr_id)
+        sketch_filters.append(ScanSketch.qr_code_id == qr_id)
     if start_date:
-        scan_query = scan_query.filter(ScanLog.timestamp >= start_date)
+        scan_filters.append(ScanLog.timestamp >= start_date)
+        rollup_filters.append(ScanRollup.day >= start_date.date())
+        sketch_filters.append(ScanSketch.day >= start_date.date())
     if end_date:
-        scan_query = scan_query.filter(ScanLog.timestamp <= end_date)
-    if location:
-        qr_ids = db.query(QRCode.id).filter(QRCode.location.ilike(f"%{location}%")).subquery()
-        scan_query = scan_query.filter(ScanLog.qr_code_id.in_(qr_ids))
-    
-    total_scans = scan_query.count()
-    total_qr_codes = db.query(QRCode).count()
-    
-    # Scans by date (last 30 days)
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    scans_by_date_query = db.query(
-        func.date(ScanLog.timestamp).label("date"),
-        func.count(ScanLog.id).label("count")
-    ).filter(ScanLog.timestamp >= thirty_days_ago)
-    
-    if qr_id:
-        scans_by_date_query = scans_by_date_query.filter(ScanLog.qr_code_id == qr_id)
-    
-    scans_by_date = scans_by_date_query.group_by(func.date(ScanLog.timestamp)).order_by(func.date(ScanLog.timestamp)).all()
+        scan_filters.append(ScanLog.timestamp <= end_date)
+        rollup_filters.append(ScanRollup.day <= end_date.date())
+        sketch_filters.append(ScanSketch.day <= end_date.date())
+    if location_ids is not None:
+        qr_ids = select(QRCode.id).where(QRCode.location_id.in_(location_ids))
+        scan_filters.append(ScanLog.qr_code_id.in_(qr_ids))
+        rollup_filters.append(ScanRollup.qr_code_id.in_(qr_ids))
+        sketch_filters.append(ScanSketch.qr_code_id.in_(qr_ids))
     
-    # Scans by location
-    scans_by_location = db.query(
-        QRCode.location,
-        func.count(ScanLog.id).label("count")
-    ).join(ScanLog).group_by(QRCode.location).order_by(desc("count")).limit(10).all()
+    # Scans by date (last 30 days unless a start date is given)
+    scans_by_date = select(
+        ScanRollup.day.label("date"),
+        func.sum(ScanRollup.count).label("count")
+    ).where(*rollup_filters)
+    if not start_date:
+        scans_by_date = scans_by_date.where(ScanRollup.day >= (datetime.utcnow() - timedelta(days=30)).date())
     
-    # Scans by device
-    scans_by_device = db.query(
-        ScanLog.device_type,
-        func.count(ScanLog.id).label("count")
-    ).group_by(ScanLog.device_type).all()
-    
-    # Recent scans with QR info
-    recent_scans_raw = scan_query.order_by(desc(ScanLog.timestamp)).limit(20).all()
+    return {
+        "total_scans": select(func.coalesce(func.sum(ScanRollup.count), 0)).where(*rollup_filters),
+        "all_scans": select(func.coalesce(func.sum(ScanSketch.total), 0)).where(*sketch_filters),
+        # Per-day visitor sketches, merged in build_analytics
+        "visitor_sketches": select(ScanSketch.visitors).where(*sketch_filters),
+        "total_qr_codes": select(func.count(QRCode.id)),
+        "scans_by_date": scans_by_date.group_by(ScanRollup.day).order_by(ScanRollup.day),
+        # Scans by location
+        "scans_by_location": select(
+            Location.name.label("location"),
+            func.sum(ScanRollup.count).label("count")
+        ).join(QRCode, QRCode.location_id == Location.id).join(ScanRollup, ScanRollup.qr_code_id == QRCode.id)
+        .where(*rollup_filters).group_by(Location.id, Location.name).order_by(desc("count")).limit(10),
+        # Scans by device
+        "scans_by_device": select(
+            ScanRollup.device_type,
+            func.sum(ScanRollup.count).label("count")
+        ).where(*rollup_filters).group_by(ScanRollup.device_type),
+        # Recent scans with QR info
+        "recent_scans": select(ScanLog).where(*scan_filters).order_by(desc(ScanLog.timestamp)).limit(20),
+    }
+
+def build_analytics(rows: Dict[str, list], recent_scans_raw: List[ScanLog], qrs: Dict[int, QRCode]) -> AnalyticsResponse:
     recent_scans = []
     for s in recent_scans_raw:
-        qr = db.query(QRCode).filter(QRCode.id == s.qr_code_id).first()
+        qr = qrs.get(s.qr_code_id)
         recent_scans.append(ScanLogResponse(
             id=s.id,
             qr_code_id=s.qr_code_id,
@@ -79,44 +109,165 @@ def get_analytics(
         ))
     
     return AnalyticsResponse(
-        total_scans=total_scans,
-        total_qr_codes=total_qr_codes,
-        scans_by_date=[ScansByDate(date=str(s.date), count=s.count) for s in scans_by_date],
-        scans_by_location=[ScansByLocation(location=s.location or "Unknown", count=s.count) for s in scans_by_location],
-        scans_by_device=[ScansByDevice(device_type=s.device_type or "Unknown", count=s.count) for s in scans_by_device],
+        total_scans=rows["total_scans"][0][0],
+        all_scans=rows["all_scans"][0][0],
+        unique_visitors=merge_all(r.visitors for r in rows["visitor_sketches"]).count(),
+        total_qr_codes=rows["total_qr_codes"][0][0],
+        scans_by_date=[ScansByDate(date=str(s.date), count=s.count) for s in rows["scans_by_date"]],
+        scans_by_location=[ScansByLocation(location=s.location or "Unknown", count=s.count) for s in rows["scans_by_location"]],
+        scans_by_device=[ScansByDevice(device_type=s.device_type or "Unknown", count=s.count) for s in rows["scans_by_device"]],
         recent_scans=recent_scans
     )
 
+def analytics_response(request: Request, body: str, etag: str) -> Response:
+    # Polling clients revalidate with If-None-Match and skip the JSON entirely
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/", response_model=AnalyticsResponse)
+def get_analytics(
+    request: Request,
+    qr_id: Optional[int] = Query(None),
+    location: Optional[str] = Query(None),
+    location_id: Optional[int] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+    loaders: Loaders = Depends(get_loaders),
+    current_user: Principal = Depends(get_current_admin)
+):
+    def compute() -> str:
+        statements = analytics_statements(qr_id, location_filter(location, location_id), start_date, end_date)
+        recent_scans_raw = db.execute(statements.pop("recent_scans")).scalars().all()
+        rows = {name: db.execute(stmt).all() for name, stmt in statements.items()}
+        recent_ids = list({s.qr_code_id for s in recent_scans_raw})
+        qrs = dict(zip(recent_ids, loaders.qr_codes.load_many(recent_ids)))
+        return build_analytics(rows, recent_scans_raw, qrs).model_dump_json()
+    
+    key = analytics_key(qr_id, location, location_id, start_date, end_date)
+    body, etag = analytics_cache.get_or_compute(key, compute)
+    return analytics_response(request, body, etag)
+
+@router.get("/timeseries", response_model=TimeSeriesResponse)
+def get_timeseries(
+    request: Request,
+    granularity: Literal["hour", "day", "week", "month"] = Query("day"),
+    tz: str = Query("UTC"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    qr_ids: Optional[List[int]] = Query(None),
+    locations: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db),
+    loaders: Loaders = Depends(get_loaders),
+    current_user: Principal = Depends(get_current_admin)
+):
+    # One series per QR code or per location (naive dates are in `tz`), or a
+    # single series over all scans. Defaults to the last 30 days.
+    if qr_ids and locations:
+        raise HTTPException(status_code=400, detail="Compare either qr_ids or locations, not both")
+    try:
+        zone = timeseries.get_zone(tz)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    requested = list(dict.fromkeys(qr_ids or locations or []))
+    if len(requested) > settings.timeseries_max_series:
+        raise HTTPException(status_code=400, detail=f"At most {settings.timeseries_max_series} series per request")
+
+    if qr_ids:
+        by = "qr"
+        qrs = loaders.qr_codes.load_many(requested)
+        missing = [str(i) for i, qr in zip(requested, qrs) if qr is None]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"QR code not found: {', '.join(missing)}")
+        ids, labels = requested, [qr.name for qr in qrs]
+    elif locations:
+        by = "location"
+        entries = [location_catalog.get(name) for name in requested]
+        missing = [name for name, entry in zip(requested, entries) if entry is None]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Location not found: {', '.join(missing)}")
+        ids, labels = [e.id for e in entries], [e.name for e in entries]
+    else:
+        by, ids, labels = None, [], ["All scans"]
+
+    def compute() -> str:
+        end = timeseries.to_zone(end_date, zone) if end_date else datetime.now(zone)
+        start = timeseries.to_zone(start_date, zone) if start_date else end - timedelta(days=30)
+        try:
+            starts, result = timeseries.query_series(db, granularity, zone, start, end, by, ids)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        buckets = [s.isoformat() for s in starts]
+        series = [
+            TimeSeries(
+                key=str(key), label=label, counts=counts, total=total, share=share,
+                peak=buckets[peak] if peak >= 0 else None,
+            )
+            for key, label, counts, total, share, peak in zip(
+                ids or ["all"], labels, result["counts"], result["totals"], result["shares"], result["peaks"])
+        ]
+        return TimeSeriesResponse(granularity=granularity, timezone=tz, buckets=buckets,
+                                  totals=result["bucket_totals"], series=series).model_dump_json()
+
+    key = ("timeseries", granularity, tz, start_date and start_date.isoformat(), end_date and end_date.isoformat(),
+           by, tuple(ids))
+    body, etag = analytics_cache.get_or_compute(key, compute)
+    return analytics_response(request, body, etag)
+
 @router.get("/qr/{qr_id}/scans")
 def get_qr_scans(
     qr_id: int,
-    limit: int = Query(100, le=500),
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin)
+    current_user: Principal = Depends(get_current_admin)
 ):
-    scans = db.query(ScanLog).filter(ScanLog.qr_code_id == qr_id).order_by(desc(ScanLog.timestamp)).limit(limit).all()
+    query = db.query(ScanLog).filter(ScanLog.qr_code_id == qr_id)
+    query = after_cursor(query, ScanLog.timestamp, ScanLog.id, decode_cursor(cursor))
+    scans = query.order_by(desc(ScanLog.timestamp), desc(ScanLog.id)).limit(limit).all()
+    token = next_cursor(scans, limit, "timestamp")
+    if token:
+        response.headers["X-Next-Cursor"] = token
     return [ScanLogResponse.model_validate(s) for s in scans]
 
 @router.get("/locations")
-def get_locations(db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
-    locations = db.query(QRCode.location).distinct().all()
-    return [loc[0] for loc in locations if loc[0]]
+def get_locations(current_user: Principal = Depends(get_current_admin)):
+    return location_catalog.names()
+
+@router.get("/locations/search", response_model=List[LocationResponse])
+def search_locations(
+    q: str = Query(""),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: Principal = Depends(get_current_admin)
+):
+    return [LocationResponse(id=e.id, name=e.name) for e in location_catalog.search(q, limit)]
 
 
 @router.get("/contacts", response_model=List[ContactSubmissionResponse])
 def get_contacts(
+    response: Response,
     qr_id: Optional[int] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin)
+    loaders: Loaders = Depends(get_loaders),
+    current_user: Principal = Depends(get_current_admin)
 ):
     query = db.query(ContactSubmission)
     if qr_id:
         query = query.filter(ContactSubmission.qr_code_id == qr_id)
+    query = after_cursor(query, ContactSubmission.created_at, ContactSubmission.id, decode_cursor(cursor))
     
-    contacts_raw = query.order_by(desc(ContactSubmission.created_at)).limit(50).all()
+    contacts_raw = query.order_by(desc(ContactSubmission.created_at), desc(ContactSubmission.id)).limit(limit).all()
+    token = next_cursor(contacts_raw, limit, "created_at")
+    if token:
+        response.headers["X-Next-Cursor"] = token
+    contact_qrs = loaders.qr_codes.load_many(c.qr_code_id for c in contacts_raw)
     contacts = []
-    for c in contacts_raw:
-        qr = db.query(QRCode).filter(QRCode.id == c.qr_code_id).first()
+    for c, qr in zip(contacts_raw, contact_qrs):
         contacts.append(ContactSubmissionResponse(
             id=c.id,
             qr_code_id=c.qr_code_id,
@@ -128,3 +279,47 @@ def get_contacts(
             created_at=c.created_at
         ))
     return contacts
+
+
+# Full-history exports. Rows are streamed in keyset pages, so memory use does
+# not depend on the size of the export.
+
+SCAN_EXPORT_COLUMNS = ["id", "qr_code_id", "timestamp", "ip_address", "device_type", "browser", "os", "country", "city", "user_agent"]
+CONTACT_EXPORT_COLUMNS = ["id", "qr_code_id", "scan_id", "name", "phone", "message", "created_at"]
+
+def _export_response(rows, columns: List[str], format: str, name: str) -> StreamingResponse:
+    if format == "ndjson":
+        return StreamingResponse(to_ndjson(rows, columns), media_type="application/x-ndjson",
+                                 headers={"Content-Disposition": f"attachment; filename={name}.ndjson"})
+    return StreamingResponse(to_csv(rows, columns), media_type="text/csv",
+                             headers={"Content-Disposition": f"attachment; filename={name}.csv"})
+
+@router.get("/export/scans")
+def export_scans(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    qr_id: Optional[int] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    current_user: Principal = Depends(get_current_admin)
+):
+    stmt = select(*(getattr(ScanLog, c) for c in SCAN_EXPORT_COLUMNS))
+    if qr_id:
+        stmt = stmt.where(ScanLog.qr_code_id == qr_id)
+    if start_date:
+        stmt = stmt.where(ScanLog.timestamp >= start_date)
+    if end_date:
+        stmt = stmt.where(ScanLog.timestamp <= end_date)
+    rows = iter_keyset(stmt, ScanLog.timestamp, ScanLog.id)
+    return _export_response(rows, SCAN_EXPORT_COLUMNS, format, "scans")
+
+@router.get("/export/contacts")
+def export_contacts(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    qr_id: Optional[int] = Query(None),
+    current_user: Principal = Depends(get_current_admin)
+):
+    stmt = select(*(getattr(ContactSubmission, c) for c in CONTACT_EXPORT_COLUMNS))
+    if qr_id:
+        stmt = stmt.where(ContactSubmission.qr_code_id == qr_id)
+    rows = iter_keyset(stmt, ContactSubmission.created_at, ContactSubmission.id)
+    return _export_response(rows, CONTACT_EXPORT_COLUMNS, format, "contacts")
@@ -0,0 +1,65 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import Optional
+from ..database import get_async_db
+from ..models import QRCode
+from ..schemas import AnalyticsResponse
+from ..auth import get_current_admin, Principal
+from ..dedup import seen_index
+from ..sketches import recorder
+from ..landing import get_landing_async
+from .scan import client_ip, scan_event, record_scan
+from ..ratelimit import rate_limit
+from ..analytics_cache import analytics_cache, analytics_key
+from .analytics import analytics_statements, analytics_response, build_analytics, location_filter
+
+# Async versions of the hottest routes, registered ahead of the sync routers
+# when ASYNC_DATABASE is enabled so they take precedence for these paths.
+# They don't hold a threadpool thread while waiting on the database.
+
+router = APIRouter(tags=["async"])
+
+@router.get("/api/scan/{qr_id}", dependencies=[Depends(rate_limit("scan"))])
+async def scan_qrcode_async(qr_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    landing = await get_landing_async(db, qr_id)
+    if not landing or not landing["is_active"]:
+        raise HTTPException(status_code=404, detail="QR code not found or inactive")
+    
+    ip = client_ip(request)
+    recorder.record(qr_id, ip)
+    if not await seen_index.seen_async(qr_id, ip, db):
+        # A full queue drops the scan rather than block the event loop
+        record_scan(scan_event(qr_id, request), block=False)
+    
+    return landing["payload"]
+
+@router.get("/api/analytics/", response_model=AnalyticsResponse)
+async def get_analytics_async(
+    request: Request,
+    qr_id: Optional[int] = Query(None),
+    location: Optional[str] = Query(None),
+    location_id: Optional[int] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_admin)
+):
+    async def compute() -> str:
+        # The catalog may need a (sync) reload, so resolve it off the event loop
+        location_ids = await run_in_threadpool(location_filter, location, location_id)
+        statements = analytics_statements(qr_id, location_ids, start_date, end_date)
+        recent_scans_raw = (await db.execute(statements.pop("recent_scans"))).scalars().all()
+        rows = {name: (await db.execute(stmt)).all() for name, stmt in statements.items()}
+        recent_ids = {s.qr_code_id for s in recent_scans_raw}
+        qrs = {}
+        if recent_ids:
+            result = await db.execute(select(QRCode).where(QRCode.id.in_(recent_ids)))
+            qrs = {qr.id: qr for qr in result.scalars()}
+        return build_analytics(rows, recent_scans_raw, qrs).model_dump_json()
+    
+    key = analytics_key(qr_id, location, location_id, start_date, end_date)
+    body, etag = await analytics_cache.get_or_compute_async(key, compute)
+    return analytics_response(request, body, etag)
@@ -1,42 +1,61 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from ..database import get_db
 from ..models import User
 from ..schemas import UserCreate, UserResponse, Token
-from ..auth import get_password_hash, authenticate_user, create_access_token, get_current_user
+from ..auth import authenticate_user, create_user_token, get_current_user, Principal
+from ..passwords import PasswordHasherBusy, hasher
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
-@router.post("/register", response_model=UserResponse)
-def register(user_data: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user_data.email).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
+# Login and signup are async so bcrypt waits on the password pool without
+# holding one of the threads that serve scans; only the short DB steps run in
+# the threadpool.
+
+def hasher_busy() -> HTTPException:
+    return HTTPException(status_code=503, detail="Too many sign-in attempts, try again shortly",
+                         headers={"Retry-After": "1"})
+
+def _create_user(db: Session, user_data: UserCreate, hashed_password: str) -> User:
     user = User(
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=hashed_password,
         full_name=user_data.full_name,
-        is_admin=db.query(User).count() == 0  # First user is admin
+        is_admin=db.query(User.id).first() is None  # First user is admin
     )
     db.add(user)
     db.commit()
     db.refresh(user)
     return user
 
+@router.post("/register", response_model=UserResponse)
+async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+    existing = await run_in_threadpool(lambda: db.query(User.id).filter(User.email == user_data.email).first())
+    if existing:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    try:
+        hashed_password = await hasher.hash(user_data.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
+    return await run_in_threadpool(_create_user, db, user_data, hashed_password)
+
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserResponse)
-def get_me(current_user: User = Depends(get_current_user)):
+def get_me(current_user: Principal = Depends(get_current_user)):
     return current_user
@@ -1,108 +1,277 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
-import qrcode
+from sqlalchemy import delete, insert
+from datetime import datetime
+from typing import List, Optional
+import csv
 import io
+import json
 import os
-import uuid
 from ..database import get_db
-from ..models import User, QRCode, ScanLog, ContactSubmission
-from ..schemas import QRCodeCreate, QRCodeUpdate, QRCodeResponse
-from ..auth import get_current_admin
+from ..models import QRCode, ScanLog, ScanRollup, ScanSketch, ContactSubmission
+from ..schemas import QRCodeCreate, QRCodeUpdate, QRCodeResponse, QRCodeBulkResult, QRCodeExportRequest
+from ..auth import get_current_admin, Principal
 from ..config import get_settings
+from ..loaders import Loaders, get_loaders
+from ..cache import etag_matches
+from ..qr_images import MEDIA_TYPES, MIN_CONTRAST, SVG_MODULES, contrast, image_cache, image_key, make_style, scan_url
+from ..pagination import after_cursor, decode_cursor, next_cursor
+from ..landing import get_landing, invalidate_landing
+from ..analytics_cache import analytics_cache
+from ..locations import ensure_locations, location_catalog, location_id_for, normalize
+from ..exports import EXPORT_MEDIA_TYPES, stream_pdf, stream_zip
+from .. import logos
 
 router = APIRouter(prefix="/api/qrcodes", tags=["qrcodes"])
 settings = get_settings()
 
-UPLOAD_DIR = "uploads/logos"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(settings.logo_dir, exist_ok=True)
 
 @router.post("/", response_model=QRCodeResponse)
-def create_qrcode(qr_data: QRCodeCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
-    qr = QRCode(**qr_data.model_dump(), owner_id=current_user.id)
+def create_qrcode(qr_data: QRCodeCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin)):
+    qr = QRCode(**qr_data.model_dump(), owner_id=current_user.id, location_id=location_id_for(db, qr_data.location))
     db.add(qr)
     db.commit()
     db.refresh(qr)
+    invalidate_landing(qr.id)
+    analytics_cache.invalidate()
+    location_catalog.invalidate()
     return qr
 
+@router.post("/bulk", response_model=QRCodeBulkResult)
+async def bulk_create_qrcodes(request: Request, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin)):
+    # Accepts a JSON array of QRCodeCreate objects, a text/csv body, or a CSV
+    # file upload with the same column names
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Expected a CSV file in the 'file' field")
+        rows = _parse_csv(await upload.read())
+    elif "csv" in content_type:
+        rows = _parse_csv(await request.body())
+    else:
+        try:
+            rows = json.loads(await request.body())
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="JSON body must be UTF-8")
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON at line {e.lineno}, column {e.colno}: {e.msg}")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of QR codes")
+    
+    if not rows:
+        raise HTTPException(status_code=400, detail="No QR codes to create")
+    if len(rows) > settings.bulk_max_rows:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_rows} QR codes per request")
+    
+    items, errors = [], []
+    for i, row in enumerate(rows, start=1):
+        try:
+            items.append(QRCodeCreate.model_validate(row))
+        except ValidationError as e:
+            errors.append({"row": i, "errors": e.errors(include_url=False, include_context=False)})
+    if errors:
+        raise HTTPException(status_code=422, detail=errors[:100])
+    
+    ids = await run_in_threadpool(_insert_qrcodes, db, items, current_user.id)
+    return QRCodeBulkResult(ids=ids, count=len(ids))
+
+def _parse_csv(raw: bytes) -> List[dict]:
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        # Header is line 1, so the data row is one less
+        line = raw.count(b"\n", 0, e.start) + 1
+        raise HTTPException(status_code=400, detail=f"CSV must be UTF-8; invalid bytes on line {line} (row {line - 1})")
+    reader = csv.DictReader(io.StringIO(text))
+    try:
+        # Short rows fill the missing columns with None
+        return [{k.strip(): (v.strip() or None) if v is not None else None for k, v in row.items() if k}
+                for row in reader]
+    except csv.Error as e:
+        raise HTTPException(status_code=400, detail=f"Malformed CSV on line {reader.line_num}: {e}")
+
+def _insert_qrcodes(db: Session, items: List[QRCodeCreate], owner_id: int) -> List[int]:
+    # One multi-row INSERT in a single transaction
+    now = datetime.utcnow()
+    location_ids = ensure_locations(db, [item.location for item in items])
+    values = [
+        {**item.model_dump(), "owner_id": owner_id, "location_id": location_ids.get(normalize(item.location)),
+         "is_active": True, "created_at": now, "updated_at": now}
+        for item in items
+    ]
+    stmt = insert(QRCode).returning(QRCode.id, sort_by_parameter_order=True)
+    ids = list(db.execute(stmt, values).scalars())
+    db.commit()
+    for qr_id in ids:
+        invalidate_landing(qr_id)
+    analytics_cache.invalidate()
+    location_catalog.invalidate()
+    return ids
+
+@router.post("/export")
+def export_qrcodes(req: QRCodeExportRequest, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin)):
+    ids = list(dict.fromkeys(req.ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No QR codes to export")
+    if req.image_format == "svg" and req.format == "zip" and req.module not in SVG_MODULES:
+        raise HTTPException(status_code=400, detail=f"Module style '{req.module}' is only available for PNG")
+    if contrast(req.fill, req.back) < MIN_CONTRAST:
+        raise HTTPException(status_code=400, detail="Fill and background colours don't have enough contrast to scan")
+    found = {qr.id: qr for qr in db.query(QRCode.id, QRCode.name, QRCode.location, QRCode.logo_path).filter(QRCode.id.in_(ids))}
+    missing = [i for i in ids if i not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "QR codes not found", "ids": missing[:100]})
+    
+    qrs = [
+        (i, found[i].name, found[i].location,
+         make_style(req.fill, req.back, req.module, found[i].logo_path if req.logo else None))
+        for i in ids
+    ]
+    if req.format == "pdf":
+        stream = stream_pdf(qrs, req.box_size, req.border, req.ec)
+    else:
+        stream = stream_zip(qrs, req.image_format, req.box_size, req.border, req.ec)
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[req.format],
+        headers={"Content-Disposition": f"attachment; filename=qr-codes.{req.format}"}
+    )
+
 @router.get("/", response_model=List[QRCodeResponse])
-def list_qrcodes(db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
-    qrcodes = db.query(QRCode).all()
+def list_qrcodes(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    loaders: Loaders = Depends(get_loaders),
+    current_user: Principal = Depends(get_current_admin)
+):
+    # Without a limit every code is returned, as before
+    query = after_cursor(db.query(QRCode), QRCode.created_at, QRCode.id, decode_cursor(cursor), descending=False)
+    query = query.order_by(QRCode.created_at, QRCode.id)
+    if limit:
+        query = query.limit(limit)
+    qrcodes = query.all()
+    token = limit and next_cursor(qrcodes, limit, "created_at")
+    if token:
+        response.headers["X-Next-Cursor"] = token
+    scan_counts = loaders.scan_counts.load_many(qr.id for qr in qrcodes)
     result = []
-    for qr in qrcodes:
+    for qr, scan_count in zip(qrcodes, scan_counts):
         qr_dict = QRCodeResponse.model_validate(qr)
-        qr_dict.scan_count = db.query(ScanLog).filter(ScanLog.qr_code_id == qr.id).count()
+        qr_dict.scan_count = scan_count
         result.append(qr_dict)
     return result
 
 @router.get("/{qr_id}", response_model=QRCodeResponse)
-def get_qrcode(qr_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
+def get_qrcode(qr_id: int, loaders: Loaders = Depends(get_loaders), current_user: Principal = Depends(get_current_admin)):
+    qr = loaders.qr_codes.load(qr_id)
     if not qr:
         raise HTTPException(status_code=404, detail="QR code not found")
     qr_response = QRCodeResponse.model_validate(qr)
-    qr_response.scan_count = db.query(ScanLog).filter(ScanLog.qr_code_id == qr.id).count()
+    qr_response.scan_count = loaders.scan_counts.load(qr.id)
     return qr_response
 
 @router.put("/{qr_id}", response_model=QRCodeResponse)
-def update_qrcode(qr_id: int, qr_data: QRCodeUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
+def update_qrcode(qr_id: int, qr_data: QRCodeUpdate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin)):
     qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
     if not qr:
         raise HTTPException(status_code=404, detail="QR code not found")
     
     for key, value in qr_data.model_dump(exclude_unset=True).items():
         setattr(qr, key, value)
+        if key == "location":
+            qr.location_id = location_id_for(db, value)
     db.commit()
     db.refresh(qr)
+    invalidate_landing(qr_id)
+    analytics_cache.invalidate()
+    location_catalog.invalidate()
     return qr
 
 @router.delete("/{qr_id}")
-def delete_qrcode(qr_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
-    if not qr:
+def delete_qrcode(qr_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin)):
+    # Set-based deletes: dependent rows are never loaded into the session
+    db.execute(delete(ContactSubmission).where(ContactSubmission.qr_code_id == qr_id))
+    db.execute(delete(ScanLog).where(ScanLog.qr_code_id == qr_id))
+    db.execute(delete(ScanRollup).where(ScanRollup.qr_code_id == qr_id))
+    db.execute(delete(ScanSketch).where(ScanSketch.qr_code_id == qr_id))
+    if db.execute(delete(QRCode).where(QRCode.id == qr_id)).rowcount == 0:
+        db.rollback()
         raise HTTPException(status_code=404, detail="QR code not found")
-    
-    # Delete related records first
-    db.query(ContactSubmission).filter(ContactSubmission.qr_code_id == qr_id).delete()
-    db.query(ScanLog).filter(ScanLog.qr_code_id == qr_id).delete()
-    
-    db.delete(qr)
     db.commit()
+    invalidate_landing(qr_id)
+    analytics_cache.invalidate()
+    location_catalog.invalidate()
     return {"message": "QR code deleted"}
 
-@router.post("/{qr_id}/logo")
-async def upload_logo(qr_id: int, file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
+@router.post("/{qr_id}/logo", openapi_extra={"requestBody": {"content": {"multipart/form-data": {"schema": {
+    "type": "object", "properties": {"file": {"type": "string", "format": "binary"}}, "required": ["file"]}}}}})
+async def upload_logo(qr_id: int, request: Request, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin)):
+    # The form is parsed by hand so an oversized upload is refused before any of
+    # it is read
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > settings.logo_max_bytes + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"Logo must be at most {settings.logo_max_bytes} bytes")
+    qr = await run_in_threadpool(db.get, QRCode, qr_id)
     if not qr:
         raise HTTPException(status_code=404, detail="QR code not found")
     
-    ext = file.filename.split(".")[-1]
-    filename = f"{uuid.uuid4()}.{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
+    form = await request.form(max_files=1, max_fields=10)
+    upload = form.get("file")
+    if upload is None or isinstance(upload, str):
+        raise HTTPException(status_code=400, detail="Expected an image in the 'file' field")
+    try:
+        logo = await logos.save_upload(upload)
+    except logos.LogoTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except logos.InvalidLogo as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {exc}")
+    finally:
+        await form.close()
     
-    with open(filepath, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    
-    qr.logo_path = filepath
-    db.commit()
-    return {"logo_path": filepath}
+    qr.logo_path = logo.path
+    await run_in_threadpool(db.commit)
+    invalidate_landing(qr_id)
+    return {"logo_path": logo.path, "logo_url": f"/api/scan/logos/{logo.digest}", "variants": logo.manifest}
 
 @router.get("/{qr_id}/image")
-def get_qr_image(qr_id: int, db: Session = Depends(get_db)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
-    if not qr:
+def get_qr_image(
+    qr_id: int,
+    request: Request,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    box_size: int = Query(10, ge=1, le=50),
+    border: int = Query(4, ge=0, le=20),
+    ec: str = Query("M", pattern="^[LMQH]$"),
+    fill: str = Query("#000000", pattern="^#[0-9a-fA-F]{6}$"),
+    back: str = Query("#ffffff", pattern="^#[0-9a-fA-F]{6}$"),
+    module: str = Query("square", pattern="^(square|rounded|circle|gapped)$"),
+    logo: bool = Query(True, description="Embed the uploaded logo, if any (forces error correction H)"),
+    db: Session = Depends(get_db)
+):
+    entry = get_landing(db, qr_id)
+    if not entry:
         raise HTTPException(status_code=404, detail="QR code not found")
+    if format == "svg" and module not in SVG_MODULES:
+        raise HTTPException(status_code=400, detail=f"Module style '{module}' is only available for PNG")
+    if contrast(fill, back) < MIN_CONTRAST:
+        raise HTTPException(status_code=400, detail="Fill and background colours don't have enough contrast to scan")
     
-    scan_url = f"{settings.frontend_url}/scan/{qr_id}"
-    qr_img = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr_img.add_data(scan_url)
-    qr_img.make(fit=True)
-    img = qr_img.make_image(fill_color="black", back_color="white")
+    data = scan_url(qr_id)
+    style = make_style(fill, back, module, entry["logo_path"] if logo else None)
+    etag = f'"{image_key(data, format, box_size, border, ec, style)}"'
+    # A code with a logo renders differently when the logo is replaced, so its
+    # image is only cached briefly and revalidated with the ETag
+    max_age = 300 if logo and entry["logo_path"] else settings.qr_image_max_age
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
     
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="image/png")
+    _, content = image_cache.get_or_render(data, format, box_size, border, ec, style)
+    return Response(content=content, media_type=MEDIA_TYPES[format], headers=headers)
@@ -1,75 +1,95 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import FileResponse, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from user_agents import parse
 from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+import os
 from ..database import get_db
-from ..models import QRCode, ScanLog, ContactSubmission
+from ..models import ContactSubmission
 from ..schemas import QRCodeResponse, ContactSubmissionCreate
+from ..scan_pipeline import pipeline
+from ..dedup import seen_index
+from ..sketches import recorder
+from ..landing import get_landing
+from ..ua import classify
+from ..cache import etag_matches
+from ..ratelimit import client_ip, rate_limit
+from .. import logos
 
 router = APIRouter(prefix="/api/scan", tags=["scan"])
 
-@router.get("/{qr_id}")
-def scan_qrcode(qr_id: int, request: Request, db: Session = Depends(get_db)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id, QRCode.is_active == True).first()
-    if not qr:
-        raise HTTPException(status_code=404, detail="QR code not found or inactive")
-    
+def scan_event(qr_id: int, request: Request) -> dict:
     # Parse user agent
     user_agent_str = request.headers.get("user-agent", "")
-    user_agent = parse(user_agent_str)
-    
-    device_type = "mobile" if user_agent.is_mobile else "tablet" if user_agent.is_tablet else "desktop"
-    
-    # Get client IP
-    forwarded = request.headers.get("x-forwarded-for")
-    ip = forwarded.split(",")[0] if forwarded else request.client.host
+    ua = classify(user_agent_str)
     
-    # Check if this IP has EVER scanned this specific QR code before
-    existing_scan = db.query(ScanLog).filter(
-        and_(
-            ScanLog.qr_code_id == qr_id,
-            ScanLog.ip_address == ip
-        )
-    ).first()
+    return {
+        "qr_code_id": qr_id,
+        "timestamp": datetime.utcnow(),
+        "ip_address": client_ip(request),
+        "user_agent": user_agent_str,
+        "device_type": ua.device_type,
+        "browser": ua.browser,
+        "os": ua.os,
+    }
+
+def record_scan(event: dict, block: bool = True):
+    # The write is handed to the scan pipeline so the response doesn't wait on it
+    seen_index.mark(event["qr_code_id"], event["ip_address"])
+    if not pipeline.submit(event, block=block):
+        seen_index.forget(event["qr_code_id"], event["ip_address"])
+
+@router.get("/{qr_id}", dependencies=[Depends(rate_limit("scan"))])
+def scan_qrcode(qr_id: int, request: Request, db: Session = Depends(get_db)):
+    landing = get_landing(db, qr_id)
+    if not landing or not landing["is_active"]:
+        raise HTTPException(status_code=404, detail="QR code not found or inactive")
     
-    # Only log the scan if this IP has never scanned this QR code before
-    if not existing_scan:
-        scan = ScanLog(
-            qr_code_id=qr_id,
-            ip_address=ip,
-            user_agent=user_agent_str,
-            device_type=device_type,
-            browser=f"{user_agent.browser.family} {user_agent.browser.version_string}",
-            os=f"{user_agent.os.family} {user_agent.os.version_string}"
-        )
-        db.add(scan)
-        db.commit()
+    # Every scan is counted; only an IP's first scan of this QR code is logged
+    ip = client_ip(request)
+    recorder.record(qr_id, ip)
+    if not seen_index.seen(qr_id, ip, db):
+        record_scan(scan_event(qr_id, request))
     
     # Return QR code details for the landing page
-    return {
-        "id": qr.id,
-        "name": qr.name,
-        "location": qr.location,
-        "company_name": qr.company_name,
-        "phone_number": qr.phone_number,
-        "description": qr.description,
-        "logo_path": qr.logo_path
-    }
+    return landing["payload"]
+
+def logo_response(request: Request, digest: str, width: Optional[int], cache_control: str) -> Response:
+    manifest = logos.load_manifest(digest)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Logo not found")
+    name, media_type = logos.choose_variant(manifest, request.headers.get("accept"), width)
+    etag = f'"{digest[:32]}-{name}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(logos.variant_path(digest, name), media_type=media_type, headers=headers)
+
+@router.get("/logos/{digest}", dependencies=[Depends(rate_limit("logo"))])
+def get_logo_variant(digest: str, request: Request, w: Optional[int] = Query(None, ge=1, le=4096)):
+    # The URL names the content, so it never changes
+    if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Logo not found")
+    return logo_response(request, digest, w, "public, max-age=31536000, immutable")
 
-@router.get("/{qr_id}/logo")
-def get_logo(qr_id: int, db: Session = Depends(get_db)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
-    if not qr or not qr.logo_path:
+@router.get("/{qr_id}/logo", dependencies=[Depends(rate_limit("logo"))])
+def get_logo(qr_id: int, request: Request, w: Optional[int] = Query(None, ge=1, le=4096), db: Session = Depends(get_db)):
+    landing = get_landing(db, qr_id)
+    if not landing or not landing["logo_path"]:
         raise HTTPException(status_code=404, detail="Logo not found")
-    return FileResponse(qr.logo_path)
+    digest = logos.digest_from_path(landing["logo_path"])
+    if digest is None:
+        if not os.path.exists(landing["logo_path"]):
+            raise HTTPException(status_code=404, detail="Logo not found")
+        return FileResponse(landing["logo_path"])
+    # The QR code's logo can be replaced, so this URL is only cached briefly
+    return logo_response(request, digest, w, "public, max-age=300")
 
 
-@router.post("/{qr_id}/contact")
+@router.post("/{qr_id}/contact", dependencies=[Depends(rate_limit("contact"))])
 def submit_contact(qr_id: int, data: ContactSubmissionCreate, db: Session = Depends(get_db)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
-    if not qr:
+    if not get_landing(db, qr_id):
         raise HTTPException(status_code=404, detail="QR code not found")
     
     contact = ContactSubmission(
@@ -84,11 +104,12 @@ def submit_contact(qr_id: int, data: ContactSubmissionCreate, db: Session = Depe
     return {"message": "Contact submitted successfully"}
 
 
-@router.get("/{qr_id}/vcard")
+@router.get("/{qr_id}/vcard", dependencies=[Depends(rate_limit("vcard"))])
 def get_vcard(qr_id: int, db: Session = Depends(get_db)):
-    qr = db.query(QRCode).filter(QRCode.id == qr_id).first()
-    if not qr:
+    landing = get_landing(db, qr_id)
+    if not landing:
         raise HTTPException(status_code=404, detail="QR code not found")
+    qr = SimpleNamespace(**landing["payload"])
     
     # Build vCard content
     vcard = f"""BEGIN:VCARD
@@ -0,0 +1,188 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .database import engine
+from .models import QRCode, ScanLog
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ScanPipeline:
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float, put_timeout: float):
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        # Stages run on the worker thread before a batch is written; flush hooks run
+        # inside the same transaction with the rows that were written; listeners
+        # are told about those rows once the transaction has committed. Failure
+        # listeners get the rows of a batch that could not be written.
+        self.stages: List[Callable[[List[dict]], List[dict]]] = []
+        self.flush_hooks: List[Callable] = []
+        self.listeners: List[Callable[[List[dict]], None]] = []
+        self.failure_listeners: List[Callable[[List[dict]], None]] = []
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "overflow": 0, "duplicates": 0, "batches": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _bump(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def add_stage(self, fn: Callable[[List[dict]], List[dict]]):
+        self.stages.append(fn)
+
+    def add_flush_hook(self, fn: Callable):
+        self.flush_hooks.append(fn)
+
+    def add_listener(self, fn: Callable[[List[dict]], None]):
+        self.listeners.append(fn)
+
+    def add_failure_listener(self, fn: Callable[[List[dict]], None]):
+        self.failure_listeners.append(fn)
+
+    def submit(self, row: dict, block: bool = True) -> bool:
+        # Callers on an event loop pass block=False: a full queue drops the
+        # row straight away instead of stalling every coroutine on the loop
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            # Backpressure: give the worker a short window to drain before dropping
+            self._bump("overflow")
+            try:
+                if not block:
+                    raise queue.Full
+                self.queue.put(row, timeout=self.put_timeout)
+            except queue.Full:
+                self._bump("dropped")
+                return False
+        self._bump("enqueued")
+        return True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="scan-pipeline", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if not self._thread:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        batch: List[dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._drain(batch)
+                return
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self.flush(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _drain(self, batch: List[dict]):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+
+    def flush(self, rows: List[dict]):
+        batch = rows
+        try:
+            for stage in self.stages:
+                rows = stage(rows)
+            if not rows:
+                return
+            with engine.begin() as conn:
+                written = _insert_if_absent(conn, rows)
+                for hook in self.flush_hooks:
+                    hook(conn, written)
+            self._bump("written", len(written))
+            self._bump("duplicates", len(rows) - len(written))
+            self._bump("batches")
+        except Exception:
+            self._bump("failed", len(rows))
+            logger.exception("Failed to write %d scan events", len(rows))
+            for listener in self.failure_listeners:
+                try:
+                    listener(batch)
+                except Exception:
+                    logger.exception("Scan failure listener %r failed", listener)
+            return
+        for listener in self.listeners:
+            try:
+                listener(written)
+            except Exception:
+                logger.exception("Scan listener %r failed", listener)
+
+
+def _insert_if_absent(conn, rows: List[dict]) -> List[dict]:
+    # Skip rows whose (qr_code_id, ip_address) already exists, whether from an earlier
+    # batch, another worker, or twice in this batch. Returns the rows actually inserted.
+    unique = {}
+    for row in rows:
+        unique.setdefault((row["qr_code_id"], row["ip_address"]), row)
+    # A QR code can be deleted while its scans are still queued; drop those rows
+    # rather than failing the whole batch on the foreign key
+    qr_ids = {qr_id for qr_id, _ in unique}
+    existing = set(conn.execute(select(QRCode.id).where(QRCode.id.in_(qr_ids))).scalars())
+    rows = [row for key, row in unique.items() if key[0] in existing]
+    if rows and settings.scan_log_partitioning:
+        # Partitions only enforce (qr_code_id, ip_address) within their own month
+        pairs = [(row["qr_code_id"], row["ip_address"]) for row in rows]
+        seen = set(conn.execute(
+            select(ScanLog.qr_code_id, ScanLog.ip_address).where(tuple_(ScanLog.qr_code_id, ScanLog.ip_address).in_(pairs))
+        ).tuples())
+        rows = [row for row in rows if (row["qr_code_id"], row["ip_address"]) not in seen]
+    if not rows:
+        return []
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        stmt = pg_insert(ScanLog).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(ScanLog).on_conflict_do_nothing()
+    else:
+        conn.execute(insert(ScanLog), rows)
+        return rows
+    result = conn.execute(stmt.returning(*ScanLog.__table__.c), rows)
+    return [dict(r._mapping) for r in result]
+
+
+pipeline = ScanPipeline(
+    maxsize=settings.scan_queue_size,
+    batch_size=settings.scan_batch_size,
+    flush_interval=settings.scan_flush_interval,
+    put_timeout=settings.scan_queue_put_timeout,
+)
@@ -1,6 +1,9 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal
+from .config import get_settings
+
+settings = get_settings()
 
 # Auth schemas
 class UserCreate(BaseModel):
@@ -56,6 +59,26 @@ class QRCodeResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class LocationResponse(BaseModel):
+    id: int
+    name: str
+
+class QRCodeBulkResult(BaseModel):
+    ids: List[int]
+    count: int
+
+class QRCodeExportRequest(BaseModel):
+    ids: List[int] = Field(..., max_length=settings.bulk_max_rows)
+    format: Literal["zip", "pdf"] = "zip"
+    image_format: Literal["png", "svg"] = "png"
+    box_size: int = Field(10, ge=1, le=50)
+    border: int = Field(4, ge=0, le=20)
+    ec: Literal["L", "M", "Q", "H"] = "M"
+    fill: str = Field("#000000", pattern="^#[0-9a-fA-F]{6}$")
+    back: str = Field("#ffffff", pattern="^#[0-9a-fA-F]{6}$")
+    module: Literal["square", "rounded", "circle", "gapped"] = "square"
+    logo: bool = True
+
 # Scan schemas
 class ScanLogResponse(BaseModel):
     id: int
@@ -86,13 +109,34 @@ class ScansByDevice(BaseModel):
     count: int
 
 class AnalyticsResponse(BaseModel):
+    # total_scans counts first scans per visitor and QR code; all_scans includes
+    # repeats and unique_visitors is a HyperLogLog estimate over the filters
     total_scans: int
+    all_scans: int = 0
+    unique_visitors: int = 0
     total_qr_codes: int
     scans_by_date: List[ScansByDate]
     scans_by_location: List[ScansByLocation]
     scans_by_device: List[ScansByDevice]
     recent_scans: List[ScanLogResponse]
 
+class TimeSeries(BaseModel):
+    # key is the QR code or location id, or "all" for an unsplit series
+    key: str
+    label: str
+    counts: List[int]
+    total: int
+    share: float
+    peak: Optional[str] = None
+
+class TimeSeriesResponse(BaseModel):
+    # Bucket start times in the requested zone; every series has one count per bucket
+    granularity: str
+    timezone: str
+    buckets: List[str]
+    totals: List[int]
+    series: List[TimeSeries]
+
 
 # Contact submission schemas
 class ContactSubmissionCreate(BaseModel):
@@ -0,0 +1,307 @@
+import argparse
+import hashlib
+import logging
+import math
+import struct
+import threading
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, delete, insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .database import engine
+from .models import QRCode, ScanLog, ScanSketch
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Constant-memory scan counting. Every scan, repeats included, bumps a counter and
+# adds the visitor's IP to a HyperLogLog for its (QR code, day). Both are kept in
+# memory between flushes and merged into scan_sketches, so the scan path does no
+# database work. Sketches merge losslessly, so unique visitors over any range
+# of days and set of codes come from the stored rows alone, without touching
+# scan_logs.
+
+SPARSE, DENSE = 1, 0
+_INV_POW2 = [2.0 ** -r for r in range(65)]
+
+
+class HyperLogLog:
+    # Registers start out sparse ({index: rank}) and switch to a dense bytearray
+    # once a quarter of them are set; small per-day sketches stay a few bytes.
+    __slots__ = ("p", "m", "sparse", "registers")
+
+    def __init__(self, p: int = 12):
+        if not 4 <= p <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.p = p
+        self.m = 1 << p
+        self.sparse: Optional[Dict[int, int]] = {}
+        self.registers: Optional[bytearray] = None
+
+    def add(self, value: str):
+        h = int.from_bytes(hashlib.blake2b(value.encode("utf-8", "surrogateescape"), digest_size=8).digest(), "big")
+        width = 64 - self.p
+        self._set(h >> width, width - (h & ((1 << width) - 1)).bit_length() + 1)
+
+    def _set(self, index: int, rank: int):
+        if self.sparse is not None:
+            if rank > self.sparse.get(index, 0):
+                self.sparse[index] = rank
+                if len(self.sparse) > self.m // 4:
+                    self._densify()
+        elif rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _densify(self):
+        registers = bytearray(self.m)
+        for index, rank in self.sparse.items():
+            registers[index] = rank
+        self.registers, self.sparse = registers, None
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.p != self.p:
+            raise ValueError(f"Can't merge sketches of precision {other.p} into {self.p}")
+        if other.sparse is not None:
+            for index, rank in other.sparse.items():
+                self._set(index, rank)
+            return self
+        if self.sparse is not None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        if self.sparse is not None:
+            zeros = self.m - len(self.sparse)
+            total = zeros + sum(_INV_POW2[r] for r in self.sparse.values())
+        else:
+            zeros = self.registers.count(0)
+            total = sum(_INV_POW2[r] for r in self.registers)
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / total
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        if self.sparse is not None:
+            indexes = sorted(self.sparse)
+            return (bytes((self.p, SPARSE)) + struct.pack(f">{len(indexes)}H", *indexes)
+                    + bytes(self.sparse[i] for i in indexes))
+        return bytes((self.p, DENSE)) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        sketch = cls(data[0])
+        if data[1] == SPARSE:
+            n = (len(data) - 2) // 3
+            indexes = struct.unpack(f">{n}H", data[2:2 + 2 * n])
+            sketch.sparse = dict(zip(indexes, data[2 + 2 * n:]))
+        else:
+            sketch.sparse, sketch.registers = None, bytearray(data[2:])
+        return sketch
+
+
+def merge_all(blobs: Iterable[bytes], p: Optional[int] = None) -> HyperLogLog:
+    merged = None
+    for blob in blobs:
+        sketch = HyperLogLog.from_bytes(blob)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged or HyperLogLog(p or settings.sketch_precision)
+
+
+Key = Tuple[int, date]
+
+
+class SketchRecorder:
+    def __init__(self, precision: int, flush_interval: float):
+        self.precision = precision
+        self.flush_interval = flush_interval
+        self.listeners: List[Callable[[List[Key]], None]] = []
+        self.stats = {"recorded": 0, "flushes": 0, "failed": 0}
+        self._pending: Dict[Key, list] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_listener(self, fn: Callable[[List[Key]], None]):
+        self.listeners.append(fn)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def record(self, qr_id: int, ip: str, when: Optional[datetime] = None):
+        key = (qr_id, (when or datetime.utcnow()).date())
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = [0, HyperLogLog(self.precision)]
+            entry[0] += 1
+            entry[1].add(ip)
+            self.stats["recorded"] += 1
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="scan-sketches", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with engine.begin() as conn:
+                write(conn, pending)
+        except Exception:
+            # Keep the counts for the next attempt
+            logger.exception("Failed to write %d scan sketches", len(pending))
+            with self._lock:
+                self.stats["failed"] += 1
+                for key, (total, sketch) in pending.items():
+                    entry = self._pending.get(key)
+                    if entry is None:
+                        self._pending[key] = [total, sketch]
+                    else:
+                        entry[0] += total
+                        entry[1].merge(sketch)
+            return
+        with self._lock:
+            self.stats["flushes"] += 1
+        for listener in self.listeners:
+            try:
+                listener(list(pending))
+            except Exception:
+                logger.exception("Sketch listener %r failed", listener)
+
+
+def _ensure_rows(conn, keys: List[Key], empty: bytes):
+    values = [{"qr_code_id": qr_id, "day": day, "total": 0, "visitors": empty} for qr_id, day in keys]
+    dialect = conn.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(ScanSketch)
+        conn.execute(stmt.on_conflict_do_nothing(index_elements=["qr_code_id", "day"]), values)
+        return
+    existing = set(conn.execute(
+        select(ScanSketch.qr_code_id, ScanSketch.day).where(tuple_(ScanSketch.qr_code_id, ScanSketch.day).in_(keys))
+    ).all())
+    missing = [v for v in values if (v["qr_code_id"], v["day"]) not in existing]
+    if missing:
+        conn.execute(insert(ScanSketch), missing)
+
+
+def write(conn, pending: Dict[Key, list], batch_size: int = 1000):
+    # Merges in-memory counts into scan_sketches. Rows are locked in key order so
+    # workers flushing the same codes can't deadlock. Large merges (rebuilds) go
+    # in batches; Postgres rejects a row-value IN list of many thousand keys.
+    qr_ids = {qr_id for qr_id, _ in pending}
+    live = set(conn.execute(select(QRCode.id).where(QRCode.id.in_(qr_ids))).scalars())
+    keys = sorted(key for key in pending if key[0] in live)
+    for i in range(0, len(keys), batch_size):
+        _write_batch(conn, keys[i:i + batch_size], pending)
+
+
+def _write_batch(conn, keys: List[Key], pending: Dict[Key, list]):
+    _ensure_rows(conn, keys, HyperLogLog(settings.sketch_precision).to_bytes())
+    rows = conn.execute(
+        select(ScanSketch.id, ScanSketch.qr_code_id, ScanSketch.day, ScanSketch.total, ScanSketch.visitors)
+        .where(tuple_(ScanSketch.qr_code_id, ScanSketch.day).in_(keys))
+        .order_by(ScanSketch.qr_code_id, ScanSketch.day)
+        .with_for_update()
+    ).all()
+    updates = []
+    for row_id, qr_id, day, total, visitors in rows:
+        added, sketch = pending[(qr_id, day)]
+        merged = HyperLogLog.from_bytes(visitors).merge(sketch)
+        updates.append({"row_id": row_id, "new_total": total + added, "new_visitors": merged.to_bytes()})
+    conn.execute(
+        update(ScanSketch).where(ScanSketch.id == bindparam("row_id"))
+        .values(total=bindparam("new_total"), visitors=bindparam("new_visitors")),
+        updates,
+    )
+
+
+recorder = SketchRecorder(precision=settings.sketch_precision, flush_interval=settings.sketch_flush_interval)
+
+
+def rebuild(batch_size: int = 10000) -> int:
+    # Seeds sketches from scan_logs. Only first scans per visitor were logged, so
+    # historical totals equal the logged rows; repeats are counted from here on.
+    pending: Dict[Key, list] = {}
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(ScanLog.id, ScanLog.qr_code_id, ScanLog.ip_address, ScanLog.timestamp)
+                .where(ScanLog.id > last_id).order_by(ScanLog.id).limit(batch_size)
+            ).all()
+        if not rows:
+            break
+        for _, qr_id, ip, timestamp in rows:
+            key = (qr_id, (timestamp or datetime.utcnow()).date())
+            entry = pending.get(key)
+            if entry is None:
+                entry = pending[key] = [0, HyperLogLog(settings.sketch_precision)]
+            entry[0] += 1
+            entry[1].add(ip or "")
+        last_id = rows[-1][0]
+    with engine.begin() as conn:
+        conn.execute(delete(ScanSketch))
+        if pending:
+            write(conn, pending)
+    return len(pending)
+
+
+def needs_backfill() -> bool:
+    with engine.connect() as conn:
+        has_sketches = conn.execute(select(ScanSketch.id).limit(1)).first() is not None
+        has_scans = conn.execute(select(ScanLog.id).limit(1)).first() is not None
+    return has_scans and not has_sketches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain scan count sketches")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="Recompute sketches from scan_logs (drops repeat-scan totals)")
+    count_cmd = sub.add_parser("count", help="Estimate unique visitors")
+    count_cmd.add_argument("--qr-id", type=int, nargs="*", help="Only these QR codes")
+    count_cmd.add_argument("--start", type=date.fromisoformat, help="First day (YYYY-MM-DD)")
+    count_cmd.add_argument("--end", type=date.fromisoformat, help="Last day (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        print(f"Rebuilt {rebuild()} scan sketches")
+    elif args.command == "count":
+        stmt = select(ScanSketch.total, ScanSketch.visitors)
+        if args.qr_id:
+            stmt = stmt.where(ScanSketch.qr_code_id.in_(args.qr_id))
+        if args.start:
+            stmt = stmt.where(ScanSketch.day >= args.start)
+        if args.end:
+            stmt = stmt.where(ScanSketch.day <= args.end)
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        print(f"{sum(r.total for r in rows)} scans, ~{merge_all(r.visitors for r in rows).count()} unique visitors "
+              f"from {len(rows)} sketches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+from datetime import datetime, time, timedelta, timezone
+from functools import reduce
+from math import gcd
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from sqlalchemy import BigInteger, Integer, Select, cast, extract, func, select
+from .models import QRCode, ScanLog, ScanRollup
+from .config import get_settings
+
+if TYPE_CHECKING:
+    import numpy as np
+
+settings = get_settings()
+
+# Scan counts over time, bucketed by hour, day, week or month in any IANA time
+# zone. Bucket boundaries come from the zone's rules, so DST days have 23 or 25
+# hours. The database returns one grouped result at the coarsest resolution that
+# still lines up with every boundary, and numpy assigns the rows to buckets and
+# series in a few array operations. UTC series of a day or longer read the daily
+# rollups; the rest group raw scans, which only reach back as far as retention.
+
+GRANULARITIES = ("hour", "day", "week", "month")
+# Grouping resolution ceilings, in seconds
+HOUR, DAY = 3600, 86400
+
+
+def get_zone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone {name!r}")
+
+
+def to_zone(value: datetime, tz: ZoneInfo) -> datetime:
+    # Naive datetimes are wall-clock times in the requested zone
+    return value.replace(tzinfo=tz) if value.tzinfo is None else value.astimezone(tz)
+
+
+def _next_start(day, granularity: str):
+    if granularity == "day":
+        return day + timedelta(days=1)
+    if granularity == "week":
+        return day + timedelta(days=7)
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def bucket_edges(granularity: str, tz: ZoneInfo, start: datetime, end: datetime,
+                 max_buckets: Optional[int] = None) -> List[datetime]:
+    # Local start of every bucket from the one holding `start` to the one
+    # holding `end`, followed by the end of the last bucket
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularity must be one of {', '.join(GRANULARITIES)}")
+    max_buckets = max_buckets or settings.timeseries_max_buckets
+    start, end = to_zone(start, tz), to_zone(end, tz)
+    if end < start:
+        raise ValueError("end_date is before start_date")
+    edges = []
+    if granularity == "hour":
+        # Hours are counted in absolute time, so a DST change repeats or skips
+        # a local label instead of making an hour 0 or 120 minutes long
+        edge = start.replace(minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+        while True:
+            edges.append(edge.astimezone(tz))
+            if edges[-1] > end or len(edges) > max_buckets + 1:
+                break
+            edge += timedelta(hours=1)
+    else:
+        day = start.date()
+        if granularity == "week":
+            day -= timedelta(days=day.weekday())
+        elif granularity == "month":
+            day = day.replace(day=1)
+        while True:
+            edges.append(datetime.combine(day, time(), tzinfo=tz))
+            if edges[-1] > end or len(edges) > max_buckets + 1:
+                break
+            day = _next_start(day, granularity)
+    if len(edges) > max_buckets + 1:
+        raise ValueError(f"More than {max_buckets} {granularity} buckets; use a shorter range or a coarser granularity")
+    return edges
+
+
+def resolution(granularity: str, epochs: Sequence[int]) -> int:
+    # The largest step (up to an hour, or a day for daily and longer buckets)
+    # that divides every boundary: 86400 for UTC days, 1800 for Asia/Kolkata
+    return reduce(gcd, epochs, HOUR if granularity == "hour" else DAY)
+
+
+def _epoch_bucket(dialect: str, column, step: int):
+    if dialect == "sqlite":
+        return cast(func.strftime("%s", column), Integer) // step
+    return cast(func.floor(extract("epoch", column)), BigInteger) // step
+
+
+def series_statement(dialect: str, step: int, by: Optional[str], ids: Sequence[int],
+                     lower: datetime, upper: datetime) -> Tuple[Select, bool]:
+    # One grouped query: (series key, time bucket, count) rows covering
+    # [lower, upper). Returns the statement and whether buckets are rollup days.
+    use_rollups = step % DAY == 0
+    if use_rollups:
+        qr_column = ScanRollup.qr_code_id
+        bucket = ScanRollup.day
+        count = func.sum(ScanRollup.count)
+        filters = [ScanRollup.day >= lower.date(), ScanRollup.day < upper.date()]
+    else:
+        qr_column = ScanLog.qr_code_id
+        bucket = _epoch_bucket(dialect, ScanLog.timestamp, step)
+        count = func.count(ScanLog.id)
+        filters = [ScanLog.timestamp >= lower, ScanLog.timestamp < upper]
+    bucket = bucket.label("bucket")
+    if by == "qr":
+        stmt = select(qr_column.label("key"), bucket, count.label("count")).where(qr_column.in_(ids))
+        return stmt.where(*filters).group_by(qr_column, bucket), use_rollups
+    if by == "location":
+        stmt = (select(QRCode.location_id.label("key"), bucket, count.label("count"))
+                .join(QRCode, QRCode.id == qr_column).where(QRCode.location_id.in_(ids)))
+        return stmt.where(*filters).group_by(QRCode.location_id, bucket), use_rollups
+    return select(bucket, count.label("count")).where(*filters).group_by(bucket), use_rollups
+
+
+def bucketize(rows: Sequence[tuple], edges: Sequence[int], ids: Optional[Sequence[int]],
+              step: int, use_rollups: bool) -> "np.ndarray":
+    # rows are (key, bucket, count), or (bucket, count) for a single series.
+    # Returns a (series x buckets) matrix with empty buckets as zeros.
+    import numpy as np
+
+    n_series = len(ids) if ids else 1
+    n_buckets = len(edges) - 1
+    if not rows:
+        return np.zeros((n_series, n_buckets), dtype=np.int64)
+    columns = list(zip(*rows))
+    buckets, counts = columns[-2], np.asarray(columns[-1], dtype=np.int64)
+    if use_rollups:
+        seconds = np.asarray(buckets, dtype="datetime64[D]").astype(np.int64) * DAY
+    else:
+        seconds = np.asarray(buckets, dtype=np.int64) * step
+    position = np.searchsorted(np.asarray(edges, dtype=np.int64), seconds, side="right") - 1
+    if ids:
+        order = np.argsort(ids)
+        keys = np.asarray(columns[0], dtype=np.int64)
+        row = order[np.searchsorted(np.asarray(ids, dtype=np.int64)[order], keys)]
+    else:
+        row = np.zeros(len(seconds), dtype=np.int64)
+    valid = (position >= 0) & (position < n_buckets)
+    flat = row[valid] * n_buckets + position[valid]
+    matrix = np.bincount(flat, weights=counts[valid], minlength=n_series * n_buckets)
+    return matrix.reshape(n_series, n_buckets).astype(np.int64)
+
+
+def compare(matrix: "np.ndarray") -> dict:
+    # Per-series totals, share of all scans and busiest bucket, plus the
+    # combined count per bucket
+    import numpy as np
+
+    totals = matrix.sum(axis=1)
+    grand_total = int(totals.sum())
+    shares = totals / grand_total if grand_total else np.zeros(len(totals))
+    peaks = np.where(totals > 0, matrix.argmax(axis=1), -1) if matrix.shape[1] else np.full(len(totals), -1)
+    return {
+        "counts": matrix.tolist(),
+        "totals": totals.tolist(),
+        "shares": np.round(shares, 4).tolist(),
+        "peaks": peaks.tolist(),
+        "bucket_totals": matrix.sum(axis=0).tolist(),
+    }
+
+
+def query_series(db, granularity: str, tz: ZoneInfo, start: datetime, end: datetime,
+                 by: Optional[str] = None, ids: Sequence[int] = ()) -> Tuple[List[datetime], dict]:
+    edges = bucket_edges(granularity, tz, start, end)
+    epochs = [int(edge.timestamp()) for edge in edges]
+    step = resolution(granularity, epochs)
+    lower, upper = (datetime.fromtimestamp(epochs[i], timezone.utc).replace(tzinfo=None) for i in (0, -1))
+    stmt, use_rollups = series_statement(db.get_bind().dialect.name, step, by, ids, lower, upper)
+    rows = db.execute(stmt).all()
+    return edges[:-1], compare(bucketize(rows, epochs, list(ids) if by else None, step, use_rollups))
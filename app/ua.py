@@ -0,0 +1,110 @@
+import argparse
+import hashlib
+import logging
+import threading
+from typing import Iterable, List, NamedTuple
+from sqlalchemy import bindparam, select, update
+from .cache import LRUCache
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class UAInfo(NamedTuple):
+    device_type: str
+    browser: str
+    os: str
+
+
+# user_agents.parse runs a long list of regexes per call, but scan traffic
+# comes from a small set of distinct UA strings, so results are memoized by a
+# digest of the string (bounded memory regardless of header length).
+ua_cache = LRUCache(maxsize=settings.ua_cache_size)
+
+
+def parse_user_agent(user_agent_str: str) -> UAInfo:
+    # user_agents compiles its regex table on import (a few hundred ms), so it is
+    # loaded on first use or by warm_in_background rather than at startup
+    from user_agents import parse
+
+    user_agent = parse(user_agent_str)
+    device_type = "mobile" if user_agent.is_mobile else "tablet" if user_agent.is_tablet else "desktop"
+    return UAInfo(
+        device_type,
+        f"{user_agent.browser.family} {user_agent.browser.version_string}",
+        f"{user_agent.os.family} {user_agent.os.version_string}",
+    )
+
+
+def classify(user_agent_str: str) -> UAInfo:
+    key = hashlib.blake2b(user_agent_str.encode("utf-8", "surrogateescape"), digest_size=16).digest()
+    info = ua_cache.get(key)
+    if info is None:
+        info = parse_user_agent(user_agent_str)
+        ua_cache.set(key, info)
+    return info
+
+
+def classify_many(user_agent_strs: Iterable[str]) -> List[UAInfo]:
+    # Parses each distinct string once
+    user_agent_strs = list(user_agent_strs)
+    distinct = {ua: classify(ua) for ua in set(user_agent_strs)}
+    return [distinct[ua] for ua in user_agent_strs]
+
+
+def warm_in_background():
+    def run():
+        try:
+            import user_agents
+        except Exception:
+            logger.exception("Failed to load user_agents")
+    threading.Thread(target=run, name="ua-warm", daemon=True).start()
+
+
+def stats() -> dict:
+    return {"hits": ua_cache.hits, "misses": ua_cache.misses, "size": len(ua_cache)}
+
+
+def backfill(batch_size: int = 5000, reparse: bool = False) -> int:
+    from .database import engine
+    from .models import ScanLog
+
+    stmt = update(ScanLog).where(ScanLog.id == bindparam("scan_id")).values(
+        device_type=bindparam("ua_device_type"), browser=bindparam("ua_browser"), os=bindparam("ua_os")
+    )
+    updated, last_id = 0, 0
+    while True:
+        query = select(ScanLog.id, ScanLog.user_agent).where(ScanLog.id > last_id, ScanLog.user_agent.isnot(None))
+        if not reparse:
+            query = query.where(ScanLog.device_type.is_(None))
+        with engine.begin() as conn:
+            rows = conn.execute(query.order_by(ScanLog.id).limit(batch_size)).all()
+            if not rows:
+                return updated
+            infos = classify_many(ua for _, ua in rows)
+            conn.execute(stmt, [
+                {"scan_id": scan_id, "ua_device_type": i.device_type, "ua_browser": i.browser, "ua_os": i.os}
+                for (scan_id, _), i in zip(rows, infos)
+            ])
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User-agent classification")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill_cmd = sub.add_parser("backfill", help="Fill device_type/browser/os on scan_logs")
+    backfill_cmd.add_argument("--reparse", action="store_true", help="Reclassify rows that already have a device type")
+    backfill_cmd.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        updated = backfill(args.batch_size, args.reparse)
+        print(f"Classified {updated} scans ({stats()})")
+        if updated:
+            print("Run `python -m app.rollups rebuild` to refresh the device rollups")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+from .config import get_settings
+
+settings = get_settings()
+
+# Process pool for CPU-bound image work (PIL encoding) so it runs on every core
+# instead of holding the GIL in a request thread. Created on first use.
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.render_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def imap_bounded(fn: Callable, items: Iterable, window: Optional[int] = None) -> Iterator:
+    # Like Executor.map, but keeps at most `window` tasks in flight so a large
+    # batch never has all of its results held in memory at once.
+    pool = get_pool()
+    window = window or settings.render_workers * 2
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
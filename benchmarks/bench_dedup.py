@@ -0,0 +1,65 @@
+"""Seen-IP dedup check latency as the number of logged scans grows.
+
+    python -m benchmarks.bench_dedup --sizes 10000 100000 1000000 10000000
+
+The index is filled with synthetic (qr_code_id, ip) pairs, then timed on repeat
+scans (exact LRU), first-time scans (Bloom negative) and repeats that have aged
+out of the LRU (Bloom positive -> exact lookup, which is stubbed out here and
+counted instead).
+"""
+import argparse
+import random
+import time
+from app.dedup import SeenIndex
+
+
+def _ip(n: int) -> str:
+    return f"{(n >> 24) & 255}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+
+def run(size: int, probes: int, recent_size: int, qr_codes: int):
+    lookups = []
+    # Same sizing warm() picks for a table of this size
+    index = SeenIndex(recent_size=recent_size, capacity=max(size * 2, 100000), error_rate=0.01,
+                      lookup=lambda db, qr_id, ip: lookups.append(1) or True)
+    start = time.perf_counter()
+    for n in range(size):
+        index.mark(n % qr_codes, _ip(n))
+    fill = time.perf_counter() - start
+    index.ready = True
+
+    rng = random.Random(size)
+    cases = {
+        "repeat (recent)": [(n % qr_codes, _ip(n)) for n in (size - 1 - rng.randrange(min(recent_size, size)) for _ in range(probes))],
+        "first scan": [(n % qr_codes, _ip(n)) for n in (size + rng.randrange(size) for _ in range(probes))],
+        "repeat (aged out)": [(n % qr_codes, _ip(n)) for n in (rng.randrange(max(size - recent_size, 1)) for _ in range(probes))],
+    }
+    results = {}
+    for name, keys in cases.items():
+        lookups.clear()
+        start = time.perf_counter()
+        for qr_id, ip in keys:
+            index.seen(qr_id, ip, None)
+        elapsed = time.perf_counter() - start
+        results[name] = (elapsed / probes * 1e6, len(lookups) / probes)
+    return fill, index.bloom.nbytes, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--probes", type=int, default=50000)
+    parser.add_argument("--recent-size", type=int, default=100000)
+    parser.add_argument("--qr-codes", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'bloom MB':>9} {'case':<18} {'us/check':>9} {'db lookups':>11}")
+    for size in args.sizes:
+        fill, nbytes, results = run(size, args.probes, args.recent_size, args.qr_codes)
+        for name, (us, lookup_rate) in results.items():
+            print(f"{size:>10} {nbytes / 1e6:>9.1f} {name:<18} {us:>9.2f} {lookup_rate:>10.1%}")
+        print(f"{'':>10} filled in {fill:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Cold vs. warm cost of classifying scan user agents.
+
+    python -m benchmarks.bench_ua --scans 20000
+
+Draws scans from a corpus of real-world mobile/desktop UA strings with a
+Zipf-like popularity skew (a few iOS/Android builds dominate poster traffic),
+then compares parsing every scan with user_agents.parse against the memoized
+app.ua.classify. ua_parser keeps a small cache of its own, so the uncached row
+makes every string unique to show the real regex cost of a cold parse.
+"""
+import argparse
+import random
+import time
+from app import ua
+
+CORPUS = [
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.6312.118 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 13; SM-A536B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/24.0 Chrome/117.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/124.0.6367.71 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 12; Redmi Note 11) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.6261.119 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_3_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Instagram 325.0.0.35.91 (iPhone14,5; iOS 17_3_1; en_US)",
+    "Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 11; SM-T500) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (Linux; Android 13; CPH2447) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.6167.178 Mobile Safari/537.36 OPR/80.4.4244.77552",
+    "Mozilla/5.0 (Linux; Android 10; SM-G973F) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36 [FB_IAB/FB4A;FBAV/458.0.0.50.108;]",
+    "Mozilla/5.0 (Linux; Android 14; moto g54 5G) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 15_8 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.6.6 Mobile/15E148 Safari/604.1",
+    "WhatsApp/2.24.8.78 A",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+]
+
+
+def sample(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(len(CORPUS))]
+    return rng.choices(CORPUS, weights=weights, k=n)
+
+
+def timed(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, default=20000)
+    args = parser.parse_args()
+
+    scans = sample(args.scans)
+    unique = [f"{s} bench/{i}" for i, s in enumerate(scans)]
+    ua.ua_cache.clear()
+    uncached = timed(ua.parse_user_agent, unique)
+    cold = timed(ua.parse_user_agent, scans)
+    first_pass = timed(ua.classify, scans)
+    warm = timed(ua.classify, scans)
+
+    print(f"{args.scans} scans, {len(set(scans))} distinct user agents")
+    print(f"{'parse, uncached':<24} {uncached / args.scans * 1e6:>9.1f} us/scan")
+    print(f"{'parse every scan':<24} {cold / args.scans * 1e6:>9.1f} us/scan")
+    print(f"{'memoized, from empty':<24} {first_pass / args.scans * 1e6:>9.1f} us/scan")
+    print(f"{'memoized, warm':<24} {warm / args.scans * 1e6:>9.1f} us/scan  ({uncached / warm:.0f}x vs uncached)")
+    print(f"cache: {ua.stats()}")
+
+
+if __name__ == "__main__":
+    main()
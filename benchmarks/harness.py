@@ -0,0 +1,368 @@
+"""End-to-end latency of the scan, dashboard and QR listing endpoints.
+
+    python -m benchmarks.harness run --qr-codes 500 --scans 50000 --concurrency 16
+    python -m benchmarks.harness run --baseline benchmarks/results/before.json
+    python -m benchmarks.harness compare before.json after.json
+
+Seeds a fresh database (DATABASE_URL, or --database-url; SQLite and Postgres
+both work) with QR codes, scans and contact submissions, then drives the ASGI
+app in process, with its lifespan running, from concurrent clients. Requests
+bypass the network and any HTTP client library, so the numbers are the app's
+own cost. Each endpoint is reported with p50/p95/p99 latency, throughput and the
+number of SQL statements per request (measured in a separate sequential pass,
+since the query counter is engine-wide). Results are written as JSON; pass
+--baseline or use `compare` to diff two runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+ADMIN = ("admin@gmail.com", "admin@123")
+
+USER_AGENTS = [
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.6312.118 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 13; SM-A536B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/24.0 Chrome/117.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+]
+DEVICES = [("mobile", "Mobile Safari", "iOS"), ("mobile", "Chrome Mobile", "Android"),
+           ("tablet", "Mobile Safari", "iOS"), ("desktop", "Chrome", "Windows")]
+
+
+def _ip(n: int, prefix: int = 10) -> str:
+    return f"{prefix}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+
+# Seeding
+
+def seed(qr_codes: int, scans: int, contacts: int, days: int, locations: int, seed_value: int):
+    from sqlalchemy import insert, select
+    from app.database import engine, Base
+    from app.init_db import init_database
+    from app.models import ContactSubmission, QRCode, ScanLog, User
+    from app.locations import ensure_locations, normalize
+    from app import rollups
+
+    Base.metadata.drop_all(bind=engine)
+    init_database()
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+
+    with engine.begin() as conn:
+        owner_id = conn.execute(select(User.id).where(User.email == ADMIN[0])).scalar()
+        names = [f"Venue {n}" for n in range(locations)]
+        location_ids = ensure_locations(conn, names)
+        qr_rows = []
+        for i in range(qr_codes):
+            location = names[i % locations]
+            created = start + timedelta(seconds=rng.uniform(0, days * 86400))
+            qr_rows.append({
+                "name": f"Bench QR {i}", "location": location, "location_id": location_ids[normalize(location)],
+                "company_name": "Bench Co", "phone_number": "+910000000000", "description": "Benchmark fixture",
+                "is_active": True, "owner_id": owner_id, "created_at": created, "updated_at": created,
+            })
+        qr_ids = list(conn.execute(insert(QRCode).returning(QRCode.id, sort_by_parameter_order=True), qr_rows).scalars())
+
+    # A few codes get most of the traffic, like posters in busy places
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(qr_ids))]
+    batch = []
+    for n in range(scans):
+        device, browser, os_name = rng.choice(DEVICES)
+        batch.append({
+            "qr_code_id": rng.choices(qr_ids, weights=weights)[0], "ip_address": _ip(n),
+            "timestamp": start + timedelta(seconds=rng.uniform(0, days * 86400)),
+            "user_agent": rng.choice(USER_AGENTS), "device_type": device, "browser": browser, "os": os_name,
+            "country": "India", "city": "Kochi",
+        })
+        if len(batch) == 5000 or n == scans - 1:
+            with engine.begin() as conn:
+                conn.execute(insert(ScanLog), batch)
+            batch = []
+
+    with engine.begin() as conn:
+        rows = [{
+            "qr_code_id": rng.choice(qr_ids), "name": f"Visitor {n}", "phone": f"+91{n:010d}",
+            "message": "Please call back", "created_at": start + timedelta(seconds=rng.uniform(0, days * 86400)),
+        } for n in range(contacts)]
+        if rows:
+            conn.execute(insert(ContactSubmission), rows)
+    rollups.rebuild()
+    return qr_ids
+
+
+# In-process ASGI client
+
+async def request(app, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                  body: bytes = b"") -> Tuple[int, bytes]:
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    done = asyncio.Event()
+    sent_body = False
+    status = 0
+    chunks = []
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status, b"".join(chunks)
+
+
+# Scenarios
+
+class Scenario(NamedTuple):
+    name: str
+    make: Callable[[random.Random], Tuple[str, Dict[str, str]]]
+    before: Optional[Callable[[], None]] = None
+
+
+def scenarios(qr_ids: List[int], auth: Dict[str, str], locations: int) -> List[Scenario]:
+    from app.analytics_cache import analytics_cache
+    counter = iter(range(10 ** 9))
+
+    def scan(rng):
+        # Mostly first-time visitors, some repeats of recent ones
+        n = next(counter)
+        ip = _ip(rng.randrange(max(n, 1)), 172) if rng.random() < 0.2 else _ip(n, 172)
+        return f"/api/scan/{rng.choice(qr_ids)}", {"x-forwarded-for": ip, "user-agent": rng.choice(USER_AGENTS)}
+
+    return [
+        Scenario("scan_qrcode", scan),
+        Scenario("scan_unknown_id", lambda rng: (f"/api/scan/{10 ** 9 + rng.randrange(1000)}", {})),
+        Scenario("get_analytics", lambda rng: ("/api/analytics/", auth)),
+        Scenario("get_analytics_uncached", lambda rng: ("/api/analytics/", auth), before=analytics_cache.invalidate),
+        Scenario("get_analytics_qr", lambda rng: (f"/api/analytics/?qr_id={rng.choice(qr_ids)}", auth)),
+        Scenario("get_analytics_location",
+                 lambda rng: (f"/api/analytics/?location=venue%20{rng.randrange(locations)}", auth)),
+        Scenario("list_qrcodes", lambda rng: ("/api/qrcodes/", auth)),
+        Scenario("list_qrcodes_page", lambda rng: ("/api/qrcodes/?limit=50", auth)),
+        Scenario("qr_image", lambda rng: (f"/api/qrcodes/{rng.choice(qr_ids)}/image", auth)),
+    ]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+async def drive(app, scenario: Scenario, total: int, concurrency: int, rng: random.Random) -> dict:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    remaining = iter(range(total))
+
+    async def client():
+        for _ in remaining:
+            if scenario.before:
+                scenario.before()
+            url, headers = scenario.make(rng)
+            start = time.perf_counter()
+            status, _ = await request(app, "GET", url, headers)
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    ms = lambda s: round(s * 1000, 3)
+    return {
+        "requests": total,
+        "statuses": statuses,
+        "errors": sum(n for code, n in statuses.items() if code.startswith("5")),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else 0.0,
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def count_statements(app, scenario: Scenario, samples: int, rng: random.Random) -> float:
+    from app.querycount import count_queries
+    total = 0
+    for _ in range(samples):
+        if scenario.before:
+            scenario.before()
+        url, headers = scenario.make(rng)
+        with count_queries() as counter:
+            await request(app, "GET", url, headers)
+        total += counter.count
+    return round(total / samples, 2)
+
+
+async def settle(pipeline):
+    while pipeline.depth:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(pipeline.flush_interval + 0.1)
+
+
+async def run_all(args, qr_ids: List[int]) -> Dict[str, dict]:
+    from urllib.parse import urlencode
+    from app.main import app
+    from app.scan_pipeline import pipeline
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        form = urlencode({"username": ADMIN[0], "password": ADMIN[1]}).encode()
+        status, body = await request(app, "POST", "/api/auth/login",
+                                     {"content-type": "application/x-www-form-urlencoded"}, form)
+        if status != 200:
+            raise SystemExit(f"Login failed ({status}): {body[:200]!r}")
+        auth = {"authorization": f"Bearer {json.loads(body)['access_token']}"}
+        selected = [s for s in scenarios(qr_ids, auth, args.locations) if not args.only or s.name in args.only]
+        for scenario in selected:
+            rng = random.Random(args.seed)
+            await drive(app, scenario, args.warmup, args.concurrency, rng)
+            stats = await drive(app, scenario, args.requests, args.concurrency, rng)
+            # Let buffered scan writes land so they don't leak into the next endpoint
+            await settle(pipeline)
+            stats["queries_per_request"] = await count_statements(app, scenario, args.query_samples, rng)
+            await settle(pipeline)
+            results[scenario.name] = stats
+            print(f"{scenario.name:<24} p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+                  f"p99 {stats['p99_ms']:>8.2f} ms  {stats['throughput_rps']:>8.1f} req/s  "
+                  f"{stats['queries_per_request']:>5} queries  {stats['statuses']}")
+    return results
+
+
+# Reporting
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+METRICS = [("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("throughput_rps", True), ("queries_per_request", False)]
+
+
+def compare(baseline: dict, current: dict):
+    # Positive change means better: lower latency/queries, higher throughput
+    print(f"\n{'endpoint':<24}" + "".join(f"{name:>28}" for name, _ in METRICS))
+    for endpoint, stats in current["endpoints"].items():
+        base = baseline["endpoints"].get(endpoint)
+        if not base:
+            print(f"{endpoint:<24} (not in baseline)")
+            continue
+        cells = []
+        for name, higher_is_better in METRICS:
+            old, new = base.get(name), stats.get(name)
+            if old is None or new is None:
+                cells.append("-")
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            better = change if higher_is_better else -change
+            cells.append(f"{old:g} -> {new:g} ({better:+.0f}%)")
+        print(f"{endpoint:<24}" + "".join(f"{c:>28}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run", help="Seed a database and benchmark the endpoints")
+    run_cmd.add_argument("--database-url", default=None, help="Defaults to DATABASE_URL, else ./bench.db")
+    run_cmd.add_argument("--reuse", action="store_true", help="Skip seeding and use the existing data")
+    run_cmd.add_argument("--qr-codes", type=int, default=500)
+    run_cmd.add_argument("--scans", type=int, default=50000)
+    run_cmd.add_argument("--contacts", type=int, default=2000)
+    run_cmd.add_argument("--days", type=int, default=90)
+    run_cmd.add_argument("--locations", type=int, default=40)
+    run_cmd.add_argument("--requests", type=int, default=1000, help="Measured requests per endpoint")
+    run_cmd.add_argument("--warmup", type=int, default=100)
+    run_cmd.add_argument("--concurrency", type=int, default=16)
+    run_cmd.add_argument("--query-samples", type=int, default=20)
+    run_cmd.add_argument("--only", nargs="*", help="Endpoint names to run")
+    run_cmd.add_argument("--seed", type=int, default=7)
+    run_cmd.add_argument("--output", default=None, help="Defaults to benchmarks/results/<timestamp>.json")
+    run_cmd.add_argument("--baseline", default=None, help="Results file to diff against")
+    compare_cmd = sub.add_parser("compare", help="Diff two results files")
+    compare_cmd.add_argument("baseline")
+    compare_cmd.add_argument("current")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f, open(args.current) as g:
+            compare(json.load(f), json.load(g))
+        return
+
+    # Settings are read at import time, so the URL must be set before importing the app
+    os.environ["DATABASE_URL"] = args.database_url or os.environ.get("DATABASE_URL", "sqlite:///./bench.db")
+    # Scenarios replay many requests from few client IPs; per-IP limits would turn
+    # them into 429s. Set RATE_LIMIT_ENABLED=true to measure the limiter itself.
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    # Visitors are told apart by X-Forwarded-For, sent as if from a local proxy
+    os.environ.setdefault("TRUSTED_PROXIES", '["127.0.0.1"]')
+    if args.reuse:
+        from sqlalchemy import select
+        from app.database import engine
+        from app.models import QRCode
+        with engine.connect() as conn:
+            qr_ids = list(conn.execute(select(QRCode.id)).scalars())
+    else:
+        start = time.perf_counter()
+        qr_ids = seed(args.qr_codes, args.scans, args.contacts, args.days, args.locations, args.seed)
+        print(f"Seeded {args.qr_codes} QR codes, {args.scans} scans, {args.contacts} contacts "
+              f"in {time.perf_counter() - start:.1f}s")
+    if not qr_ids:
+        raise SystemExit("No QR codes to benchmark against")
+
+    endpoints = asyncio.run(run_all(args, qr_ids))
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "database": os.environ["DATABASE_URL"].split("://")[0],
+            "python": platform.python_version(),
+            "volumes": {"qr_codes": len(qr_ids), "scans": args.scans, "contacts": args.contacts, "days": args.days},
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "reused_data": args.reuse,
+        },
+        "endpoints": endpoints,
+    }
+    output = args.output or os.path.join("benchmarks", "results", f"{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Import-time profile of the API, to keep cold starts in check.
+
+    python -m benchmarks.import_time --runs 5 --top 15
+    python -m benchmarks.import_time --json boot.json --budget-ms 1500
+
+Each run imports app.main in a fresh interpreter under `python -X importtime`
+and then enters the app's lifespan, the way a new worker boots. The report
+gives median import and startup times, the slowest modules by cumulative time
+(app modules and third-party packages) and the heavy libraries that should not
+load at boot (they load on first use or in the render workers). With
+--budget-ms the exit status is 1 when the median import exceeds the budget, so
+the report can gate CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Libraries the app loads on first use; their presence at import is a regression
+LAZY = ("qrcode", "PIL", "user_agents", "ua_parser", "numpy")
+
+BOOT = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+loaded = sorted({name.split(".")[0] for name in sys.modules})
+
+async def boot():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(boot())
+print(json.dumps({"import_ms": (imported - start) * 1000, "startup_ms": (ready - imported) * 1000, "modules": loaded}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    # (module, self us, cumulative us, nesting depth) for every import line
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative), depth))
+    return rows
+
+
+def run_once(env: Dict[str, str]) -> Tuple[dict, List[Tuple[str, int, int, int]]]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", BOOT], capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"Boot failed with exit code {proc.returncode}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result, parse_importtime(proc.stderr)
+
+
+def packages(rows: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    # Self time summed per top-level package
+    totals: Dict[str, int] = {}
+    for name, self_us, _, _ in rows:
+        top = name.split(".")[0]
+        totals[top] = totals.get(top, 0) + self_us
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL", "sqlite:///./bench.db"))
+    parser.add_argument("--json", dest="json_path", help="Write the report to this file")
+    parser.add_argument("--budget-ms", type=float, help="Fail when the median import takes longer")
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+    # The first run also compiles bytecode; it isn't counted
+    run_once(env)
+    results, last_rows = [], []
+    for _ in range(args.runs):
+        result, last_rows = run_once(env)
+        results.append(result)
+
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    startup_ms = statistics.median(r["startup_ms"] for r in results)
+    app_modules = sorted((r for r in last_rows if r[0].startswith("app.")), key=lambda r: -r[2])[:args.top]
+    third_party = sorted(((name, us) for name, us in packages(last_rows).items() if name != "app"),
+                         key=lambda item: -item[1])[:args.top]
+    eager = sorted(set(LAZY) & set(results[-1]["modules"]))
+
+    print(f"{args.runs} runs, median import {import_ms:.0f} ms, lifespan startup {startup_ms:.0f} ms")
+    print(f"\n{'app module (cumulative)':<40} {'ms':>8}")
+    for name, _, cumulative, _ in app_modules:
+        print(f"{name:<40} {cumulative / 1000:>8.1f}")
+    print(f"\n{'package (self time)':<40} {'ms':>8}")
+    for name, self_us in third_party:
+        print(f"{name:<40} {self_us / 1000:>8.1f}")
+    print(f"\nloaded at boot but meant to be lazy: {', '.join(eager) or 'none'}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "runs": args.runs,
+                "import_ms": import_ms,
+                "startup_ms": startup_ms,
+                "app_modules": [{"module": n, "cumulative_ms": c / 1000} for n, _, c, _ in app_modules],
+                "packages": [{"package": n, "self_ms": us / 1000} for n, us in third_party],
+                "eager_lazy_modules": eager,
+            }, f, indent=2)
+    if args.budget_ms and import_ms > args.budget_ms:
+        print(f"Import time {import_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
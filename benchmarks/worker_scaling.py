@@ -0,0 +1,296 @@
+"""Throughput of the production server (gunicorn.conf.py) as workers are added.
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 --duration 10
+    python -m benchmarks.worker_scaling --reuse --only scan_qrcode --json scaling.json
+
+Seeds a database the same way as benchmarks.harness (skip with --reuse), then
+for each worker count starts gunicorn with WEB_CONCURRENCY set, waits for
+/health and drives each endpoint over real HTTP for --duration seconds. The
+load comes from --clients processes with --connections keep-alive connections
+each, so the client is not the bottleneck; give it cores of its own when the
+server has many workers. Every worker count runs with the settings
+gunicorn.conf.py picks for it (one worker keeps in-process caches, more share
+them through SQLite), so the numbers are what a deployment would see.
+
+The report gives req/s, p50 and p95 per endpoint and worker count, the speedup
+over the smallest count and the scaling efficiency (speedup / worker ratio),
+plus how many workers /metrics saw, which checks that metrics are merged
+across workers. Scaling stops at the number of cores and, for write-heavy
+endpoints, at the database: on one core extra workers only add overhead.
+Rate limiting is disabled for the run, as in the harness, unless --rate-limit
+is given: then every request goes through the limiter with limits too high to
+reject anything, which measures what the shared buckets cost.
+
+gunicorn.conf.py defaults to one worker. Run this on the target host, with
+more cores than the largest worker count, before raising WEB_CONCURRENCY.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from .harness import ADMIN, _git_commit, percentile
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py")
+DEFAULT_SCENARIOS = ["scan_qrcode", "get_analytics_qr", "list_qrcodes_page", "qr_image"]
+
+# Set in the parent before the client processes fork, since the scenario
+# closures can't be pickled
+_SCENARIOS = []
+
+
+# Server
+
+def start_server(workers: int, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(env, WEB_CONCURRENCY=str(workers), PORT=str(port), GUNICORN_MAX_REQUESTS="0")
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", CONFIG, "app.main:app"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def stop_server(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def call(port: int, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+         body: Optional[str] = None) -> Tuple[int, bytes]:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request(method, url, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def wait_ready(proc: subprocess.Popen, port: int, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {proc.returncode}:\n{proc.stderr.read()[-4000:]}")
+        try:
+            if call(port, "GET", "/health")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(proc)
+    raise SystemExit("gunicorn did not become ready")
+
+
+def login(port: int) -> Dict[str, str]:
+    status, body = call(port, "POST", "/api/auth/login", {"content-type": "application/x-www-form-urlencoded"},
+                        urlencode({"username": ADMIN[0], "password": ADMIN[1]}))
+    if status != 200:
+        raise SystemExit(f"Login failed ({status}): {body[:200]!r}")
+    return {"authorization": f"Bearer {json.loads(body)['access_token']}"}
+
+
+def metrics_workers(port: int, token: str) -> Optional[int]:
+    headers = {"authorization": f"Bearer {token}"} if token else {}
+    status, body = call(port, "GET", "/metrics", headers)
+    if status != 200:
+        return None
+    for line in body.decode().splitlines():
+        if line.startswith("server_workers "):
+            return int(float(line.split()[1]))
+    return None
+
+
+# Load generation
+
+def _client(job: Tuple[int, int, int, int, float]) -> Tuple[List[float], Dict[str, int], float]:
+    port, index, seed, connections, duration = job
+    scenario = _SCENARIOS[index]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def connection(n: int):
+        rng = random.Random(seed * 1000 + n)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        own, counts = [], {}
+        while time.perf_counter() < deadline:
+            url, headers = scenario.make(rng)
+            start = time.perf_counter()
+            try:
+                conn.request("GET", url, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                status = str(resp.status)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                status = "error"
+            own.append(time.perf_counter() - start)
+            counts[status] = counts.get(status, 0) + 1
+        conn.close()
+        with lock:
+            latencies.extend(own)
+            for status, n in counts.items():
+                statuses[status] = statuses.get(status, 0) + n
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=connection, args=(n,)) for n in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def drive(pool, port: int, index: int, clients: int, connections: int, duration: float, seed: int) -> dict:
+    jobs = [(port, index, seed + c, connections, duration) for c in range(clients)]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    elapsed = 0.0
+    for own, counts, seconds in pool.map(_client, jobs):
+        latencies.extend(own)
+        elapsed = max(elapsed, seconds)
+        for status, n in counts.items():
+            statuses[status] = statuses.get(status, 0) + n
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "statuses": statuses,
+        "errors": sum(n for code, n in statuses.items() if code == "error" or code.startswith("5")),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+# Reporting
+
+def summarize(results: Dict[int, Dict[str, dict]]) -> Dict[str, List[dict]]:
+    counts = sorted(results)
+    base = counts[0]
+    table = {}
+    for name in results[base]:
+        rows = []
+        for workers in counts:
+            stats = results[workers][name]
+            reference = results[base][name]["throughput_rps"]
+            speedup = stats["throughput_rps"] / reference if reference else 0.0
+            rows.append(dict(stats, workers=workers, speedup=round(speedup, 2),
+                             efficiency=round(speedup / (workers / base), 2)))
+        table[name] = rows
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None, help="Defaults to DATABASE_URL, else ./bench.db")
+    parser.add_argument("--reuse", action="store_true", help="Skip seeding and use the existing data")
+    parser.add_argument("--qr-codes", type=int, default=500)
+    parser.add_argument("--scans", type=int, default=50000)
+    parser.add_argument("--contacts", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--locations", type=int, default=40)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per endpoint and worker count")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--clients", type=int, default=4, help="Load generator processes")
+    parser.add_argument("--connections", type=int, default=8, help="Keep-alive connections per client")
+    parser.add_argument("--only", nargs="*", help=f"Endpoint names (default: {' '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rate-limit", action="store_true", help="Run requests through the rate limiter")
+    parser.add_argument("--json", dest="json_path", help="Write the report to this file")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or os.environ.get("DATABASE_URL", "sqlite:///./bench.db")
+    if args.rate_limit:
+        os.environ["RATE_LIMIT_ENABLED"] = "true"
+        os.environ["RATE_LIMITS"] = json.dumps({route: "1000000/second" for route in ("public", "scan", "logo")})
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("TRUSTED_PROXIES", '["127.0.0.1"]')
+    from sqlalchemy import select
+    from app.config import get_settings
+    from app.database import engine
+    from app.models import QRCode
+    from .harness import scenarios, seed
+
+    if args.reuse:
+        with engine.connect() as conn:
+            qr_ids = list(conn.execute(select(QRCode.id)).scalars())
+    else:
+        start = time.perf_counter()
+        qr_ids = seed(args.qr_codes, args.scans, args.contacts, args.days, args.locations, args.seed)
+        print(f"Seeded {args.qr_codes} QR codes, {args.scans} scans, {args.contacts} contacts "
+              f"in {time.perf_counter() - start:.1f}s")
+    engine.dispose()
+    if not qr_ids:
+        raise SystemExit("No QR codes to benchmark against")
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    if max(args.workers) > 1 and max(args.workers) >= cpus:
+        print(f"Warning: {cpus} CPU(s) for up to {max(args.workers)} workers plus the load generators; "
+              "the speedups below measure contention, not scaling")
+    names = args.only or DEFAULT_SCENARIOS
+    results: Dict[int, Dict[str, dict]] = {}
+    seen_workers: Dict[int, Optional[int]] = {}
+    for workers in args.workers:
+        proc = start_server(workers, args.port, dict(os.environ))
+        try:
+            wait_ready(proc, args.port)
+            auth = login(args.port)
+            _SCENARIOS[:] = [s for s in scenarios(qr_ids, auth, args.locations) if s.name in names and not s.before]
+            results[workers] = {}
+            with multiprocessing.get_context("fork").Pool(args.clients) as pool:
+                for index, scenario in enumerate(_SCENARIOS):
+                    drive(pool, args.port, index, args.clients, args.connections, args.warmup, args.seed)
+                    stats = drive(pool, args.port, index, args.clients, args.connections, args.duration, args.seed)
+                    results[workers][scenario.name] = stats
+                    print(f"{workers} workers  {scenario.name:<20} {stats['throughput_rps']:>8.1f} req/s  "
+                          f"p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  {stats['statuses']}")
+            seen_workers[workers] = metrics_workers(args.port, get_settings().metrics_token)
+        finally:
+            stop_server(proc)
+
+    table = summarize(results)
+    print(f"\n{'endpoint':<20} {'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'speedup':>8} {'eff.':>6}")
+    for name, rows in table.items():
+        for row in rows:
+            print(f"{name:<20} {row['workers']:>7} {row['throughput_rps']:>9.1f} {row['p50_ms']:>8.2f} "
+                  f"{row['p95_ms']:>8.2f} {row['speedup']:>7.2f}x {row['efficiency']:>6.2f}")
+    print("\nworkers seen by /metrics: " + ", ".join(f"{w} -> {seen_workers[w]}" for w in args.workers))
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "meta": {
+                    "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+                    "commit": _git_commit(),
+                    "database": os.environ["DATABASE_URL"].split("://")[0],
+                    "python": platform.python_version(),
+                    "cpus": cpus,
+                    "rate_limit": args.rate_limit,
+                    "duration": args.duration,
+                    "clients": args.clients,
+                    "connections": args.connections,
+                },
+                "metrics_workers": seen_workers,
+                "endpoints": table,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
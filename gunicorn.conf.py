@@ -0,0 +1,85 @@
+import json
+import os
+
+# Production entry point: gunicorn -c gunicorn.conf.py app.main:app
+#
+# The app is imported once in the master (preload_app) and forked into uvicorn
+# workers. The master creates and migrates the schema and warms the seen-IP
+# index before forking, so workers boot without touching DDL or rescanning
+# scan_logs.
+#
+# Requests never wait on another worker. Caches and rate limit buckets stay in
+# each worker's memory; with more than one worker, cache invalidations are
+# broadcast through a log in the shared SQLite file, rate limit buckets are
+# reconciled with it in the background, and metrics snapshots in METRICS_DIR
+# are merged by whichever worker answers /metrics.
+
+port = os.getenv("PORT", "8000")
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{port}")
+
+# One worker per usable core. Containers often report the host's CPUs; set
+# WEB_CONCURRENCY to the real share. Each worker has its own DB pool
+# (DB_POOL_SIZE + DB_MAX_OVERFLOW), so keep workers times that under the
+# database's connection limit.
+workers = int(os.getenv("WEB_CONCURRENCY", len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity")
+                        else os.cpu_count() or 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Recycle workers now and then to bound slow leaks; the jitter keeps them from
+# restarting together. A replacement is forked from the master, so it inherits
+# the warmed seen-IP index and only loads scans written since boot.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "500"))
+
+# A stopping worker drains its scan queue and sketches in the lifespan, which
+# must finish inside graceful_timeout
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# uvicorn replaces the client address from X-Forwarded-For only for these
+# peers. "*" would let any client pick its own address, so this follows
+# TRUSTED_PROXIES (a JSON list, as the app reads it) unless set explicitly.
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS") or ",".join(
+    json.loads(os.getenv("TRUSTED_PROXIES") or "[]") or ["127.0.0.1", "::1"])
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+
+if workers > 1:
+    os.environ.setdefault("INVALIDATION_BACKEND", "sqlite")
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "synced")
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+    os.environ.setdefault("METRICS_DIR", os.path.join(shm, f"qr-analytics-metrics-{port}"))
+
+
+def on_starting(server):
+    from app import init_db, metrics
+    from app.config import get_settings
+    from app.database import engine
+    from app.dedup import seen_index
+
+    settings = get_settings()
+    if settings.init_db_on_startup:
+        init_db.init_on_startup()
+        # Inherited by the workers, so their lifespans skip it
+        settings.init_db_on_startup = False
+    # Forked workers share the filter's pages and only load newer scans
+    try:
+        seen_index.warm()
+    except Exception:
+        server.log.exception("Failed to warm seen-IP index; workers will warm their own")
+    metrics.reset_snapshots()
+    # Workers must not share the master's connections
+    engine.dispose()
+
+
+def post_fork(server, worker):
+    from app.database import engine
+
+    engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    from app import metrics
+
+    metrics.retire_snapshot(worker.pid)
@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+# Settings are read when app modules are imported, so the test environment has
+# to be in place first: a throwaway SQLite database, cheap bcrypt, no rate
+# limits, and no background sketch flushes landing inside query counts.
+_tmp = tempfile.mkdtemp(prefix="qr-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ["SHARED_CACHE_PATH"] = f"{_tmp}/shared.db"
+os.environ["INIT_DB_LOCK_PATH"] = f"{_tmp}/init_db.lock"
+os.environ["LOGO_DIR"] = f"{_tmp}/logos"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+# Requests come from 127.0.0.1 and name the visitor in X-Forwarded-For
+os.environ["TRUSTED_PROXIES"] = '["127.0.0.1"]'
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["SKETCH_FLUSH_INTERVAL"] = "3600"
+os.environ["SCAN_FLUSH_INTERVAL"] = "0.05"
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+ADMIN = ("admin@gmail.com", "admin@123")
+
+
+@pytest.fixture(scope="session")
+def client():
+    from app.main import app
+    with TestClient(app, client=("127.0.0.1", 50000)) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def auth(client):
+    response = client.post("/api/auth/login", data={"username": ADMIN[0], "password": ADMIN[1]})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def settle():
+    # Waits for queued scans to be written so they don't land inside a query count
+    from app.scan_pipeline import pipeline
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        enqueued = pipeline.stats["enqueued"]
+        done = pipeline.stats["written"] + pipeline.stats["duplicates"] + pipeline.stats["failed"]
+        if pipeline.depth == 0 and done >= enqueued:
+            return
+        time.sleep(0.02)
+    raise AssertionError("scan pipeline did not drain")
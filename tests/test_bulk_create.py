@@ -0,0 +1,25 @@
+def test_short_csv_row(client, auth):
+    body = "name,location,description\nShort row,Lobby\n"
+    resp = client.post("/api/qrcodes/bulk", content=body, headers={**auth, "content-type": "text/csv"})
+    assert resp.status_code == 200
+    assert resp.json()["count"] == 1
+
+
+def test_csv_not_utf8(client, auth):
+    body = "name,location\nok,Lobby\n".encode() + b"caf\xe9,Hall\n"
+    resp = client.post("/api/qrcodes/bulk", content=body, headers={**auth, "content-type": "text/csv"})
+    assert resp.status_code == 400
+    assert "row 2" in resp.json()["detail"]
+
+
+def test_csv_missing_name(client, auth):
+    body = "name,location\nok,Lobby\n,Hall\n"
+    resp = client.post("/api/qrcodes/bulk", content=body, headers={**auth, "content-type": "text/csv"})
+    assert resp.status_code == 422
+    assert resp.json()["detail"][0]["row"] == 2
+
+
+def test_malformed_json(client, auth):
+    resp = client.post("/api/qrcodes/bulk", content=b'[{"name": "a",', headers={**auth, "content-type": "application/json"})
+    assert resp.status_code == 400
+    assert "line 1" in resp.json()["detail"]
@@ -0,0 +1,25 @@
+import time
+from app.cache import SqliteBackend
+
+
+def _rows(backend):
+    return backend._conn().execute("SELECT key FROM cache ORDER BY rowid").fetchall()
+
+
+def test_sqlite_backend_keeps_newest_rows(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "cache.db"), "landing", maxsize=3, purge_every=5)
+    other = SqliteBackend(str(tmp_path / "cache.db"), "analytics", maxsize=3)
+    other.set("x", 1)
+    for i in range(5):
+        backend.set(str(i), i)
+    assert [k for k, in _rows(backend)] == ["analytics:x", "landing:2", "landing:3", "landing:4"]
+    assert backend.get("0") is None and backend.get("4") == 4
+
+
+def test_sqlite_backend_purges_expired_rows(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "cache.db"), "landing", maxsize=100, purge_every=3)
+    backend.set("old", 1, ttl=0.01)
+    time.sleep(0.02)
+    backend.set("a", 2)
+    backend.set("b", 3)
+    assert [k for k, in _rows(backend)] == ["landing:a", "landing:b"]
@@ -0,0 +1,31 @@
+import pytest
+from starlette.requests import Request
+from app import ratelimit
+
+
+def _request(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+@pytest.fixture
+def proxies(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_trusted_proxies", [ratelimit.ipaddress.ip_network("10.0.0.0/8")])
+
+
+def test_forwarded_ignored_without_trusted_proxies():
+    assert ratelimit.client_ip(_request("203.0.113.9", "1.2.3.4")) == "203.0.113.9"
+
+
+def test_forwarded_ignored_from_untrusted_peer(proxies):
+    assert ratelimit.client_ip(_request("203.0.113.9", "1.2.3.4")) == "203.0.113.9"
+
+
+def test_rightmost_untrusted_hop(proxies):
+    request = _request("10.0.0.2", "6.6.6.6, 198.51.100.7 , 10.0.0.5")
+    assert ratelimit.client_ip(request) == "198.51.100.7"
+
+
+def test_only_trusted_hops(proxies):
+    assert ratelimit.client_ip(_request("10.0.0.2", " 10.1.1.1,10.0.0.5")) == "10.1.1.1"
+    assert ratelimit.client_ip(_request("10.0.0.2", " , ")) == "10.0.0.2"
@@ -0,0 +1,97 @@
+from sqlalchemy import insert, inspect, select, text
+from app import init_db
+from app.database import engine
+from app.dedup import BloomFilter, ScalableBloomFilter, SeenIndex, _key
+from app.models import ContactSubmission, ScanLog
+from tests.conftest import settle
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [_key(1, f"10.0.0.{i}") for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(_key(2, f"10.0.0.{i}") in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_scalable_bloom_filter_grows():
+    bloom = ScalableBloomFilter(100, 0.01)
+    keys = [_key(1, str(i)) for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert len(bloom.filters) > 1
+    assert all(key in bloom for key in keys)
+
+
+def _index(lookups):
+    def lookup(db, qr_id, ip):
+        lookups.append((qr_id, ip))
+        return False
+    return SeenIndex(recent_size=10, capacity=100, error_rate=0.01, lookup=lookup)
+
+
+def test_falls_back_to_lookup_until_warm():
+    lookups = []
+    index = _index(lookups)
+    assert not index.seen(1, "1.1.1.1", None)
+    assert lookups == [(1, "1.1.1.1")]
+    index.ready = True
+    assert not index.seen(1, "1.1.1.1", None)
+    assert len(lookups) == 1
+
+
+def test_mark_and_forget():
+    lookups = []
+    index = _index(lookups)
+    index.ready = True
+    index.mark(1, "1.1.1.1")
+    assert index.seen(1, "1.1.1.1", None)
+    index.forget_scans([{"qr_code_id": 1, "ip_address": "1.1.1.1"}])
+    # Still in the Bloom filter, so the exact lookup decides
+    assert not index.seen(1, "1.1.1.1", None)
+    assert lookups == [(1, "1.1.1.1")]
+
+
+def test_warm_loads_existing_scans(client, auth):
+    qr_id = client.post("/api/qrcodes/", json={"name": "warm", "location": "Lobby"}, headers=auth).json()["id"]
+    for i in range(3):
+        client.get(f"/api/scan/{qr_id}", headers={"X-Forwarded-For": f"192.0.2.{i}"})
+    settle()
+    lookups = []
+    index = _index(lookups)
+    index.warm()
+    assert index.ready
+    assert not index.seen(qr_id, "192.0.2.200", None)
+    for i in range(3):
+        index.seen(qr_id, f"192.0.2.{i}", None)
+    assert lookups == [(qr_id, f"192.0.2.{i}") for i in range(3)]
+
+
+def test_duplicates_removed_before_unique_index(client, auth):
+    qr_id = client.post("/api/qrcodes/", json={"name": "dupes", "location": "Lobby"}, headers=auth).json()["id"]
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ux_scan_logs_qr_ip"))
+        ids = [conn.execute(insert(ScanLog).values(qr_code_id=qr_id, ip_address=ip)).inserted_primary_key[0]
+               for ip in ("203.0.113.1", "203.0.113.1", "203.0.113.1", "203.0.113.2", None, None)]
+        conn.execute(insert(ContactSubmission).values(qr_code_id=qr_id, scan_id=ids[2], name="c"))
+    init_db.ensure_indexes()
+    with engine.connect() as conn:
+        kept = list(conn.execute(select(ScanLog.id).where(ScanLog.qr_code_id == qr_id).order_by(ScanLog.id)).scalars())
+        contact_scan = conn.execute(select(ContactSubmission.scan_id).where(ContactSubmission.qr_code_id == qr_id)).scalar()
+    assert kept == [ids[0], ids[3], ids[4], ids[5]]
+    assert contact_scan == ids[0]
+    assert "ux_scan_logs_qr_ip" in {index["name"] for index in inspect(engine).get_indexes("scan_logs")}
+
+
+def test_warm_again_loads_only_newer_scans(client, auth):
+    qr_id = client.post("/api/qrcodes/", json={"name": "rewarm", "location": "Lobby"}, headers=auth).json()["id"]
+    index = _index([])
+    index.warm()
+    first = index.warmed_id
+    client.get(f"/api/scan/{qr_id}", headers={"X-Forwarded-For": "198.51.100.1"})
+    settle()
+    index.warm()
+    assert index.warmed_id > first
+    assert _key(qr_id, "198.51.100.1") in index.bloom
@@ -0,0 +1,26 @@
+import pytest
+from app.config import get_settings
+
+
+@pytest.fixture(scope="module")
+def qr_id(client, auth):
+    return client.post("/api/qrcodes/", json={"name": "export", "location": "Lobby"}, headers=auth).json()["id"]
+
+
+@pytest.mark.parametrize("options", [
+    {"box_size": 0}, {"box_size": -3}, {"box_size": 51}, {"border": -1}, {"border": 21},
+])
+def test_export_rejects_bad_sizes(client, auth, qr_id, options):
+    resp = client.post("/api/qrcodes/export", json={"ids": [qr_id], **options}, headers=auth)
+    assert resp.status_code == 422
+
+
+def test_export_caps_ids(client, auth, qr_id):
+    ids = [qr_id] * (get_settings().bulk_max_rows + 1)
+    assert client.post("/api/qrcodes/export", json={"ids": ids}, headers=auth).status_code == 422
+
+
+def test_export_zip(client, auth, qr_id):
+    resp = client.post("/api/qrcodes/export", json={"ids": [qr_id], "box_size": 2, "border": 0}, headers=auth)
+    assert resp.status_code == 200
+    assert resp.content[:2] == b"PK"
@@ -0,0 +1,10 @@
+from app.config import get_settings
+
+
+def test_plain_code_gets_long_max_age(client, auth):
+    qr_id = client.post("/api/qrcodes/", json={"name": "plain", "location": "Lobby"}, headers=auth).json()["id"]
+    resp = client.get(f"/api/qrcodes/{qr_id}/image?box_size=2")
+    assert resp.status_code == 200
+    assert resp.headers["cache-control"] == f"public, max-age={get_settings().qr_image_max_age}"
+    assert client.get(f"/api/qrcodes/{qr_id}/image?box_size=2",
+                      headers={"If-None-Match": resp.headers["etag"]}).status_code == 304
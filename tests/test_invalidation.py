@@ -0,0 +1,50 @@
+import multiprocessing
+from app.invalidation import InvalidationBus
+
+
+def _publish(path):
+    InvalidationBus(path, poll_interval=60).publish("landing", "7")
+
+
+def test_events_reach_other_processes(tmp_path):
+    path = str(tmp_path / "shared.db")
+    bus = InvalidationBus(path, poll_interval=60)
+    received = []
+    bus.subscribe("landing", received.append)
+    bus.start()
+    try:
+        bus.publish("landing", "1")
+        assert received == ["1"]
+        child = multiprocessing.get_context("fork").Process(target=_publish, args=(path,))
+        child.start()
+        child.join()
+        bus.poll()
+        # Its own event isn't run twice
+        assert received == ["1", "7"]
+        bus.poll()
+        assert received == ["1", "7"]
+    finally:
+        bus.stop()
+
+
+def test_start_skips_earlier_events(tmp_path):
+    path = str(tmp_path / "shared.db")
+    child = multiprocessing.get_context("fork").Process(target=_publish, args=(path,))
+    child.start()
+    child.join()
+    bus = InvalidationBus(path, poll_interval=60)
+    received = []
+    bus.subscribe("landing", received.append)
+    bus.start()
+    bus.poll()
+    bus.stop()
+    assert received == []
+
+
+def test_local_only_without_path():
+    bus = InvalidationBus(None, poll_interval=60)
+    received = []
+    bus.subscribe("analytics", received.append)
+    bus.publish("analytics")
+    bus.start()
+    assert received == [""] and bus.stats["published"] == 0
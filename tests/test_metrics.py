@@ -0,0 +1,19 @@
+def _value(body, series):
+    for line in body.splitlines():
+        if line.startswith(series + " "):
+            return float(line.split()[1])
+    return None
+
+
+def test_ua_cache_series(client, auth):
+    qr_id = client.post("/api/qrcodes/", json={"name": "ua", "location": "Lobby"}, headers=auth).json()["id"]
+    before = client.get("/metrics").text
+    misses = _value(before, 'ua_cache_lookups_total{result="miss"}') or 0
+    hits = _value(before, 'ua_cache_lookups_total{result="hit"}') or 0
+    agent = "Mozilla/5.0 (X11; Linux x86_64; metrics-test) Firefox/120.0"
+    for i in range(3):
+        client.get(f"/api/scan/{qr_id}", headers={"X-Forwarded-For": f"198.51.100.{50 + i}", "User-Agent": agent})
+    body = client.get("/metrics").text
+    assert _value(body, 'ua_cache_lookups_total{result="miss"}') == misses + 1
+    assert _value(body, 'ua_cache_lookups_total{result="hit"}') == hits + 2
+    assert _value(body, "ua_cache_size") >= 1
@@ -0,0 +1,41 @@
+import pytest
+from collections import namedtuple
+from datetime import datetime
+from fastapi import HTTPException
+from app.pagination import decode_cursor, encode_cursor, next_cursor
+
+
+def test_next_cursor_empty_page():
+    assert next_cursor([], 0, "timestamp") is None
+
+
+@pytest.mark.parametrize("path", ["/api/analytics/contacts", "/api/analytics/locations/search?q=a"])
+def test_limit_must_be_positive(client, auth, path):
+    sep = "&" if "?" in path else "?"
+    assert client.get(f"{path}{sep}limit=0", headers=auth).status_code == 422
+
+
+def test_scans_limit_must_be_positive(client, auth):
+    qr_id = client.post("/api/qrcodes/", json={"name": "p", "location": "Lobby"}, headers=auth).json()["id"]
+    assert client.get(f"/api/analytics/qr/{qr_id}/scans?limit=0", headers=auth).status_code == 422
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2026, 3, 1, 12, 30, 15, 123456)
+    token = encode_cursor(timestamp, 42)
+    assert "=" not in token
+    assert decode_cursor(token) == (timestamp, 42)
+
+
+@pytest.mark.parametrize("token", ["not-base64!", "e30", encode_cursor(datetime(2026, 1, 1), 1)[:-3]])
+def test_invalid_cursor(token):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(token)
+    assert exc.value.status_code == 400
+
+
+def test_next_cursor():
+    Row = namedtuple("Row", "timestamp id")
+    rows = [Row(datetime(2026, 1, 2), 7), Row(datetime(2026, 1, 1), 3)]
+    assert next_cursor(rows, 3, "timestamp") is None
+    assert decode_cursor(next_cursor(rows, 2, "timestamp")) == (datetime(2026, 1, 1), 3)
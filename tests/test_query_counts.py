@@ -0,0 +1,85 @@
+import pytest
+
+from app.analytics_cache import analytics_cache
+from app.landing import landing_cache
+from app.querycount import assert_max_queries
+from tests.conftest import settle
+
+# Statement budgets for the hot endpoints. They hold however many QR codes and
+# scans exist, so a loop that queries per row fails here long before it shows up
+# in production.
+
+QR_CODES = 30
+SCANS_PER_CODE = 3
+
+
+@pytest.fixture(scope="module")
+def qr_ids(client, auth):
+    ids = []
+    for n in range(QR_CODES):
+        response = client.post("/api/qrcodes/", headers=auth,
+                               json={"name": f"Query QR {n}", "location": f"Hall {n % 5}"})
+        assert response.status_code == 200, response.text
+        ids.append(response.json()["id"])
+    for qr_id in ids:
+        for visitor in range(SCANS_PER_CODE):
+            assert client.get(f"/api/scan/{qr_id}", headers={"X-Forwarded-For": f"10.0.{qr_id}.{visitor}"}).status_code == 200
+    settle()
+    return ids
+
+
+def test_list_qrcodes(client, auth, qr_ids):
+    with assert_max_queries(2):
+        response = client.get("/api/qrcodes/", headers=auth)
+    assert response.status_code == 200
+    assert len(response.json()) >= QR_CODES
+
+
+def test_list_qrcodes_page(client, auth, qr_ids):
+    with assert_max_queries(2):
+        response = client.get("/api/qrcodes/?limit=20", headers=auth)
+    assert response.status_code == 200
+
+
+def test_analytics(client, auth, qr_ids):
+    analytics_cache.invalidate()
+    with assert_max_queries(9):
+        response = client.get("/api/analytics/", headers=auth)
+    assert response.status_code == 200
+    assert response.json()["total_scans"] >= QR_CODES * SCANS_PER_CODE
+    # Recent scans name their QR codes through one batched load
+    assert all(scan["qr_name"] for scan in response.json()["recent_scans"])
+
+
+def test_analytics_filtered(client, auth, qr_ids):
+    analytics_cache.invalidate()
+    # One more for the location catalog, which is loaded at most once per TTL
+    with assert_max_queries(10):
+        response = client.get("/api/analytics/", params={"location": "hall 1"}, headers=auth)
+    assert response.status_code == 200
+
+
+def test_analytics_cached(client, auth, qr_ids):
+    client.get("/api/analytics/", headers=auth)
+    with assert_max_queries(0):
+        assert client.get("/api/analytics/", headers=auth).status_code == 200
+
+
+def test_landing(client, qr_ids):
+    # A repeat visitor on a cold landing cache: one lookup for the code, and the
+    # seen-IP index answers without the database
+    qr_id = qr_ids[0]
+    landing_cache.delete(str(qr_id))
+    with assert_max_queries(1):
+        response = client.get(f"/api/scan/{qr_id}", headers={"X-Forwarded-For": f"10.0.{qr_id}.0"})
+    assert response.status_code == 200
+    with assert_max_queries(0):
+        assert client.get(f"/api/scan/{qr_id}", headers={"X-Forwarded-For": f"10.0.{qr_id}.0"}).status_code == 200
+
+
+def test_landing_unknown_code(client, qr_ids):
+    missing = max(qr_ids) + 1000
+    with assert_max_queries(1):
+        assert client.get(f"/api/scan/{missing}").status_code == 404
+    with assert_max_queries(0):
+        assert client.get(f"/api/scan/{missing}").status_code == 404
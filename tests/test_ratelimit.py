@@ -0,0 +1,87 @@
+import pytest
+from app.ratelimit import Limit, MemoryRateLimitBackend, SqliteRateLimitBackend, SyncedRateLimitBackend, parse_limit
+
+
+@pytest.fixture(params=["memory", "sqlite", "synced"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryRateLimitBackend(max_keys=100)
+    if request.param == "synced":
+        return SyncedRateLimitBackend(str(tmp_path / "limits.db"), max_keys=100, sync_interval=0.5)
+    return SqliteRateLimitBackend(str(tmp_path / "limits.db"))
+
+
+def test_parse_limit():
+    assert parse_limit("30/minute") == Limit(30.0, 0.5)
+    for value in ("0/minute", "30/day", "x/second", "30"):
+        with pytest.raises(ValueError):
+            parse_limit(value)
+
+
+def test_burst_then_wait(backend):
+    limit = parse_limit("3/minute")
+    assert [backend.take("k", limit, 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # One token comes back every 20 seconds
+    assert backend.take("k", limit, 100.0) == pytest.approx(20.0)
+    assert backend.take("k", limit, 110.0) == pytest.approx(10.0)
+    assert backend.take("k", limit, 120.0) == 0.0
+    assert backend.take("k", limit, 120.0) == pytest.approx(20.0)
+
+
+def test_refill_is_capped(backend):
+    limit = parse_limit("2/second")
+    assert backend.take("k", limit, 0.0) == 0.0
+    # Idle for an hour still leaves only a full bucket
+    assert [backend.take("k", limit, 3600.0) for _ in range(3)] == [0.0, 0.0, pytest.approx(0.5)]
+
+
+def test_keys_are_independent(backend):
+    limit = parse_limit("1/minute")
+    assert backend.take("a", limit, 0.0) == 0.0
+    assert backend.take("b", limit, 0.0) == 0.0
+    assert backend.take("a", limit, 0.0) > 0
+
+
+def test_memory_drops_refilled_and_excess_buckets():
+    backend = MemoryRateLimitBackend(max_keys=2)
+    limit = parse_limit("1/second")
+    for i, key in enumerate("abc"):
+        backend.take(key, limit, i * 0.1)
+    assert len(backend) == 2
+    backend.take("d", limit, 10.0)
+    assert len(backend) == 1
+
+
+def _workers(tmp_path, n=2):
+    return [SyncedRateLimitBackend(str(tmp_path / "limits.db"), max_keys=100, sync_interval=0.5) for _ in range(n)]
+
+
+def test_synced_workers_share_debt(tmp_path):
+    a, b = _workers(tmp_path)
+    limit = parse_limit("10/minute")
+    # Each worker hands out tokens from its own view until it syncs
+    assert all(a.take("k", limit, 0.0) == 0.0 for _ in range(6))
+    assert all(b.take("k", limit, 0.0) == 0.0 for _ in range(6))
+    a.sync(0.0)
+    b.sync(0.0)
+    assert b.take("k", limit, 0.0) == pytest.approx(18.0)
+    assert a.take("k", limit, 0.0) == 0.0
+    a.sync(0.0)
+    # 10 - 6 - 6 - 1: three tokens in debt, so the next one is 24 seconds away
+    assert a.take("k", limit, 0.0) == pytest.approx(24.0)
+
+
+def test_synced_workers_hold_the_long_run_rate(tmp_path):
+    workers = _workers(tmp_path, 4)
+    limit = parse_limit("60/minute")
+    allowed, now = 0, 0.0
+    while now < 60.0:
+        for worker in workers:
+            allowed += sum(worker.take("k", limit, now) == 0.0 for _ in range(5))
+        now += 0.1
+        if round(now * 10) % 5 == 0:
+            for worker in workers:
+                worker.sync(now)
+    # A burst of 60 plus 60 refilled; each worker may overshoot by one sync interval
+    assert 120 <= allowed <= 120 + 4 * 5 * 5
+
@@ -0,0 +1,116 @@
+import threading
+import time
+from datetime import datetime
+import pytest
+from sqlalchemy import select
+from app.database import engine
+from app.dedup import SeenIndex
+from app.models import ScanLog
+from app.scan_pipeline import ScanPipeline
+
+
+def test_submit_without_blocking_drops_when_full():
+    pipeline = ScanPipeline(maxsize=1, batch_size=10, flush_interval=60, put_timeout=5)
+    assert pipeline.submit({"n": 1}, block=False)
+    start = time.monotonic()
+    assert not pipeline.submit({"n": 2}, block=False)
+    assert time.monotonic() - start < 0.5
+    assert pipeline.stats["overflow"] == 1 and pipeline.stats["dropped"] == 1
+
+
+@pytest.fixture
+def qr_id(client, auth):
+    return client.post("/api/qrcodes/", json={"name": "pipeline", "location": "Lobby"}, headers=auth).json()["id"]
+
+
+def _rows(qr_id, n, prefix="203.0.113"):
+    return [{"qr_code_id": qr_id, "ip_address": f"{prefix}.{i}", "timestamp": datetime.utcnow()} for i in range(n)]
+
+
+def _written(qr_id):
+    with engine.connect() as conn:
+        return set(conn.execute(select(ScanLog.ip_address).where(ScanLog.qr_code_id == qr_id)).scalars())
+
+
+def _sizes(pipeline):
+    sizes = []
+
+    def stage(rows):
+        sizes.append(len(rows))
+        return rows
+    pipeline.add_stage(stage)
+    return sizes
+
+
+def test_batches_by_size_then_interval(qr_id):
+    pipeline = ScanPipeline(maxsize=100, batch_size=3, flush_interval=0.2, put_timeout=1)
+    sizes = _sizes(pipeline)
+    for row in _rows(qr_id, 7):
+        pipeline.submit(row)
+    pipeline.start()
+    deadline = time.monotonic() + 5
+    while pipeline.stats["written"] < 7 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    pipeline.stop()
+    assert sizes == [3, 3, 1]
+    assert len(_written(qr_id)) == 7
+    assert pipeline.stats["batches"] == 3
+
+
+def test_submit_blocks_then_drops_when_full():
+    pipeline = ScanPipeline(maxsize=1, batch_size=10, flush_interval=60, put_timeout=0.2)
+    assert pipeline.submit({"n": 1})
+    start = time.monotonic()
+    assert not pipeline.submit({"n": 2})
+    assert time.monotonic() - start >= 0.2
+    assert (pipeline.stats["enqueued"], pipeline.stats["overflow"], pipeline.stats["dropped"]) == (1, 1, 1)
+
+
+def test_submit_waits_for_room(qr_id):
+    pipeline = ScanPipeline(maxsize=1, batch_size=1, flush_interval=60, put_timeout=5)
+    rows = _rows(qr_id, 2)
+    assert pipeline.submit(rows[0])
+    threading.Timer(0.1, pipeline.start).start()
+    assert pipeline.submit(rows[1])
+    pipeline.stop()
+    assert pipeline.stats["overflow"] == 1 and pipeline.stats["dropped"] == 0
+    assert len(_written(qr_id)) == 2
+
+
+def test_stop_drains_the_queue(qr_id):
+    pipeline = ScanPipeline(maxsize=100, batch_size=4, flush_interval=60, put_timeout=1)
+    sizes = _sizes(pipeline)
+    pipeline.start()
+    for row in _rows(qr_id, 10):
+        pipeline.submit(row)
+    pipeline.stop()
+    assert sum(sizes) == 10
+    assert len(_written(qr_id)) == 10
+
+
+def test_failed_batch_is_rolled_back_and_forgotten(qr_id):
+    lookups = []
+
+    def lookup(db, qr, ip):
+        lookups.append(ip)
+        return False
+
+    def failing_hook(conn, written):
+        raise RuntimeError("rollup write failed")
+
+    index = SeenIndex(recent_size=100, capacity=1000, error_rate=0.01, lookup=lookup)
+    index.ready = True
+    pipeline = ScanPipeline(maxsize=100, batch_size=10, flush_interval=60, put_timeout=1)
+    pipeline.add_flush_hook(failing_hook)
+    pipeline.add_failure_listener(index.forget_scans)
+    rows = _rows(qr_id, 3)
+    for row in rows:
+        index.mark(row["qr_code_id"], row["ip_address"])
+        pipeline.submit(row)
+    pipeline.start()
+    pipeline.stop()
+    assert pipeline.stats["failed"] == 3
+    assert _written(qr_id) == set()
+    # Marked visitors are no longer remembered, so their next scan is checked again
+    assert not any(index.seen(row["qr_code_id"], row["ip_address"], None) for row in rows)
+    assert lookups == [row["ip_address"] for row in rows]
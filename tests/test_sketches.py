@@ -0,0 +1,52 @@
+import pytest
+from app.sketches import HyperLogLog, merge_all
+
+
+def _sketch(values, p=12):
+    hll = HyperLogLog(p)
+    for value in values:
+        hll.add(value)
+    return hll
+
+
+def test_sparse_until_a_quarter_of_registers_are_set():
+    hll = _sketch(f"10.0.0.{i}" for i in range(50))
+    assert hll.sparse is not None and hll.registers is None
+    hll = _sketch(f"10.0.{i // 256}.{i % 256}" for i in range(5000))
+    assert hll.sparse is None and len(hll.registers) == hll.m
+
+
+@pytest.mark.parametrize("n", [0, 1, 100, 1000, 20000])
+def test_count_is_close(n):
+    assert abs(_sketch(f"ip-{i}" for i in range(n)).count() - n) <= max(2, n * 0.05)
+
+
+def test_repeats_do_not_count():
+    assert _sketch(["1.1.1.1"] * 100).count() == 1
+
+
+@pytest.mark.parametrize("sizes", [(10, 20), (10, 5000), (5000, 10), (5000, 8000)])
+def test_merge_matches_union(sizes):
+    a = [f"a-{i}" for i in range(sizes[0])]
+    b = [f"b-{i}" for i in range(sizes[1])]
+    merged = _sketch(a).merge(_sketch(b))
+    union = _sketch(a + b)
+    assert merged.count() == union.count()
+    assert (merged.sparse, merged.registers) == (union.sparse, union.registers)
+
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
+
+
+@pytest.mark.parametrize("n", [0, 30, 5000])
+def test_bytes_round_trip(n):
+    hll = _sketch(f"ip-{i}" for i in range(n))
+    copy = HyperLogLog.from_bytes(hll.to_bytes())
+    assert (copy.p, copy.sparse, copy.registers) == (hll.p, hll.sparse, hll.registers)
+
+
+def test_merge_all():
+    blobs = [_sketch(f"{day}-{i}" for i in range(100)).to_bytes() for day in range(10)]
+    assert abs(merge_all(blobs).count() - 1000) <= 50
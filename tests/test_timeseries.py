@@ -0,0 +1,102 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import insert
+from app import rollups
+from app.database import engine
+from app.models import ScanLog
+
+
+@pytest.fixture
+def make_qr(client, auth):
+    def make(*timestamps):
+        # Scans at naive UTC times, one visitor each
+        qr_id = client.post("/api/qrcodes/", json={"name": "series", "location": "Lobby"}, headers=auth).json()["id"]
+        if timestamps:
+            with engine.begin() as conn:
+                conn.execute(insert(ScanLog), [
+                    {"qr_code_id": qr_id, "ip_address": f"192.0.2.{i}", "timestamp": datetime.fromisoformat(ts)}
+                    for i, ts in enumerate(timestamps)
+                ])
+            rollups.rebuild(qr_id)
+        return qr_id
+    return make
+
+
+def series(client, auth, qr_ids, **params):
+    resp = client.get("/api/analytics/timeseries", params={"qr_ids": qr_ids, **params}, headers=auth)
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def test_hours_across_spring_forward(client, auth, make_qr):
+    # 02:00 doesn't exist in New York on 2026-03-08
+    qr_id = make_qr("2026-03-08 05:30", "2026-03-08 06:59", "2026-03-08 07:00", "2026-03-08 07:30",
+                    "2026-03-08 08:10")
+    body = series(client, auth, [qr_id], granularity="hour", tz="America/New_York",
+                  start_date="2026-03-08T00:00", end_date="2026-03-08T04:00")
+    assert body["buckets"] == ["2026-03-08T00:00:00-05:00", "2026-03-08T01:00:00-05:00",
+                               "2026-03-08T03:00:00-04:00", "2026-03-08T04:00:00-04:00"]
+    assert body["series"][0]["counts"] == [1, 1, 2, 1]
+
+
+def test_hours_across_fall_back(client, auth, make_qr):
+    # 01:00 happens twice in New York on 2026-11-01
+    qr_id = make_qr("2026-11-01 05:30", "2026-11-01 06:30")
+    body = series(client, auth, [qr_id], granularity="hour", tz="America/New_York",
+                  start_date="2026-11-01T00:00", end_date="2026-11-01T03:00")
+    assert body["buckets"] == ["2026-11-01T00:00:00-04:00", "2026-11-01T01:00:00-04:00",
+                               "2026-11-01T01:00:00-05:00", "2026-11-01T02:00:00-05:00",
+                               "2026-11-01T03:00:00-05:00"]
+    assert body["series"][0]["counts"] == [0, 1, 1, 0, 0]
+
+
+def test_days_across_spring_forward(client, auth, make_qr):
+    # 2026-03-08 is 23 hours long in New York
+    qr_id = make_qr("2026-03-08 04:30", "2026-03-08 05:00", "2026-03-09 03:30", "2026-03-09 04:30")
+    body = series(client, auth, [qr_id], granularity="day", tz="America/New_York",
+                  start_date="2026-03-07T00:00", end_date="2026-03-09T12:00")
+    assert body["buckets"] == ["2026-03-07T00:00:00-05:00", "2026-03-08T00:00:00-05:00",
+                               "2026-03-09T00:00:00-04:00"]
+    assert body["series"][0]["counts"] == [1, 2, 1]
+
+
+def test_weeks_and_months_in_half_hour_zone(client, auth, make_qr):
+    # Asia/Kolkata is UTC+05:30, so its midnights are at hh:30 UTC
+    qr_id = make_qr("2026-01-31 18:29", "2026-01-31 18:31", "2026-02-08 18:29", "2026-02-08 18:31",
+                    "2026-03-01 00:00")
+    months = series(client, auth, [qr_id], granularity="month", tz="Asia/Kolkata",
+                    start_date="2026-01-15T00:00", end_date="2026-03-10T00:00")
+    assert months["buckets"] == ["2026-01-01T00:00:00+05:30", "2026-02-01T00:00:00+05:30",
+                                 "2026-03-01T00:00:00+05:30"]
+    assert months["series"][0]["counts"] == [1, 3, 1]
+    weeks = series(client, auth, [qr_id], granularity="week", tz="Asia/Kolkata",
+                   start_date="2026-02-04T00:00", end_date="2026-02-15T00:00")
+    assert weeks["buckets"] == ["2026-02-02T00:00:00+05:30", "2026-02-09T00:00:00+05:30"]
+    assert weeks["series"][0]["counts"] == [1, 1]
+
+
+def test_utc_days_from_rollups_with_comparison(client, auth, make_qr):
+    first = make_qr("2026-05-01 00:00", "2026-05-01 23:59", "2026-05-03 12:00")
+    second = make_qr("2026-05-02 08:00")
+    empty = make_qr()
+    body = series(client, auth, [first, second, empty], granularity="day",
+                  start_date="2026-05-01T00:00", end_date="2026-05-03T00:00")
+    assert body["buckets"] == ["2026-05-01T00:00:00+00:00", "2026-05-02T00:00:00+00:00",
+                               "2026-05-03T00:00:00+00:00"]
+    assert [s["counts"] for s in body["series"]] == [[2, 0, 1], [0, 1, 0], [0, 0, 0]]
+    assert [s["total"] for s in body["series"]] == [3, 1, 0]
+    assert [s["share"] for s in body["series"]] == [0.75, 0.25, 0.0]
+    assert [s["peak"] for s in body["series"]] == ["2026-05-01T00:00:00+00:00", "2026-05-02T00:00:00+00:00", None]
+    assert body["totals"] == [2, 1, 1]
+
+
+@pytest.mark.parametrize("params, status", [
+    ({"tz": "Mars/Olympus_Mons"}, 400),
+    ({"granularity": "minute"}, 422),
+    ({"start_date": "2026-02-01T00:00", "end_date": "2026-01-01T00:00"}, 400),
+    ({"granularity": "hour", "start_date": "2020-01-01T00:00", "end_date": "2026-01-01T00:00"}, 400),
+])
+def test_invalid_requests(client, auth, make_qr, params, status):
+    qr_id = make_qr()
+    resp = client.get("/api/analytics/timeseries", params={"qr_ids": [qr_id], **params}, headers=auth)
+    assert resp.status_code == status, resp.text